@@ -0,0 +1,59 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Point = Tuple[float, float]
+BBox = Tuple[float, float, float, float]
+
+# Children are keyed by (admin_level, parent_id). Level 9 areas hang off their
+# city; level 10 areas hang off the level 9 area containing their centroid, or
+# off the city when no level 9 area does.
+AreaChildren = Dict[Tuple[str, str], List[dict]]
+Covers = Callable[[dict, Point], bool]
+
+
+def bbox_contains(bbox: BBox, point: Point) -> bool:
+    return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
+
+
+def find_container(
+    areas: Iterable[dict], point: Point, covers: Covers
+) -> Optional[dict]:
+    for area in areas:
+        if bbox_contains(area["bbox"], point) and covers(area, point):
+            return area
+    return None
+
+
+def build_area_hierarchy(areas: List[dict], covers: Covers) -> AreaChildren:
+    children: AreaChildren = {}
+    level10 = []
+    for area in areas:
+        if not area.get("city_id"):
+            continue
+        if area["admin_level"] == "9":
+            children.setdefault(("9", area["city_id"]), []).append(area)
+        elif area["admin_level"] == "10":
+            level10.append(area)
+    for area in level10:
+        parent = find_container(
+            children.get(("9", area["city_id"]), []), area["centroid"], covers
+        )
+        area["area9_id"] = parent["id"] if parent else None
+        children.setdefault(("10", area["area9_id"] or area["city_id"]), []).append(area)
+    return children
+
+
+def resolve_area_chain(
+    children: AreaChildren, city_id: Optional[str], point: Point, covers: Covers
+) -> Tuple[Optional[str], Optional[str]]:
+    if not city_id:
+        return None, None
+    area9 = find_container(children.get(("9", city_id), []), point, covers)
+    area10 = None
+    if area9 is not None:
+        area10 = find_container(children.get(("10", area9["id"]), []), point, covers)
+    if area10 is None:
+        area10 = find_container(children.get(("10", city_id), []), point, covers)
+    return (
+        area9["id"] if area9 is not None else None,
+        area10["id"] if area10 is not None else None,
+    )
@@ -0,0 +1,241 @@
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from output_manifest import write_json_output
+
+Point = Tuple[float, float]
+QPoint = Tuple[int, int]
+RingGroups = List[List[List[Point]]]
+
+# Coordinates are snapped to 1e-7 degrees (OSM precision) so shared borders
+# produce identical vertices.
+QUANT = 10_000_000
+
+
+def quantize_ring(ring: Sequence[Point]) -> List[QPoint]:
+    out: List[QPoint] = []
+    for x, y in ring:
+        q = (round(x * QUANT), round(y * QUANT))
+        if not out or out[-1] != q:
+            out.append(q)
+    if len(out) > 1 and out[0] == out[-1]:
+        out.pop()
+    return out
+
+
+def split_ring(ring: List[QPoint], junctions: set) -> List[List[QPoint]]:
+    cuts = [i for i, pt in enumerate(ring) if pt in junctions]
+    if not cuts:
+        # No junction: cut at the smallest vertex so every ring sharing this
+        # loop splits it at the same place.
+        start = ring.index(min(ring))
+        rotated = ring[start:] + ring[:start]
+        return [rotated + [rotated[0]]]
+    start = cuts[0]
+    rotated = ring[start:] + ring[:start]
+    offsets = [i - start for i in cuts] + [len(ring)]
+    rotated.append(rotated[0])
+    return [rotated[a : b + 1] for a, b in zip(offsets, offsets[1:])]
+
+
+def build_topology(
+    layers: Dict[str, List[Tuple[str, dict, RingGroups]]]
+) -> Tuple[List[List[QPoint]], Dict[str, List[dict]]]:
+    quantized: Dict[str, List[Tuple[str, dict, List[List[List[QPoint]]]]]] = {}
+    counts: Counter = Counter()
+    for layer, features in layers.items():
+        items = []
+        for feature_id, props, groups in features:
+            q_groups = []
+            for group in groups:
+                rings = [quantize_ring(ring) for ring in group]
+                rings = [ring for ring in rings if len(ring) >= 3]
+                if rings:
+                    q_groups.append(rings)
+                    for ring in rings:
+                        counts.update(ring)
+            if q_groups:
+                items.append((feature_id, props, q_groups))
+        quantized[layer] = items
+
+    # A shared vertex is a junction when its rings don't all continue to the
+    # same two neighbours (start/end of a shared border, or touching corners).
+    neighbours: Dict[QPoint, set] = {}
+    for items in quantized.values():
+        for _, _, groups in items:
+            for rings in groups:
+                for ring in rings:
+                    n = len(ring)
+                    for i, pt in enumerate(ring):
+                        if counts[pt] > 1:
+                            nb = neighbours.setdefault(pt, set())
+                            nb.add(ring[i - 1])
+                            nb.add(ring[(i + 1) % n])
+    junctions = {pt for pt, nb in neighbours.items() if len(nb) != 2}
+
+    arcs: List[List[QPoint]] = []
+    arc_ids: Dict[Tuple[QPoint, ...], int] = {}
+    objects: Dict[str, List[dict]] = {}
+    for layer, items in quantized.items():
+        out = []
+        for feature_id, props, groups in items:
+            ref_groups = []
+            for rings in groups:
+                ref_rings = []
+                for ring in rings:
+                    refs = []
+                    for arc in split_ring(ring, junctions):
+                        fwd = tuple(arc)
+                        rev = fwd[::-1]
+                        key = min(fwd, rev)
+                        arc_index = arc_ids.get(key)
+                        if arc_index is None:
+                            arc_index = len(arcs)
+                            arc_ids[key] = arc_index
+                            arcs.append(list(key))
+                        refs.append(arc_index if key == fwd else ~arc_index)
+                    ref_rings.append(refs)
+                ref_groups.append(ref_rings)
+            out.append({"id": feature_id, "properties": props, "arcs": ref_groups})
+        objects[layer] = out
+    return arcs, objects
+
+
+def simplify_arc(points: List[QPoint], tolerance: float) -> List[QPoint]:
+    n = len(points)
+    if tolerance <= 0 or n <= 2:
+        return list(points)
+    if points[0] == points[-1]:
+        if n <= 4:
+            return list(points)
+        x0, y0 = points[0]
+        far = max(
+            range(1, n - 1),
+            key=lambda i: (points[i][0] - x0) ** 2 + (points[i][1] - y0) ** 2,
+        )
+        head = simplify_arc(points[: far + 1], tolerance)
+        tail = simplify_arc(points[far:], tolerance)
+        return head + tail[1:]
+    # Iterative Douglas-Peucker; arc endpoints are always kept.
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        (x1, y1), (x2, y2) = points[i], points[j]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        best = -1
+        best_d = tol2
+        for k in range(i + 1, j):
+            px, py = points[k]
+            if seg2 == 0:
+                d = (px - x1) ** 2 + (py - y1) ** 2
+            else:
+                t = ((px - x1) * dx + (py - y1) * dy) / seg2
+                t = 0.0 if t < 0 else 1.0 if t > 1 else t
+                ex = x1 + t * dx - px
+                ey = y1 + t * dy - py
+                d = ex * ex + ey * ey
+            if d > best_d:
+                best_d = d
+                best = k
+        if best >= 0:
+            keep[best] = True
+            stack.append((i, best))
+            stack.append((best, j))
+    return [pt for pt, k in zip(points, keep) if k]
+
+
+def ring_points(refs: List[int], arcs: List[List[QPoint]]) -> List[QPoint]:
+    pts: List[QPoint] = []
+    for ref in refs:
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        pts.extend(arc if not pts else arc[1:])
+    return pts
+
+
+def encode_topojson(
+    arcs: List[List[QPoint]], objects: Dict[str, List[dict]], tolerance: float
+) -> dict:
+    step = max(1, int(tolerance * QUANT / 4))
+    simplified = [
+        [(round(x / step), round(y / step)) for x, y in simplify_arc(arc, tolerance * QUANT)]
+        for arc in arcs
+    ]
+
+    used: Dict[int, int] = {}
+    out_objects = {}
+    for layer, features in objects.items():
+        geometries = []
+        for feature in features:
+            polygons = []
+            for rings in feature["arcs"]:
+                kept = [refs for refs in rings if len(set(ring_points(refs, simplified))) >= 3]
+                # Rings collapsed below the tolerance are dropped; a polygon
+                # whose shell collapsed goes with it.
+                if not kept or kept[0] is not rings[0]:
+                    continue
+                polygons.append(kept)
+            if not polygons:
+                continue
+            remapped = []
+            for rings in polygons:
+                new_rings = []
+                for refs in rings:
+                    new_refs = []
+                    for ref in refs:
+                        index = ref if ref >= 0 else ~ref
+                        new_index = used.setdefault(index, len(used))
+                        new_refs.append(new_index if ref >= 0 else ~new_index)
+                    new_rings.append(new_refs)
+                remapped.append(new_rings)
+            geometry = {"id": feature["id"], "properties": feature["properties"]}
+            if len(remapped) == 1:
+                geometry.update({"type": "Polygon", "arcs": remapped[0]})
+            else:
+                geometry.update({"type": "MultiPolygon", "arcs": remapped})
+            geometries.append(geometry)
+        out_objects[layer] = {"type": "GeometryCollection", "geometries": geometries}
+
+    ordered = sorted(used, key=used.get)
+    min_x = min((x for i in ordered for x, _ in simplified[i]), default=0)
+    min_y = min((y for i in ordered for _, y in simplified[i]), default=0)
+    out_arcs = []
+    for index in ordered:
+        arc = simplified[index]
+        # Delta-encode positions against the previous one (TopoJSON style).
+        encoded = [[arc[0][0] - min_x, arc[0][1] - min_y]]
+        prev = arc[0]
+        for pt in arc[1:]:
+            if pt == prev:
+                continue
+            encoded.append([pt[0] - prev[0], pt[1] - prev[1]])
+            prev = pt
+        if len(encoded) < 2:
+            encoded.append([0, 0])
+        out_arcs.append(encoded)
+
+    scale = step / QUANT
+    return {
+        "type": "Topology",
+        "transform": {"scale": [scale, scale], "translate": [min_x * scale, min_y * scale]},
+        "objects": out_objects,
+        "arcs": out_arcs,
+    }
+
+
+def write_boundaries(
+    out_dir: Path,
+    layers: Dict[str, List[Tuple[str, dict, RingGroups]]],
+    tolerances: List[float],
+) -> List[Tuple[Path, bool]]:
+    arcs, objects = build_topology(layers)
+    written = []
+    for tolerance in tolerances:
+        topology = encode_topojson(arcs, objects, tolerance)
+        path = out_dir / f"boundaries_{tolerance:g}.topojson"
+        written.append((path, write_json_output(path, topology, indent=None)))
+    return written
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from build_neighbours import haversine_km
+from export_profile import add_profile_arguments, load_export, profile_from_args
+from normalize_areas import normalize_name
+from output_manifest import canonical_grouped, describe_write, grouped_hashes, write_json_output
+
+NAME_FIELDS = ("name", "name_es", "name_eu")
+
+
+def name_keys(entry: dict) -> Set[str]:
+    keys = set()
+    for field in NAME_FIELDS:
+        value = entry.get(field)
+        if value:
+            key = normalize_name(value)
+            if key:
+                keys.add(key)
+    return keys
+
+
+def centroid_km(a: dict, b: dict) -> float:
+    return haversine_km(
+        a["centroid"]["lon"], a["centroid"]["lat"], b["centroid"]["lon"], b["centroid"]["lat"]
+    )
+
+
+def match_city(
+    areas: List[dict], places: List[dict], max_km: float
+) -> List[Tuple[int, int, float]]:
+    # Blocking: only an area and a place sharing a normalized name (any of
+    # name / name:es / name:eu) are ever compared. Pairs are then taken
+    # closest first, each entry used once.
+    blocks: Dict[str, Tuple[List[int], List[int]]] = {}
+    for i, area in enumerate(areas):
+        for key in name_keys(area):
+            blocks.setdefault(key, ([], []))[0].append(i)
+    for j, place in enumerate(places):
+        for key in name_keys(place):
+            blocks.setdefault(key, ([], []))[1].append(j)
+
+    pairs: Set[Tuple[int, int]] = set()
+    for area_idx, place_idx in blocks.values():
+        for i in area_idx:
+            for j in place_idx:
+                pairs.add((i, j))
+    scored = []
+    for i, j in pairs:
+        dist = centroid_km(areas[i], places[j])
+        if dist <= max_km:
+            scored.append((dist, areas[i]["id"], places[j]["id"], i, j))
+    scored.sort()
+
+    matched: List[Tuple[int, int, float]] = []
+    used_areas: Set[int] = set()
+    used_places: Set[int] = set()
+    for dist, _, _, i, j in scored:
+        if i in used_areas or j in used_places:
+            continue
+        used_areas.add(i)
+        used_places.add(j)
+        matched.append((i, j, dist))
+    return matched
+
+
+def first_value(key: str, *entries: Optional[dict]):
+    for entry in entries:
+        if entry is not None and entry.get(key) is not None:
+            return entry[key]
+    return None
+
+
+def gazetteer_record(
+    city_id: str, area: Optional[dict], place: Optional[dict], dist: Optional[float]
+) -> dict:
+    # Places keep their ids (they are what city_places already holds) and
+    # their names/tags; boundaries give the geometry, since a place is often
+    # just a node while the area carries the real extent.
+    geometry = area if area is not None else place
+    own9 = area["id"] if area is not None and area.get("admin_level") == "9" else None
+    own10 = area["id"] if area is not None and area.get("admin_level") == "10" else None
+    record = {
+        "id": place["id"] if place is not None else area["id"],
+        "city_id": city_id,
+        "name": first_value("name", place, area),
+        "name_es": first_value("name_es", place),
+        "name_eu": first_value("name_eu", place),
+        "place": first_value("place", place, area),
+        "admin_level": first_value("admin_level", area, place),
+        "ref_ine": first_value("ref_ine", place),
+        "wikidata": first_value("wikidata", area, place),
+        "wikipedia": first_value("wikipedia", area, place),
+        "population": first_value("population", place),
+        "population_date": first_value("population_date", place),
+        "bbox": geometry["bbox"],
+        "centroid": geometry["centroid"],
+        "area9_id": first_value("area9_id", place) or own9,
+        "area10_id": first_value("area10_id", place) or own10,
+        "area_id": area["id"] if area is not None else None,
+        "place_id": place["id"] if place is not None else None,
+        "sources": [s for s, e in (("area", area), ("place", place)) if e is not None],
+        "match_km": round(dist, 3) if dist is not None else None,
+    }
+    for key in ("geohash", "bbox_geohash"):
+        if key in geometry:
+            record[key] = geometry[key]
+    return record
+
+
+def build_gazetteer(
+    areas_by_city: Dict[str, List[dict]],
+    places_by_city: Dict[str, List[dict]],
+    max_km: float,
+) -> Tuple[Dict[str, List[dict]], int]:
+    gazetteer: Dict[str, List[dict]] = {}
+    total_matched = 0
+    for city_id in set(areas_by_city) | set(places_by_city):
+        areas = areas_by_city.get(city_id)
+        places = places_by_city.get(city_id)
+        areas = areas if isinstance(areas, list) else []
+        places = places if isinstance(places, list) else []
+        matched = match_city(areas, places, max_km)
+        total_matched += len(matched)
+        area_pair = {i: (j, dist) for i, j, dist in matched}
+        paired_places = {j for _, j, _ in matched}
+        records = []
+        for i, area in enumerate(areas):
+            if i in area_pair:
+                j, dist = area_pair[i]
+                records.append(gazetteer_record(city_id, area, places[j], dist))
+            else:
+                records.append(gazetteer_record(city_id, area, None, None))
+        for j, place in enumerate(places):
+            if j not in paired_places:
+                records.append(gazetteer_record(city_id, None, place, None))
+        records.sort(key=lambda r: ((r["name"] or "").lower(), r["id"]))
+        if records:
+            gazetteer[city_id] = records
+    return canonical_grouped(gazetteer), total_matched
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--areas",
+        default="data/exports/areas_by_city.json",
+        help="Input areas_by_city JSON (admin levels 9/10)",
+    )
+    parser.add_argument(
+        "--places",
+        default="data/exports/places_by_city.best.json",
+        help="Input places_by_city JSON",
+    )
+    parser.add_argument(
+        "--out",
+        default="data/exports/gazetteer_by_city.json",
+        help="Output gazetteer JSON (grouped by city)",
+    )
+    parser.add_argument(
+        "--max-distance-km",
+        type=float,
+        default=1.5,
+        help="Largest centroid distance at which a same-name area and place merge",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    repo_root = Path(__file__).resolve().parent.parent
+    areas_path = (repo_root / args.areas).resolve()
+    places_path = (repo_root / args.places).resolve()
+    out_path = (repo_root / args.out).resolve()
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    areas_by_city = load_export(areas_path)
+    places_by_city = load_export(places_path)
+    gazetteer, matched = build_gazetteer(areas_by_city, places_by_city, args.max_distance_km)
+
+    profile = profile_from_args(args)
+    gazetteer = {city_id: profile.entries(items) for city_id, items in gazetteer.items()}
+    written = write_json_output(
+        out_path, gazetteer, indent=profile.indent, groups=grouped_hashes(gazetteer)
+    )
+
+    total = sum(len(items) for items in gazetteer.values())
+    total_areas = sum(len(v) for v in areas_by_city.values() if isinstance(v, list))
+    total_places = sum(len(v) for v in places_by_city.values() if isinstance(v, list))
+    print(f"Input areas: {total_areas}")
+    print(f"Input places: {total_places}")
+    print(f"Merged area/place pairs: {matched}")
+    print(f"{describe_write(out_path, written)} ({total} gazetteer entries)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
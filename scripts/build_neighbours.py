@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from boundary_topology import QUANT, RingGroups, quantize_ring
+from export_profile import load_export
+from extract_geojson import build_cities, city_key, is_city_boundary, load_geojson
+from geometry_backends import get_backend
+from osm_pbf import is_pbf
+from output_manifest import write_json_output
+from region_clip import add_region_arguments, plan_clip, region_from_args
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def load_json(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def haversine_km(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def nearest_places(
+    places: List[dict], k: int, radius_km: float, ids: Optional[Set[str]] = None
+) -> Dict[str, List[dict]]:
+    # Square grid cells one search radius tall; the longitude span a radius
+    # covers grows with latitude, so the column range widens per point.
+    # With ids, only those places get lists (still drawn from all places).
+    cell = radius_km / KM_PER_DEGREE
+    grid: Dict[Tuple[int, int], List[int]] = {}
+    coords = []
+    for i, place in enumerate(places):
+        lon, lat = place["centroid"]["lon"], place["centroid"]["lat"]
+        coords.append((lon, lat))
+        grid.setdefault((math.floor(lat / cell), math.floor(lon / cell)), []).append(i)
+
+    out: Dict[str, List[dict]] = {}
+    for i, place in enumerate(places):
+        if ids is not None and place["id"] not in ids:
+            continue
+        lon, lat = coords[i]
+        row = math.floor(lat / cell)
+        col = math.floor(lon / cell)
+        # Near the poles the span could pass the whole circle; a full circle
+        # of columns already holds every cell of the row.
+        span = math.ceil(1.0 / max(math.cos(math.radians(abs(lat) + cell)), 1e-6))
+        span = min(span, math.ceil(360.0 / cell))
+        found = []
+        for r in range(row - 1, row + 2):
+            for c in range(col - span, col + span + 1):
+                for j in grid.get((r, c), ()):
+                    if j == i:
+                        continue
+                    dist = haversine_km(lon, lat, coords[j][0], coords[j][1])
+                    if dist <= radius_km:
+                        found.append((dist, places[j]["id"]))
+        found.sort()
+        out[place["id"]] = [
+            {"id": other_id, "distance_km": round(dist, 3)} for dist, other_id in found[:k]
+        ]
+    return out
+
+
+QBox = Tuple[int, int, int, int]
+QSegment = Tuple[int, int, int, int]
+# Vertices within this many quantization steps of a segment lie on it.
+TOUCH_STEPS = 1
+SEGMENT_BUCKETS = 32
+
+
+def quantized_rings(groups: RingGroups) -> List[List[Tuple[int, int]]]:
+    return [quantize_ring(ring) for rings in groups for ring in rings]
+
+
+def ring_box(rings: List[List[Tuple[int, int]]]) -> Optional[QBox]:
+    xs = [x for ring in rings for x, _ in ring]
+    ys = [y for ring in rings for _, y in ring]
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def boxes_touch(a: QBox, b: QBox) -> bool:
+    d = TOUCH_STEPS
+    return a[0] <= b[2] + d and b[0] <= a[2] + d and a[1] <= b[3] + d and b[1] <= a[3] + d
+
+
+def on_segment(x: int, y: int, seg: QSegment) -> bool:
+    # Integer test: within TOUCH_STEPS of the segment, between its ends.
+    x1, y1, x2, y2 = seg
+    dx, dy = x2 - x1, y2 - y1
+    sq_len = dx * dx + dy * dy
+    if sq_len == 0:
+        return abs(x - x1) <= TOUCH_STEPS and abs(y - y1) <= TOUCH_STEPS
+    cross = (x - x1) * dy - (y - y1) * dx
+    if cross * cross > TOUCH_STEPS * TOUCH_STEPS * sq_len:
+        return False
+    dot = (x - x1) * dx + (y - y1) * dy
+    return 0 <= dot <= sq_len
+
+
+class SegmentIndex:
+    # One city's boundary segments bucketed on a grid over its bbox.
+    def __init__(self, rings: List[List[Tuple[int, int]]], box: QBox) -> None:
+        self.box = box
+        extent = max(box[2] - box[0], box[3] - box[1])
+        self.step = max(1, extent // SEGMENT_BUCKETS)
+        self.buckets: Dict[Tuple[int, int], List[QSegment]] = {}
+        for ring in rings:
+            n = len(ring)
+            for i in range(n):
+                (x1, y1), (x2, y2) = ring[i], ring[(i + 1) % n]
+                seg = (x1, y1, x2, y2)
+                for key in self.cells(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)):
+                    self.buckets.setdefault(key, []).append(seg)
+
+    def cells(self, min_x: int, min_y: int, max_x: int, max_y: int):
+        d, step = TOUCH_STEPS, self.step
+        for cy in range((min_y - d) // step, (max_y + d) // step + 1):
+            for cx in range((min_x - d) // step, (max_x + d) // step + 1):
+                yield (cy, cx)
+
+    def touches(self, x: int, y: int) -> bool:
+        segs = self.buckets.get((y // self.step, x // self.step), ())
+        return any(on_segment(x, y, seg) for seg in segs)
+
+
+def adjacent_cities(geometries: Dict[str, RingGroups]) -> Dict[str, List[str]]:
+    # OSM municipal boundaries are built from shared ways, so touching cities
+    # usually share (snapped) vertices; one pass over all vertices finds
+    # those pairs. A city whose vertex meets the middle of another's edge (a
+    # T-junction) shares none with it, so pairs whose bboxes touch and share
+    # no vertex are confirmed with a segment test.
+    rings = {city_id: quantized_rings(groups) for city_id, groups in geometries.items()}
+    owners: Dict[Tuple[int, int], set] = {}
+    for city_id, city_rings in rings.items():
+        for ring in city_rings:
+            for pt in ring:
+                owners.setdefault(pt, set()).add(city_id)
+    neighbours: Dict[str, set] = {city_id: set() for city_id in geometries}
+    for ids in owners.values():
+        if len(ids) < 2:
+            continue
+        for city_id in ids:
+            neighbours[city_id].update(ids)
+
+    boxes = {city_id: box for city_id, box in ((c, ring_box(r)) for c, r in rings.items()) if box}
+    indexes: Dict[str, SegmentIndex] = {}
+
+    def vertex_on(a: str, b: str) -> bool:
+        # Does a vertex of a lie on an edge of b?
+        index = indexes.get(b)
+        if index is None:
+            index = indexes[b] = SegmentIndex(rings[b], boxes[b])
+        min_x, min_y, max_x, max_y = boxes[b]
+        d = TOUCH_STEPS
+        return any(
+            index.touches(x, y)
+            for ring in rings[a]
+            for x, y in ring
+            if min_x - d <= x <= max_x + d and min_y - d <= y <= max_y + d
+        )
+
+    for a, b in bbox_pairs(boxes):
+        if b in neighbours[a]:
+            continue
+        if vertex_on(a, b) or vertex_on(b, a):
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+    return {
+        city_id: sorted(ids - {city_id}) for city_id, ids in sorted(neighbours.items())
+    }
+
+
+def bbox_pairs(boxes: Dict[str, QBox]) -> List[Tuple[str, str]]:
+    # City pairs whose bboxes touch, found through a grid of cells about the
+    # size of the median bbox.
+    if not boxes:
+        return []
+    extents = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes.values())
+    step = max(1, extents[len(extents) // 2])
+    grid: Dict[Tuple[int, int], List[str]] = {}
+    d = TOUCH_STEPS
+    for city_id, (min_x, min_y, max_x, max_y) in sorted(boxes.items()):
+        for cy in range((min_y - d) // step, (max_y + d) // step + 1):
+            for cx in range((min_x - d) // step, (max_x + d) // step + 1):
+                grid.setdefault((cy, cx), []).append(city_id)
+    pairs = set()
+    for ids in grid.values():
+        for i, a in enumerate(ids):
+            for b in ids[i + 1 :]:
+                if boxes_touch(boxes[a], boxes[b]):
+                    pairs.add((a, b))
+    return sorted(pairs)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cities",
+        default="data/geojson/spain-cities-areas.geojson",
+        help="GeoJSON with admin_level=8 city polygons",
+    )
+    parser.add_argument(
+        "--places",
+        default="data/exports/places_by_city.best.json",
+        help="Input places_by_city JSON",
+    )
+    parser.add_argument(
+        "--out",
+        default="data/exports/neighbours.json",
+        help="Output neighbours JSON",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=8,
+        help="Nearest places to keep per place",
+    )
+    parser.add_argument(
+        "--radius-km",
+        type=float,
+        default=3.0,
+        help="Maximum distance in km between neighbouring places",
+    )
+    add_region_arguments(parser)
+    args = parser.parse_args()
+
+    repo_root = Path(__file__).resolve().parent.parent
+    cities_path = (repo_root / args.cities).resolve()
+    places_path = (repo_root / args.places).resolve()
+    out_path = (repo_root / args.out).resolve()
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    clip = None
+    region = region_from_args(args, parser)
+    if region is not None:
+        if is_pbf(cities_path):
+            parser.error(
+                "--bbox/--city-ids need a GeoJSON --cities (read through its feature index)"
+            )
+        # Adjacent cities share snapped vertices, so their bboxes are at
+        # most one quantization step apart.
+        clip = plan_clip(cities_path, region, 1 / QUANT, is_city_boundary, city_key)
+        print(clip.summary())
+
+    places_by_city = load_export(places_path)
+    places = [
+        item
+        for city_id, items in places_by_city.items()
+        if city_id != "_unassigned" and isinstance(items, list)
+        for item in items
+    ]
+    # Region places still find neighbours anywhere in --places; pass a full
+    # run's export for the lists of places near the region's edge to match.
+    ids = None
+    if clip is not None:
+        ids = {
+            item["id"]
+            for city_id, items in places_by_city.items()
+            if city_id in clip.city_ids and isinstance(items, list)
+            for item in items
+        }
+    places_by_city = None
+    place_neighbours = nearest_places(places, args.k, args.radius_km, ids)
+
+    if clip is not None:
+        city_data = clip.load(cities_path, keep=is_city_boundary, hints=(b'"administrative"',))
+    else:
+        city_data = load_geojson(cities_path)
+    geometries: Dict[str, RingGroups] = {}
+    build_cities(
+        city_data.get("features") or [],
+        get_backend("python"),
+        geometries=geometries,
+    )
+    city_data = None
+    city_neighbours = adjacent_cities(geometries)
+    if clip is not None:
+        city_neighbours = {
+            city_id: others
+            for city_id, others in city_neighbours.items()
+            if city_id in clip.city_ids
+        }
+
+    written = write_json_output(
+        out_path, {"places": place_neighbours, "cities": city_neighbours}
+    )
+
+    place_links = sum(len(v) for v in place_neighbours.values())
+    city_links = len(
+        {frozenset((city_id, other)) for city_id, v in city_neighbours.items() for other in v}
+    )
+    print(f"Place neighbour links: {place_links} ({len(place_neighbours)} places)")
+    print(f"Adjacent city pairs: {city_links} ({len(city_neighbours)} cities)")
+    print(f"{'Wrote' if written else 'Unchanged'}: {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
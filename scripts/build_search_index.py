@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from normalize_areas import normalize_name
+from output_manifest import entity_hashes, write_json_output
+
+
+def load_json(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def unique_items(items: List[str]) -> List[str]:
+    seen = set()
+    out = []
+    for item in items:
+        if item in seen:
+            continue
+        seen.add(item)
+        out.append(item)
+    return out
+
+
+def prefix_keys(norm: str, min_len: int, max_len: int) -> List[str]:
+    # Prefixes of the full name and of every word tail, so "estacion" also
+    # finds "la estacion".
+    keys = []
+    words = norm.split()
+    for start in range(len(words)):
+        tail = " ".join(words[start:])
+        for n in range(min_len, min(len(tail), max_len) + 1):
+            if tail[n - 1] != " ":
+                keys.append(f"p:{tail[:n]}")
+    return keys
+
+
+def trigram_keys(norm: str) -> List[str]:
+    keys = []
+    for word in norm.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            keys.append(f"t:{padded[i:i + 3]}")
+    return keys
+
+
+def search_entry(
+    kind: str,
+    entity_id: str,
+    city_id: Optional[str],
+    name: str,
+    min_prefix: int,
+    max_prefix: int,
+) -> Optional[dict]:
+    norm = normalize_name(name)
+    if not norm:
+        return None
+    return {
+        "kind": kind,
+        "id": entity_id,
+        "city_id": city_id,
+        "name": name,
+        "name_norm": norm,
+        "keys": unique_items(prefix_keys(norm, min_prefix, max_prefix) + trigram_keys(norm)),
+    }
+
+
+def build_search_index(
+    cities: List[dict],
+    places_by_city: Dict[str, List[dict]],
+    min_prefix: int = 2,
+    max_prefix: int = 12,
+) -> List[dict]:
+    entries: List[dict] = []
+    for city in cities:
+        entry = search_entry(
+            "city", city["id"], city["id"], city.get("name") or "", min_prefix, max_prefix
+        )
+        if entry:
+            entries.append(entry)
+    for city_id, items in places_by_city.items():
+        if city_id == "_unassigned":
+            continue
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            entry = search_entry(
+                "place", item["id"], city_id, item.get("name") or "", min_prefix, max_prefix
+            )
+            if entry:
+                entries.append(entry)
+    return entries
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cities",
+        default="data/exports/cities.filtered.json",
+        help="Input cities JSON",
+    )
+    parser.add_argument(
+        "--places",
+        default="data/exports/places_by_city.best.json",
+        help="Input places_by_city JSON",
+    )
+    parser.add_argument(
+        "--out",
+        default="data/exports/search_index.json",
+        help="Output search index JSON",
+    )
+    parser.add_argument(
+        "--min-prefix",
+        type=int,
+        default=2,
+        help="Shortest prefix key to emit",
+    )
+    parser.add_argument(
+        "--max-prefix",
+        type=int,
+        default=12,
+        help="Longest prefix key to emit (queries with a word of 3+ characters, "
+        "of any length, are matched through the trigram keys)",
+    )
+    args = parser.parse_args()
+
+    repo_root = Path(__file__).resolve().parent.parent
+    cities_path = (repo_root / args.cities).resolve()
+    places_path = (repo_root / args.places).resolve()
+    out_path = (repo_root / args.out).resolve()
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    cities = load_json(cities_path)
+    places_by_city = load_json(places_path)
+    entries = build_search_index(
+        cities, places_by_city, min_prefix=args.min_prefix, max_prefix=args.max_prefix
+    )
+
+    written = write_json_output(
+        out_path, entries, groups=entity_hashes(entries, key="city_id")
+    )
+
+    total_keys = sum(len(entry["keys"]) for entry in entries)
+    print(f"Search entries: {len(entries)}")
+    print(f"Search keys: {total_keys}")
+    print(f"{'Wrote' if written else 'Unchanged'}: {out_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
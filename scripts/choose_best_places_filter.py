@@ -6,6 +6,15 @@ import unicodedata
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+from export_profile import as_bbox
+from external_groups import ExternalGroups, iter_grouped
+from output_manifest import (
+    canonical_grouped,
+    grouped_hashes,
+    write_grouped_output,
+    write_json_output,
+)
+
 
 def normalize_name(value: str) -> str:
     value = value.strip().lower()
@@ -18,7 +27,8 @@ def normalize_name(value: str) -> str:
 
 
 def bbox_area(entry: dict) -> float:
-    bbox = entry.get("bbox") or {}
+    # Passes entries through untouched, so either export geometry form.
+    bbox = as_bbox(entry.get("bbox")) or {}
     try:
         return max(0.0, (bbox["max_lon"] - bbox["min_lon"]) * (bbox["max_lat"] - bbox["min_lat"]))
     except KeyError:
@@ -80,56 +90,102 @@ def choose_best_entry(entries: List[dict], weights: dict) -> dict:
     return max(entries, key=key)
 
 
+def entry_order(entry: dict) -> str:
+    return (entry.get("name") or "").lower()
+
+
+def choose_city_entries(entries: List[dict], weights: dict) -> List[dict]:
+    groups: Dict[str, List[dict]] = {}
+    for entry in entries:
+        name = entry.get("name") or ""
+        norm = normalize_name(name)
+        if not norm:
+            norm = f"__empty__{entry.get('id') or id(entry)}"
+        groups.setdefault(norm, []).append(entry)
+
+    chosen = [choose_best_entry(group, weights) for group in groups.values()]
+    chosen.sort(key=entry_order)
+    return chosen
+
+
 def apply_strategy(data: dict, weights: dict) -> Dict[str, List[dict]]:
     output: Dict[str, List[dict]] = {}
     for city_id, entries in data.items():
         if not isinstance(entries, list):
             continue
-        groups: Dict[str, List[dict]] = {}
-        for entry in entries:
-            name = entry.get("name") or ""
-            norm = normalize_name(name)
-            if not norm:
-                norm = f"__empty__{entry.get('id') or id(entry)}"
-            groups.setdefault(norm, []).append(entry)
-
-        chosen = [choose_best_entry(group, weights) for group in groups.values()]
-        chosen.sort(key=lambda item: (item.get("name") or "").lower())
-        output[city_id] = chosen
+        output[city_id] = choose_city_entries(entries, weights)
     return output
 
 
-def summarize(data: Dict[str, List[dict]]) -> dict:
-    total = 0
-    with_wikidata = 0
-    with_wikipedia = 0
-    with_admin_level = 0
-    with_polygon = 0
-    total_quality = 0.0
+def empty_metrics() -> dict:
+    return {
+        "total": 0,
+        "with_wikidata": 0,
+        "with_wikipedia": 0,
+        "with_admin_level": 0,
+        "with_polygon": 0,
+        "total_quality": 0.0,
+    }
+
 
+def add_metrics(metrics: dict, entries: List[dict]) -> None:
+    for entry in entries:
+        metrics["total"] += 1
+        if entry.get("wikidata"):
+            metrics["with_wikidata"] += 1
+        if entry.get("wikipedia"):
+            metrics["with_wikipedia"] += 1
+        if entry.get("admin_level"):
+            metrics["with_admin_level"] += 1
+        if bbox_area(entry) > 0:
+            metrics["with_polygon"] += 1
+        metrics["total_quality"] += quality_score(entry)
+
+
+def summarize(data: Dict[str, List[dict]]) -> dict:
+    metrics = empty_metrics()
     for entries in data.values():
+        if isinstance(entries, list):
+            add_metrics(metrics, entries)
+    return metrics
+
+
+def best_strategy(metrics_by_name: Dict[str, dict]) -> str:
+    def rank(name: str) -> Tuple[float, int, int, int, int]:
+        metrics = metrics_by_name[name]
+        return (
+            metrics["total_quality"],
+            metrics["with_wikidata"],
+            metrics["with_wikipedia"],
+            metrics["with_admin_level"],
+            metrics["with_polygon"],
+        )
+
+    return max(metrics_by_name, key=rank)
+
+
+def stream_best(input_path: Path, out_path: Path, budget: int) -> Tuple[str, dict, bool]:
+    # Two passes over the input, one city decoded at a time: the first scores
+    # every strategy, the second regroups the winner's entries through a
+    # bounded (disk-spilling) buffer.
+    metrics_by_name = {name: empty_metrics() for name in STRATEGIES}
+    for _, entries in iter_grouped(input_path):
         if not isinstance(entries, list):
             continue
-        for entry in entries:
-            total += 1
-            if entry.get("wikidata"):
-                with_wikidata += 1
-            if entry.get("wikipedia"):
-                with_wikipedia += 1
-            if entry.get("admin_level"):
-                with_admin_level += 1
-            if bbox_area(entry) > 0:
-                with_polygon += 1
-            total_quality += quality_score(entry)
+        for name, weights in STRATEGIES.items():
+            add_metrics(metrics_by_name[name], choose_city_entries(entries, weights))
+    best_name = best_strategy(metrics_by_name)
 
-    return {
-        "total": total,
-        "with_wikidata": with_wikidata,
-        "with_wikipedia": with_wikipedia,
-        "with_admin_level": with_admin_level,
-        "with_polygon": with_polygon,
-        "total_quality": total_quality,
-    }
+    grouper = ExternalGroups(budget)
+    for city_id, entries in iter_grouped(input_path):
+        if not isinstance(entries, list):
+            continue
+        grouper.touch(city_id)
+        for entry in choose_city_entries(entries, STRATEGIES[best_name]):
+            grouper.add(city_id, entry_order(entry), entry)
+    written = write_grouped_output(out_path, grouper.groups())
+    print(grouper.summary())
+    return best_name, metrics_by_name[best_name], written
 
 
 def main() -> int:
@@ -144,6 +200,13 @@ def main() -> int:
         default="data/exports/places_by_city.best.json",
         help="Output JSON for the best strategy",
     )
+    parser.add_argument(
+        "--group-budget",
+        type=int,
+        default=0,
+        help="Stream the input city by city, holding at most this many output entries "
+        "in memory and spilling sorted runs to temporary files (0 = load it whole)",
+    )
     args = parser.parse_args()
 
     repo_root = Path(__file__).resolve().parent.parent
@@ -151,34 +214,28 @@ def main() -> int:
     out_path = (repo_root / args.out).resolve()
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with input_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    # Evaluate multiple strategies and keep the best overall dataset.
-    results = {}
-    for name, weights in STRATEGIES.items():
-        filtered = apply_strategy(data, weights)
-        metrics = summarize(filtered)
-        results[name] = (metrics, filtered)
+    if args.group_budget > 0:
+        best_name, best_metrics, written = stream_best(input_path, out_path, args.group_budget)
+    else:
+        with input_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
 
-    def rank(item: Tuple[str, Tuple[dict, dict]]) -> Tuple[float, int, int, int, int]:
-        metrics = item[1][0]
-        return (
-            metrics["total_quality"],
-            metrics["with_wikidata"],
-            metrics["with_wikipedia"],
-            metrics["with_admin_level"],
-            metrics["with_polygon"],
-        )
+        # Evaluate multiple strategies and keep the best overall dataset.
+        results = {}
+        for name, weights in STRATEGIES.items():
+            filtered = apply_strategy(data, weights)
+            metrics = summarize(filtered)
+            results[name] = (metrics, filtered)
 
-    best_name, (best_metrics, best_data) = max(results.items(), key=rank)
+        best_name = best_strategy({name: metrics for name, (metrics, _) in results.items()})
+        best_metrics, best_data = results[best_name]
 
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(best_data, f, ensure_ascii=False, indent=2)
+        best_data = canonical_grouped(best_data)
+        written = write_json_output(out_path, best_data, groups=grouped_hashes(best_data))
 
     print("Best strategy:", best_name)
     print("Metrics:", best_metrics)
-    print("Wrote:", out_path)
+    print("Wrote:" if written else "Unchanged:", out_path)
     return 0
 
 
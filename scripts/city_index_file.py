@@ -0,0 +1,374 @@
+import bisect
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from city_lookup import city_ring_groups
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None
+
+Point = Tuple[float, float]
+
+MAGIC = b"HCIX"
+VERSION = 2
+# magic, version, cell_size, source size, source mtime_ns, then counts:
+# cities, groups, rings, points, cells, cell entries, string bytes.
+HEADER = struct.Struct("<4sIdqq7q")
+SECTIONS = (
+    ("bboxes", "d"),
+    ("centroids", "d"),
+    ("city_groups", "q"),
+    ("group_rings", "q"),
+    ("ring_points", "q"),
+    ("coords", "d"),
+    ("cell_keys", "Q"),
+    ("cell_offsets", "q"),
+    ("cell_cities", "i"),
+    ("string_offsets", "q"),
+    ("strings", "B"),
+)
+EDGE_EPS = 1e-9
+KEY_BIAS = 2**31
+# Cities with at least this many vertices are tested with numpy (below it
+# the per-call overhead outweighs the loop); EDGE_CACHE of their edge
+# arrays are kept.
+NUMPY_MIN_POINTS = 64
+EDGE_CACHE = 4096
+
+
+def cell_key(cy: int, cx: int) -> int:
+    return ((cy + KEY_BIAS) << 32) | (cx + KEY_BIAS)
+
+
+def source_stamp(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_city_index(
+    path: Path,
+    city_polygons: Dict[str, dict],
+    grid: Dict[Tuple[int, int], List[str]],
+    cell_size: float,
+    source: Tuple[int, int] = (0, 0),
+) -> None:
+    city_ids = list(city_polygons)
+    slots = {city_id: slot for slot, city_id in enumerate(city_ids)}
+    sections = {name: array(code) for name, code in SECTIONS}
+    sections["city_groups"].append(0)
+    sections["group_rings"].append(0)
+    sections["ring_points"].append(0)
+    for city_id in city_ids:
+        city_info = city_polygons[city_id]
+        sections["bboxes"].extend(city_info["bbox"])
+        sections["centroids"].extend(city_info["centroid"])
+        groups = city_ring_groups(city_info)
+        for group in groups:
+            for ring in group:
+                for lon, lat in ring:
+                    sections["coords"].extend((lon, lat))
+                sections["ring_points"].append(len(sections["coords"]) // 2)
+            sections["group_rings"].append(len(sections["ring_points"]) - 1)
+        sections["city_groups"].append(len(sections["group_rings"]) - 1)
+
+    cells = sorted(grid, key=lambda cell: cell_key(*cell))
+    sections["cell_offsets"].append(0)
+    for cell in cells:
+        sections["cell_keys"].append(cell_key(*cell))
+        sections["cell_cities"].extend(slots[city_id] for city_id in grid[cell])
+        sections["cell_offsets"].append(len(sections["cell_cities"]))
+
+    strings = bytearray()
+    sections["string_offsets"].append(0)
+    for value in city_ids + [city_polygons[c].get("name") or "" for c in city_ids]:
+        strings.extend(value.encode("utf-8"))
+        sections["string_offsets"].append(len(strings))
+    sections["strings"].frombytes(bytes(strings))
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        cell_size,
+        source[0],
+        source[1],
+        len(city_ids),
+        len(sections["group_rings"]) - 1,
+        len(sections["ring_points"]) - 1,
+        len(sections["coords"]) // 2,
+        len(cells),
+        len(sections["cell_cities"]),
+        len(strings),
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(header)
+        for name, _ in SECTIONS:
+            data = sections[name]
+            if sys.byteorder != "little" and data.itemsize > 1:
+                data.byteswap()
+            # Keep every section 8-byte aligned so it can be cast in place.
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(data.tobytes())
+    tmp_path.replace(path)
+
+
+class MappedGrid:
+    def __init__(self, index: "MappedCityIndex") -> None:
+        self.index = index
+
+    def get(self, cell: Tuple[int, int], default: Sequence[str] = ()) -> Sequence[str]:
+        keys = self.index.cell_keys
+        key = cell_key(*cell)
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return default
+        start, end = self.index.cell_offsets[i], self.index.cell_offsets[i + 1]
+        ids = self.index.city_ids
+        return [ids[slot] for slot in self.index.cell_cities[start:end]]
+
+
+class MappedCities(Mapping):
+    def __init__(self, index: "MappedCityIndex") -> None:
+        self.index = index
+        self.cache: Dict[int, dict] = {}
+
+    def __getitem__(self, city_id: str) -> dict:
+        slot = self.index.slots[city_id]
+        info = self.cache.get(slot)
+        if info is None:
+            info = self.cache[slot] = self.index.city_info(slot)
+        return info
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index.city_ids)
+
+    def __len__(self) -> int:
+        return self.index.n_cities
+
+
+class MappedCityIndex:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = path.open("rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mm)
+        (
+            magic,
+            version,
+            self.cell_size,
+            source_size,
+            source_mtime,
+            n_cities,
+            n_groups,
+            n_rings,
+            n_points,
+            n_cells,
+            n_entries,
+            n_string_bytes,
+        ) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a city index (version {VERSION})")
+        if sys.byteorder != "little":
+            raise ValueError("City index files can only be mapped on little-endian hosts")
+        self.source = (source_size, source_mtime)
+        lengths = {
+            "bboxes": n_cities * 4,
+            "centroids": n_cities * 2,
+            "city_groups": n_cities + 1,
+            "group_rings": n_groups + 1,
+            "ring_points": n_rings + 1,
+            "coords": n_points * 2,
+            "cell_keys": n_cells,
+            "cell_offsets": n_cells + 1,
+            "cell_cities": n_entries,
+            "string_offsets": n_cities * 2 + 1,
+            "strings": n_string_bytes,
+        }
+        offset = HEADER.size
+        for name, code in SECTIONS:
+            offset += -offset % 8
+            size = lengths[name] * struct.calcsize(code)
+            if offset + size > len(view):
+                raise ValueError(f"{path} is truncated (section {name})")
+            setattr(self, name, view[offset : offset + size].cast(code))
+            offset += size
+
+        self.n_cities = n_cities
+        self.grid = MappedGrid(self)
+        # Entries are built on first access; opening the index decodes nothing.
+        self.city_polygons = MappedCities(self)
+        self._edges: Dict[int, tuple] = {}
+
+    @cached_property
+    def city_ids(self) -> List[str]:
+        return [self.string(slot) for slot in range(self.n_cities)]
+
+    @cached_property
+    def slots(self) -> Dict[str, int]:
+        return {city_id: slot for slot, city_id in enumerate(self.city_ids)}
+
+    def city_info(self, slot: int) -> dict:
+        bbox = tuple(self.bboxes[slot * 4 : slot * 4 + 4])
+        return {
+            "name": self.string(self.n_cities + slot),
+            "bbox": bbox,
+            "centroid": tuple(self.centroids[slot * 2 : slot * 2 + 2]),
+            "bbox_area": (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]),
+            "index": self,
+            "slot": slot,
+        }
+
+    def string(self, i: int) -> str:
+        start, end = self.string_offsets[i], self.string_offsets[i + 1]
+        return bytes(self.strings[start:end]).decode("utf-8")
+
+    def ring_groups(self, slot: int) -> List[List[List[Point]]]:
+        groups = []
+        for g in range(self.city_groups[slot], self.city_groups[slot + 1]):
+            rings = []
+            for r in range(self.group_rings[g], self.group_rings[g + 1]):
+                flat = self.coords[self.ring_points[r] * 2 : self.ring_points[r + 1] * 2]
+                rings.append(list(zip(flat[0::2], flat[1::2])))
+            groups.append(rings)
+        return groups
+
+    def covers(self, city_id: str, point: Point) -> bool:
+        slot = self.slots[city_id]
+        min_lon, min_lat, max_lon, max_lat = self.bboxes[slot * 4 : slot * 4 + 4]
+        x, y = point
+        if (
+            x < min_lon - EDGE_EPS
+            or x > max_lon + EDGE_EPS
+            or y < min_lat - EDGE_EPS
+            or y > max_lat + EDGE_EPS
+        ):
+            return False
+        if HAS_NUMPY and self.point_count(slot) >= NUMPY_MIN_POINTS:
+            return self.covers_numpy(slot, x, y)
+        coords = self.coords
+        for g in range(self.city_groups[slot], self.city_groups[slot + 1]):
+            # Even-odd over shell and holes; points on any edge are covered.
+            inside = False
+            for r in range(self.group_rings[g], self.group_rings[g + 1]):
+                start, end = self.ring_points[r], self.ring_points[r + 1]
+                n = end - start
+                if n < 3:
+                    continue
+                for i in range(n):
+                    j = start + i
+                    k = start + (i + 1) % n
+                    x1, y1 = coords[2 * j], coords[2 * j + 1]
+                    x2, y2 = coords[2 * k], coords[2 * k + 1]
+                    if on_segment(x, y, x1, y1, x2, y2):
+                        return True
+                    if (y1 > y) != (y2 > y):
+                        if (x2 - x1) * (y - y1) / (y2 - y1) + x1 > x:
+                            inside = not inside
+            if inside:
+                return True
+        return False
+
+    def point_count(self, slot: int) -> int:
+        first = self.group_rings[self.city_groups[slot]]
+        last = self.group_rings[self.city_groups[slot + 1]]
+        return self.ring_points[last] - self.ring_points[first]
+
+    def covers_numpy(self, slot: int, x: float, y: float) -> bool:
+        # The loop above over every edge at once; same float operations, so
+        # the answers are identical.
+        x1, y1, x2, y2, sq_len, group, n_groups = self.edges(slot)
+        if not len(x1):
+            return False
+        dx = x2 - x1
+        dy = y2 - y1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cross = (y - y1) * dx - (x - x1) * dy
+            dot = (x - x1) * dx + (y - y1) * dy
+            on_edge = np.where(
+                sq_len == 0,
+                (np.abs(x - x1) <= EDGE_EPS) & (np.abs(y - y1) <= EDGE_EPS),
+                (np.abs(cross) <= EDGE_EPS) & (dot >= -EDGE_EPS) & (dot <= sq_len + EDGE_EPS),
+            )
+            if on_edge.any():
+                return True
+            straddles = (y1 > y) != (y2 > y)
+            hits = straddles & (dx * (y - y1) / (y2 - y1) + x1 > x)
+        crossings = np.bincount(group[hits], minlength=n_groups)
+        return bool((crossings % 2 == 1).any())
+
+    def edges(self, slot: int) -> tuple:
+        cached = self._edges.get(slot)
+        if cached is not None:
+            return cached
+        coords = np.frombuffer(self.coords, dtype="<f8").reshape(-1, 2)
+        starts: List[int] = []
+        ends: List[int] = []
+        groups: List[int] = []
+        first_group = self.city_groups[slot]
+        for g in range(first_group, self.city_groups[slot + 1]):
+            for r in range(self.group_rings[g], self.group_rings[g + 1]):
+                start, end = self.ring_points[r], self.ring_points[r + 1]
+                n = end - start
+                if n < 3:
+                    continue
+                starts.extend(range(start, end))
+                ends.extend(range(start + 1, end))
+                ends.append(start)
+                groups.extend([g - first_group] * n)
+        a = coords[starts]
+        b = coords[ends]
+        x1, y1, x2, y2 = a[:, 0].copy(), a[:, 1].copy(), b[:, 0].copy(), b[:, 1].copy()
+        # Squared lengths go through Python's float pow, as in on_segment.
+        sq_len = np.array(
+            [(bx - ax) ** 2 + (by - ay) ** 2 for ax, ay, bx, by in zip(x1, y1, x2, y2)],
+            dtype=np.float64,
+        )
+        n_groups = self.city_groups[slot + 1] - first_group
+        cached = (x1, y1, x2, y2, sq_len, np.array(groups, dtype=np.intp), n_groups)
+        if len(self._edges) >= EDGE_CACHE:
+            self._edges.clear()
+        self._edges[slot] = cached
+        return cached
+
+    def close(self) -> None:
+        self._edges.clear()
+        for name, _ in SECTIONS:
+            getattr(self, name).release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+
+def on_segment(x: float, y: float, x1: float, y1: float, x2: float, y2: float) -> bool:
+    sq_len = (x2 - x1) ** 2 + (y2 - y1) ** 2
+    if sq_len == 0:
+        return abs(x - x1) <= EDGE_EPS and abs(y - y1) <= EDGE_EPS
+    if abs((y - y1) * (x2 - x1) - (x - x1) * (y2 - y1)) > EDGE_EPS:
+        return False
+    dot = (x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)
+    return -EDGE_EPS <= dot <= sq_len + EDGE_EPS
+
+
+def open_city_index(path: Path, source: Optional[Path] = None) -> Optional[MappedCityIndex]:
+    if not path.exists():
+        return None
+    try:
+        index = MappedCityIndex(path)
+    except (ValueError, IndexError, TypeError, struct.error):
+        return None
+    if source is not None and source.exists() and index.source != source_stamp(source):
+        index.close()
+        return None
+    return index
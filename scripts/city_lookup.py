@@ -0,0 +1,251 @@
+import bisect
+import hashlib
+import json
+import math
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+Point = Tuple[float, float]
+
+# Cell codes stored in the table. Codes >= FIRST_CITY index into city_ids.
+EMPTY = 0
+BOUNDARY = 1
+FIRST_CITY = 2
+
+EDGE_EPS = 1e-9
+
+
+def polygon_ring_groups(geom: dict) -> List[List[List[Point]]]:
+    geom_type = geom.get("type")
+    coords = geom.get("coordinates")
+    if not coords:
+        return []
+    if geom_type == "Polygon":
+        polygons = [coords]
+    elif geom_type == "MultiPolygon":
+        polygons = coords
+    else:
+        return []
+    groups = []
+    for poly in polygons:
+        rings = [list(map(tuple, ring)) for ring in poly if ring]
+        if rings:
+            groups.append(rings)
+    return groups
+
+
+def city_ring_groups(city_info: dict) -> List[List[List[Point]]]:
+    # Shapely and mapped-index cities keep shell + holes per polygon; manual
+    # cities only keep outer rings, each treated as its own polygon (same as
+    # point_in_polygons).
+    if "ring_groups" in city_info:
+        return city_info["ring_groups"]
+    if "index" in city_info:
+        return city_info["index"].ring_groups(city_info["slot"])
+    return [[ring] for ring in city_info.get("rings") or []]
+
+
+def city_fingerprint(city_polygons: Dict[str, dict]) -> str:
+    # Hashes the rings the table is built from, so a table built from the
+    # shapely model (shells + holes) is never reused for the rings model
+    # (outer rings only) or vice versa.
+    digest = hashlib.sha1()
+    for city_id in sorted(city_polygons):
+        key = city_id.encode("utf-8")
+        groups = city_ring_groups(city_polygons[city_id])
+        digest.update(struct.pack("<II", len(key), len(groups)) + key)
+        for group in groups:
+            digest.update(struct.pack("<I", len(group)))
+            for ring in group:
+                coords = [c for point in ring for c in point]
+                digest.update(struct.pack(f"<I{len(coords)}d", len(ring), *coords))
+    return digest.hexdigest()
+
+
+def mark_edges(
+    ring: Sequence[Point],
+    cell_size: float,
+    boundary: Dict[int, Set[int]],
+    crossings: Dict[int, List[float]],
+) -> None:
+    n = len(ring)
+    if n < 3:
+        return
+    for i in range(n):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % n]
+        min_cx = int(math.floor((min(x1, x2) - EDGE_EPS) / cell_size))
+        max_cx = int(math.floor((max(x1, x2) + EDGE_EPS) / cell_size))
+        min_cy = int(math.floor((min(y1, y2) - EDGE_EPS) / cell_size))
+        max_cy = int(math.floor((max(y1, y2) + EDGE_EPS) / cell_size))
+        for cy in range(min_cy, max_cy + 1):
+            boundary.setdefault(cy, set()).update(range(min_cx, max_cx + 1))
+        if y1 == y2:
+            continue
+        # Same half-open rule as point_in_ring: crossing when lo <= y < hi.
+        lo, hi = min(y1, y2), max(y1, y2)
+        first = int(math.ceil(lo / cell_size - 0.5))
+        last = int(math.ceil(hi / cell_size - 0.5))
+        for cy in range(first - 1, last + 1):
+            yc = (cy + 0.5) * cell_size
+            if lo <= yc < hi:
+                x = (x2 - x1) * (yc - y1) / (y2 - y1) + x1
+                crossings.setdefault(cy, []).append(x)
+
+
+def inside_cells(crossings: Dict[int, List[float]], cell_size: float) -> Dict[int, Set[int]]:
+    inside: Dict[int, Set[int]] = {}
+    for cy, xs in crossings.items():
+        xs.sort()
+        row: Set[int] = set()
+        for k in range(0, len(xs) - 1, 2):
+            start = int(math.ceil(xs[k] / cell_size - 0.5))
+            end = int(math.ceil(xs[k + 1] / cell_size - 0.5))
+            row.update(range(start, end))
+        if row:
+            inside[cy] = row
+    return inside
+
+
+class InteriorLookup:
+    def __init__(
+        self,
+        cell_size: float,
+        city_ids: List[str],
+        runs: Dict[int, List[int]],
+        fingerprint: str,
+    ) -> None:
+        self.cell_size = cell_size
+        self.city_ids = city_ids
+        self.runs = runs
+        self.fingerprint = fingerprint
+        self.rows: Dict[int, Tuple[List[int], List[int], List[int]]] = {}
+        for cy, flat in runs.items():
+            self.rows[cy] = (flat[0::3], flat[1::3], flat[2::3])
+        self.interior_hits = 0
+        self.empty_hits = 0
+        self.misses = 0
+
+    def code_at(self, lon: float, lat: float) -> int:
+        row = self.rows.get(int(math.floor(lat / self.cell_size)))
+        if not row:
+            return EMPTY
+        starts, lengths, codes = row
+        cx = int(math.floor(lon / self.cell_size))
+        i = bisect.bisect_right(starts, cx) - 1
+        if i < 0 or cx >= starts[i] + lengths[i]:
+            return EMPTY
+        return codes[i]
+
+    def resolve(self, point: Point) -> Tuple[bool, Optional[str]]:
+        # (True, city_id) for interior cells, (True, None) for cells no city
+        # touches, (False, None) when the point needs a polygon test.
+        code = self.code_at(point[0], point[1])
+        if code == BOUNDARY:
+            self.misses += 1
+            return False, None
+        if code == EMPTY:
+            self.empty_hits += 1
+            return True, None
+        self.interior_hits += 1
+        return True, self.city_ids[code - FIRST_CITY]
+
+    def summary(self) -> str:
+        total = self.interior_hits + self.empty_hits + self.misses
+        answered = self.interior_hits + self.empty_hits
+        rate = (100.0 * answered / total) if total else 0.0
+        return (
+            f"Lookup table: {answered}/{total} answered ({rate:.1f}%), "
+            f"interior {self.interior_hits}, empty {self.empty_hits}, "
+            f"boundary {self.misses}"
+        )
+
+
+def build_interior_lookup(
+    city_polygons: Dict[str, dict], cell_size: float, fingerprint: Optional[str] = None
+) -> InteriorLookup:
+    city_ids = sorted(city_polygons)
+    table: Dict[int, Dict[int, int]] = {}
+    boundary: Dict[int, Set[int]] = {}
+    for index, city_id in enumerate(city_ids):
+        code = FIRST_CITY + index
+        city_boundary: Dict[int, Set[int]] = {}
+        city_inside: Dict[int, Set[int]] = {}
+        for group in city_ring_groups(city_polygons[city_id]):
+            # Shell and holes of one polygon share an even-odd scanline.
+            crossings: Dict[int, List[float]] = {}
+            for ring in group:
+                mark_edges(ring, cell_size, city_boundary, crossings)
+            for cy, row in inside_cells(crossings, cell_size).items():
+                city_inside.setdefault(cy, set()).update(row)
+        for cy, row in city_inside.items():
+            edge_row = city_boundary.get(cy, set())
+            table_row = table.setdefault(cy, {})
+            for cx in row:
+                if cx in edge_row:
+                    continue
+                # Overlapping interiors are ambiguous: leave them to the polygon test.
+                table_row[cx] = BOUNDARY if cx in table_row else code
+        for cy, row in city_boundary.items():
+            boundary.setdefault(cy, set()).update(row)
+
+    for cy, row in boundary.items():
+        table_row = table.setdefault(cy, {})
+        for cx in row:
+            table_row[cx] = BOUNDARY
+
+    runs: Dict[int, List[int]] = {}
+    for cy, table_row in table.items():
+        flat: List[int] = []
+        for cx in sorted(table_row):
+            code = table_row[cx]
+            if flat and flat[-3] + flat[-2] == cx and flat[-1] == code:
+                flat[-2] += 1
+            else:
+                flat.extend((cx, 1, code))
+        if flat:
+            runs[cy] = flat
+    if fingerprint is None:
+        fingerprint = city_fingerprint(city_polygons)
+    return InteriorLookup(cell_size, city_ids, runs, fingerprint)
+
+
+def save_lookup(lookup: InteriorLookup, path: Path) -> None:
+    payload = {
+        "cell_size": lookup.cell_size,
+        "fingerprint": lookup.fingerprint,
+        "city_ids": lookup.city_ids,
+        # Run-length encoded rows: [cy, cx0, len0, code0, cx1, len1, code1, ...]
+        "rows": [[cy] + lookup.runs[cy] for cy in sorted(lookup.runs)],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+
+
+def load_lookup(path: Path, fingerprint: str, cell_size: float) -> Optional[InteriorLookup]:
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        payload = json.load(f)
+    if payload.get("cell_size") != cell_size:
+        return None
+    if payload.get("fingerprint") != fingerprint:
+        return None
+    runs = {row[0]: row[1:] for row in payload.get("rows") or []}
+    return InteriorLookup(cell_size, payload["city_ids"], runs, fingerprint)
+
+
+def get_interior_lookup(
+    city_polygons: Dict[str, dict], cell_size: float, path: Optional[Path]
+) -> InteriorLookup:
+    fingerprint = city_fingerprint(city_polygons)
+    if path is not None:
+        lookup = load_lookup(path, fingerprint, cell_size)
+        if lookup is not None:
+            return lookup
+    lookup = build_interior_lookup(city_polygons, cell_size, fingerprint)
+    if path is not None:
+        save_lookup(lookup, path)
+    return lookup
@@ -0,0 +1,89 @@
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+from city_lookup import InteriorLookup
+from geometry_backends import Nearest
+from spatial_order import LastHitCache
+
+Point = Tuple[float, float]
+Grid = Dict[Tuple[int, int], List[str]]
+
+
+def unique_items(items: List[str]) -> List[str]:
+    seen = set()
+    out = []
+    for item in items:
+        if item in seen:
+            continue
+        seen.add(item)
+        out.append(item)
+    return out
+
+
+def collect_candidates(grid: Grid, cy: int, cx: int, radius: int) -> List[str]:
+    candidates: List[str] = []
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            candidates.extend(grid.get((cy + dy, cx + dx), []))
+    return unique_items(candidates)
+
+
+def cell_id(lat: float, lon: float, cell_size: float) -> Tuple[int, int]:
+    return (int(math.floor(lat / cell_size)), int(math.floor(lon / cell_size)))
+
+
+def match_city(
+    center: Point,
+    city_polygons: Dict[str, dict],
+    grid: Grid,
+    cell_size: float,
+    covers: Callable[[str], bool],
+    candidate_radius: int,
+    fallback_radius: int,
+    nearest: Optional[Nearest],
+    lookup: Optional[InteriorLookup] = None,
+    last_hit: Optional[LastHitCache] = None,
+    on_candidates: Optional[Callable[[List[str]], None]] = None,
+) -> Optional[str]:
+    # covers(city_id): does that city cover center? nearest (the backend's,
+    # None = no fallback) picks among the last candidates when none covers
+    # it; on_candidates sees each candidate list before it is tested (grid
+    # tuning counts the work).
+    if last_hit is not None:
+        cached = last_hit.lookup(center)
+        if cached is not None:
+            return cached
+
+    def try_match(candidates: List[str]) -> Optional[str]:
+        if on_candidates is not None:
+            on_candidates(candidates)
+        for city_id in candidates:
+            if covers(city_id):
+                return city_id
+        return None
+
+    cy, cx = cell_id(center[1], center[0], cell_size)
+    resolved, matched_city = (
+        lookup.resolve(center) if lookup is not None else (False, None)
+    )
+    if resolved:
+        # Interior cells need no candidates; empty cells skip straight to
+        # the same candidate set the nearest fallback would have used.
+        candidates = []
+        if not matched_city:
+            radius = max(candidate_radius, fallback_radius)
+            candidates = collect_candidates(grid, cy, cx, radius)
+    else:
+        candidates = collect_candidates(grid, cy, cx, candidate_radius)
+        matched_city = try_match(candidates)
+
+        if not matched_city and fallback_radius > candidate_radius:
+            candidates = collect_candidates(grid, cy, cx, fallback_radius)
+            matched_city = try_match(candidates)
+
+    if not matched_city and nearest is not None and candidates:
+        matched_city = nearest(city_polygons, candidates, center)
+
+    if last_hit is not None:
+        last_hit.remember(matched_city)
+    return matched_city
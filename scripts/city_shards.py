@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Set
+
+from output_manifest import write_bytes_if_changed
+from records import json_default
+
+MANIFEST_NAME = "manifest.json"
+HASH_LENGTH = 16
+SHARD_NAME = re.compile(rf"[0-9a-f]{{{HASH_LENGTH}}}\.json")
+
+
+def compact_bytes(payload) -> bytes:
+    data = json.dumps(
+        payload, ensure_ascii=False, separators=(",", ":"), default=json_default
+    )
+    return data.encode("utf-8")
+
+
+def previous_shards(out_dir: Path) -> Set[str]:
+    # Files listed by the shard manifest already in out_dir. Any other
+    # manifest.json (e.g. a run manifest) means the dir is not ours.
+    path = out_dir / MANIFEST_NAME
+    if not path.exists():
+        return set()
+    try:
+        manifest = json.loads(path.read_bytes())
+    except ValueError:
+        manifest = None
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("cities"), list):
+        raise ValueError(f"{path} is not a city shard manifest; use a dedicated shards dir")
+    return {
+        entry["file"]
+        for entry in manifest["cities"]
+        if isinstance(entry, dict) and isinstance(entry.get("file"), str)
+    }
+
+
+def write_city_shards(
+    out_dir: Path,
+    cities: List[dict],
+    places_by_city: Dict[str, List[dict]],
+    areas_by_city: Dict[str, List[dict]],
+) -> dict:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    previous = previous_shards(out_dir)
+    manifest_cities = []
+    written = set()
+    for city in sorted(cities, key=lambda c: ((c.get("name") or "").lower(), c["id"])):
+        city_id = city["id"]
+        places = places_by_city.get(city_id) or []
+        areas = areas_by_city.get(city_id) or []
+        if not places and not areas:
+            continue
+        data = compact_bytes({"city": city, "places": places, "areas": areas})
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        # Content-addressed names: unchanged cities keep their URL and can be
+        # cached forever.
+        file_name = f"{digest}.json"
+        shard_path = out_dir / file_name
+        write_bytes_if_changed(shard_path, data)
+        written.add(file_name)
+        manifest_cities.append(
+            {
+                "id": city_id,
+                "name": city.get("name"),
+                "centroid": city.get("centroid"),
+                "file": file_name,
+                "hash": digest,
+                "places": len(places),
+                "areas": len(areas),
+            }
+        )
+
+    # Only shard files are pruned: ones the old manifest listed, or named
+    # like a shard.
+    for stale in out_dir.glob("*.json"):
+        if stale.name in written:
+            continue
+        if stale.name in previous or SHARD_NAME.fullmatch(stale.name):
+            stale.unlink()
+
+    manifest = {"cities": manifest_cities}
+    write_bytes_if_changed(out_dir / MANIFEST_NAME, compact_bytes(manifest))
+    return manifest
@@ -0,0 +1,120 @@
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from records import Record, json_default
+
+PROFILES = ("full", "trimmed")
+BBOX_KEYS = ("min_lon", "min_lat", "max_lon", "max_lat")
+CENTROID_KEYS = ("lon", "lat")
+
+
+class ExportProfile:
+    # full: the schema as always written. trimmed: coordinates rounded to
+    # `decimals` places, null fields left out and no indentation. arrays:
+    # bbox/centroid as fixed-order lists (BBOX_KEYS / CENTROID_KEYS order)
+    # in either profile.
+    def __init__(self, name: str = "full", decimals: int = 6, arrays: bool = False) -> None:
+        self.name = name
+        self.decimals: Optional[int] = decimals if name == "trimmed" else None
+        self.drop_nulls = name == "trimmed"
+        self.indent: Optional[int] = 2 if name == "full" else None
+        self.arrays = arrays
+
+    def describe(self) -> str:
+        text = "full" if self.name == "full" else f"trimmed ({self.decimals} decimals)"
+        return text + (", geometry arrays" if self.arrays else "")
+
+    def coords(self, value: Any, keys: tuple) -> Any:
+        if not isinstance(value, dict):
+            return value
+        values = [value.get(key) for key in keys]
+        if self.decimals is not None:
+            values = [round(v, self.decimals) if isinstance(v, float) else v for v in values]
+        if self.arrays:
+            return values
+        return dict(zip(keys, values))
+
+    def apply(self, entry: Any) -> Dict[str, Any]:
+        if isinstance(entry, Record):
+            entry = entry.to_dict()
+        if self.name == "full" and not self.arrays:
+            return entry
+        out: Dict[str, Any] = {}
+        for key, value in entry.items():
+            if value is None and self.drop_nulls:
+                continue
+            if key == "bbox":
+                value = self.coords(value, BBOX_KEYS)
+            elif key == "centroid":
+                value = self.coords(value, CENTROID_KEYS)
+            out[key] = value
+        return out
+
+    def entries(self, items: List[Any]) -> List[Any]:
+        if self.name == "full" and not self.arrays:
+            return items
+        return [self.apply(item) for item in items]
+
+    def default(self, value: Any) -> Any:
+        # default= hook: records are trimmed as they are encoded, so grouped
+        # outputs never hold a second copy of every entry.
+        if isinstance(value, Record):
+            return self.apply(value)
+        return json_default(value)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--export-profile",
+        choices=PROFILES,
+        default="full",
+        help="full = current schema; trimmed = coordinates rounded to "
+        "--coord-decimals, null fields dropped, no indentation",
+    )
+    parser.add_argument(
+        "--coord-decimals",
+        type=int,
+        default=6,
+        help="Decimal places kept by --export-profile trimmed (6 = ~0.1 m)",
+    )
+    parser.add_argument(
+        "--geometry-arrays",
+        action="store_true",
+        help="Write bbox as [min_lon, min_lat, max_lon, max_lat] and centroid as [lon, lat]",
+    )
+
+
+def profile_from_args(args: argparse.Namespace) -> ExportProfile:
+    return ExportProfile(args.export_profile, args.coord_decimals, args.geometry_arrays)
+
+
+def as_bbox(value: Any) -> Any:
+    return dict(zip(BBOX_KEYS, value)) if isinstance(value, list) else value
+
+
+def as_centroid(value: Any) -> Any:
+    return dict(zip(CENTROID_KEYS, value)) if isinstance(value, list) else value
+
+
+def expand_entry(entry: Any) -> Any:
+    # Readers always see bbox/centroid objects, whatever profile wrote them.
+    if isinstance(entry, dict):
+        if "bbox" in entry:
+            entry["bbox"] = as_bbox(entry["bbox"])
+        if "centroid" in entry:
+            entry["centroid"] = as_centroid(entry["centroid"])
+    return entry
+
+
+def load_export(path: Path) -> Any:
+    # Loads a list export or a grouped {city_id: [entries]} export.
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    groups = data.values() if isinstance(data, dict) else [data]
+    for items in groups:
+        if isinstance(items, list):
+            for entry in items:
+                expand_entry(entry)
+    return data
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import argparse
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from export_profile import BBOX_KEYS, CENTROID_KEYS, expand_entry, load_export
+from external_groups import iter_grouped
+from normalize_areas import normalize_name
+from output_manifest import describe_write, replace_output
+
+NAME_FIELDS = ("name", "name_es", "name_eu")
+
+# Columns copied from the export entries, per table; every table also gets
+# rid (rowid shared with its R*Tree), name_norm, the bbox and the centroid.
+CITY_FIELDS = (
+    "id",
+    "name",
+    "admin_level",
+    "ref_ine",
+    "ine_municipio",
+    "wikidata",
+    "wikipedia",
+    "geohash",
+    "bbox_geohash",
+)
+AREA_FIELDS = (
+    "id",
+    "city_id",
+    "name",
+    "admin_level",
+    "place",
+    "wikidata",
+    "wikipedia",
+    "geohash",
+    "bbox_geohash",
+)
+PLACE_FIELDS = (
+    "id",
+    "city_id",
+    "name",
+    "name_es",
+    "name_eu",
+    "place",
+    "admin_level",
+    "ref_ine",
+    "wikidata",
+    "wikipedia",
+    "population",
+    "population_date",
+    "area9_id",
+    "area10_id",
+    "geohash",
+    "bbox_geohash",
+)
+TABLES = {"cities": CITY_FIELDS, "city_areas": AREA_FIELDS, "city_places": PLACE_FIELDS}
+KINDS = {"cities": "city", "city_areas": "area", "city_places": "place"}
+EXTRA_COLUMNS = ("name_norm",) + BBOX_KEYS + CENTROID_KEYS
+
+
+def column_sql(field: str) -> str:
+    if field == "id":
+        return "id TEXT NOT NULL UNIQUE"
+    if field == "city_id":
+        return "city_id TEXT REFERENCES cities(id)"
+    if field == "population":
+        return "population INTEGER"
+    if field in BBOX_KEYS or field in CENTROID_KEYS:
+        return f"{field} REAL"
+    return f"{field} TEXT"
+
+
+def create_schema(conn: sqlite3.Connection) -> None:
+    for table, fields in TABLES.items():
+        columns = ["rid INTEGER PRIMARY KEY"]
+        columns += [column_sql(field) for field in fields + EXTRA_COLUMNS]
+        conn.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+        # R*Tree rows share the table's rid; coordinates are stored as
+        # 32-bit floats rounded outwards, so it is a candidate filter and
+        # the REAL columns give the exact bbox.
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {table}_bbox USING rtree(rid, min_lon, max_lon, min_lat, max_lat)"
+        )
+    # One row per distinct normalized name (name / name:es / name:eu).
+    conn.execute(
+        "CREATE VIRTUAL TABLE location_names USING fts5("
+        "name_norm, kind UNINDEXED, entity_id UNINDEXED, city_id UNINDEXED, "
+        "prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    # Built after the bulk load, which is cheaper than maintaining them.
+    for table in ("city_areas", "city_places"):
+        conn.execute(f"CREATE INDEX {table}_city_id ON {table}(city_id)")
+    conn.execute("INSERT INTO location_names(location_names) VALUES ('optimize')")
+    conn.execute("ANALYZE")
+
+
+def name_norms(entry: dict) -> List[str]:
+    norms = []
+    for field in NAME_FIELDS:
+        value = entry.get(field)
+        norm = normalize_name(value) if isinstance(value, str) else ""
+        if norm and norm not in norms:
+            norms.append(norm)
+    return norms
+
+
+def coords(entry: dict) -> Optional[Tuple[float, ...]]:
+    bbox = entry.get("bbox")
+    centroid = entry.get("centroid")
+    if not isinstance(bbox, dict) or not isinstance(centroid, dict):
+        return None
+    values = tuple(bbox.get(key) for key in BBOX_KEYS) + tuple(
+        centroid.get(key) for key in CENTROID_KEYS
+    )
+    if any(value is None for value in values):
+        return None
+    return values
+
+
+class SqliteWriter:
+    # Buffers rows for every table and flushes them with executemany, one
+    # transaction per batch_size rows.
+    def __init__(self, conn: sqlite3.Connection, batch_size: int) -> None:
+        self.conn = conn
+        self.batch_size = batch_size
+        self.rows: Dict[str, List[tuple]] = {}
+        self.pending = 0
+        self.next_rid = {table: 1 for table in TABLES}
+        self.counts = {table: 0 for table in TABLES}
+        self.names = 0
+
+    def add(self, table: str, entry: dict, city_id: Optional[str] = None) -> None:
+        fields = TABLES[table]
+        rid = self.next_rid[table]
+        self.next_rid[table] += 1
+        norms = name_norms(entry)
+        located = coords(entry)
+        values = [city_id if field == "city_id" else entry.get(field) for field in fields]
+        values.append(norms[0] if norms else None)
+        values.extend(located if located is not None else (None,) * 6)
+        self.queue(table, (rid, *values))
+        if located is not None:
+            min_lon, min_lat, max_lon, max_lat = located[:4]
+            self.queue(f"{table}_bbox", (rid, min_lon, max_lon, min_lat, max_lat))
+        for norm in norms:
+            self.queue("location_names", (norm, KINDS[table], entry.get("id"), city_id))
+            self.names += 1
+        self.counts[table] += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def queue(self, table: str, row: tuple) -> None:
+        self.rows.setdefault(table, []).append(row)
+        self.pending += 1
+
+    def flush(self) -> None:
+        with self.conn:
+            for table, rows in self.rows.items():
+                marks = ", ".join("?" * len(rows[0]))
+                self.conn.executemany(f"INSERT INTO {table} VALUES ({marks})", rows)
+        self.rows = {}
+        self.pending = 0
+
+
+def export_grouped(
+    writer: SqliteWriter, table: str, path: Path, city_ids: Set[str]
+) -> int:
+    # Streams the grouped export one city at a time. Groups for cities not
+    # in the cities table (and _unassigned) are left out, as on import.
+    skipped = 0
+    for city_id, items in iter_grouped(path):
+        if not isinstance(items, list):
+            continue
+        if city_id not in city_ids:
+            skipped += len(items)
+            continue
+        for item in items:
+            writer.add(table, expand_entry(item), city_id)
+    return skipped
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cities",
+        default="data/exports/cities.filtered.json",
+        help="Input cities JSON",
+    )
+    parser.add_argument(
+        "--areas",
+        default="data/exports/areas_by_city.json",
+        help="Input areas_by_city JSON (empty = skip)",
+    )
+    parser.add_argument(
+        "--places",
+        default="data/exports/places_by_city.best.json",
+        help="Input places_by_city JSON (empty = skip)",
+    )
+    parser.add_argument(
+        "--out",
+        default="data/exports/locations.sqlite",
+        help="Output SQLite database (rebuilt from scratch)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50000,
+        help="Rows inserted per transaction",
+    )
+    args = parser.parse_args()
+
+    repo_root = Path(__file__).resolve().parent.parent
+    cities_path = (repo_root / args.cities).resolve()
+    out_path = (repo_root / args.out).resolve()
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = out_path.with_name(f".{out_path.name}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # A scratch file replaced at the end: no journal needed.
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+        create_schema(conn)
+
+        writer = SqliteWriter(conn, max(args.batch_size, 1))
+        cities: List[Dict[str, Any]] = load_export(cities_path)
+        for city in cities:
+            writer.add("cities", city, city.get("id"))
+        writer.flush()
+        city_ids = {str(city.get("id")) for city in cities}
+
+        skipped = {}
+        for table, arg in (("city_areas", args.areas), ("city_places", args.places)):
+            if arg.strip():
+                path = (repo_root / arg).resolve()
+                skipped[table] = export_grouped(writer, table, path, city_ids)
+        writer.flush()
+        create_indexes(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    written = replace_output(out_path, tmp_path)
+
+    print(f"Cities: {writer.counts['cities']}")
+    print(f"Areas: {writer.counts['city_areas']}")
+    print(f"Places: {writer.counts['city_places']}")
+    print(f"Name index rows: {writer.names}")
+    for table, count in skipped.items():
+        if count:
+            print(f"Skipped {count} {KINDS[table]} entries outside the cities file")
+    print(describe_write(out_path, written))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,145 @@
+import heapq
+import json
+import mmap
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from geojson_stream import iter_members, skip_ws
+
+SPILL_BATCH = 1024
+# Runs of one merge generation are merged into one run of the next once
+# this many have piled up.
+MERGE_FANIN = 64
+UNASSIGNED = "_unassigned"
+
+# (group order, sort key, insertion seq, record); seq is unique, so tuple
+# comparison never reaches the record and equal sort keys keep insertion
+# order, exactly like list.sort().
+Item = Tuple[Tuple[bool, str], Any, int, Any]
+
+
+def group_order(group_id: str) -> Tuple[bool, str]:
+    # Same order as output_manifest.canonical_grouped: sorted, _unassigned last.
+    return (group_id == UNASSIGNED, group_id)
+
+
+class ExternalGroups:
+    # Collects (group_id, sort_key, record) triples and hands them back one
+    # group at a time, each sorted by sort_key. At most `budget` records are
+    # held in memory (0 = no limit); beyond that the buffer is sorted and
+    # spilled to a temporary run file, and groups() merges the runs.
+    def __init__(
+        self,
+        budget: int = 0,
+        prepare: Optional[Callable[[List[Any]], None]] = None,
+        tmp_dir: Optional[Path] = None,
+    ) -> None:
+        self.budget = budget
+        # prepare(records) runs once per record, in batches, before the
+        # record is spilled or handed out (e.g. to assign geohashes).
+        self.prepare = prepare
+        self.tmp_dir = tmp_dir
+        self.buffer: List[Item] = []
+        # Run files by merge generation: spills are generation 0.
+        self.levels: List[List[Any]] = []
+        self.group_ids: Set[str] = set()
+        self.seq = 0
+        self.count = 0
+        self.spilled = 0
+
+    def touch(self, group_id: str) -> None:
+        # Groups are emitted even when nothing is ever added to them.
+        self.group_ids.add(group_id)
+
+    def add(self, group_id: str, sort_key: Any, record: Any) -> None:
+        self.group_ids.add(group_id)
+        self.buffer.append((group_order(group_id), sort_key, self.seq, record))
+        self.seq += 1
+        self.count += 1
+        if self.budget > 0 and len(self.buffer) >= self.budget:
+            self.spill()
+
+    def sorted_buffer(self) -> List[Item]:
+        if self.prepare is not None:
+            self.prepare([item[3] for item in self.buffer])
+        self.buffer.sort()
+        items, self.buffer = self.buffer, []
+        return items
+
+    def write_run(self, items: Iterable[Item]):
+        run = tempfile.TemporaryFile(dir=self.tmp_dir)
+        batch: List[Item] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= SPILL_BATCH:
+                pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+                batch = []
+        if batch:
+            pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        return run
+
+    def spill(self) -> None:
+        self.add_run(0, self.write_run(self.sorted_buffer()))
+        self.spilled += 1
+
+    def add_run(self, level: int, run) -> None:
+        # Only runs of the same generation are merged, so each record is
+        # rewritten once per generation (log-many times) rather than on
+        # every merge into one ever-growing run.
+        if level == len(self.levels):
+            self.levels.append([])
+        runs = self.levels[level]
+        runs.append(run)
+        if len(runs) >= MERGE_FANIN:
+            self.levels[level] = []
+            merged = self.write_run(heapq.merge(*(self.read_run(r) for r in runs)))
+            for r in runs:
+                r.close()
+            self.add_run(level + 1, merged)
+
+    def read_run(self, run) -> Iterator[Item]:
+        while True:
+            try:
+                batch = pickle.load(run)
+            except EOFError:
+                return
+            yield from batch
+
+    def groups(self) -> Iterator[Tuple[str, List[Any]]]:
+        # One group's records are in memory at a time.
+        try:
+            runs = [run for level in self.levels for run in level]
+            merged = heapq.merge(*(self.read_run(run) for run in runs), self.sorted_buffer())
+            pending = next(merged, None)
+            for group_id in sorted(self.group_ids, key=group_order):
+                order = group_order(group_id)
+                records = []
+                while pending is not None and pending[0] == order:
+                    records.append(pending[3])
+                    pending = next(merged, None)
+                yield group_id, records
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for level in self.levels:
+            for run in level:
+                run.close()
+        self.levels = []
+
+    def summary(self) -> str:
+        return f"Grouped {self.count} entries ({self.spilled} runs spilled to disk)"
+
+
+def iter_grouped(path: Path) -> Iterator[Tuple[str, Any]]:
+    # Streams a {group_id: value} export one member at a time, so only the
+    # current city's entries are ever decoded.
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for key, start, end in iter_members(buf, skip_ws(buf, 0)):
+                yield json.loads(b'"' + key + b'"'), json.loads(buf[start:end])
@@ -1,25 +1,53 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import math
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Tuple
 
-try:
-    from shapely.geometry import Point as ShPoint
-    from shapely.geometry import shape
-    from shapely.prepared import prep
-
-    HAS_SHAPELY = True
-except Exception:
-    HAS_SHAPELY = False
-    ShPoint = None
-    shape = None
-    prep = None
+from boundary_topology import write_boundaries
+from city_lookup import InteriorLookup, get_interior_lookup, polygon_ring_groups
+from city_match import match_city
+from export_profile import add_profile_arguments, profile_from_args
+from feature_index import load_indexed_features
+from geojson_stream import load_features
+from geometry_backends import (
+    GeometryBackend,
+    add_backend_arguments,
+    backend_from_args,
+    get_backend,
+    select_backend,
+)
+from geometry_kernels import geometry_stats_many
+from grid_tuning import GridSetting, auto_tune, sample_indexes
+from osm_pbf import is_pbf, load_pbf_boundaries
+from output_manifest import (
+    canonical_grouped,
+    describe_write,
+    entity_hashes,
+    grouped_hashes,
+    write_json_output,
+)
+from partitions import (
+    assign_owners,
+    expand,
+    intersects,
+    load_plan,
+    merge_grouped,
+    points_hull,
+    sparse_features,
+)
+from records import AreaRecord
+from region_clip import add_region_arguments, plan_clip, region_from_args
+from spatial_keys import MAX_PRECISION, assign_geohashes
+from spatial_order import CURVES, LastHitCache, curve_order
+from vector_tiles import write_mbtiles
 
 Point = Tuple[float, float]
 BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
 
+ADMIN_LEVELS = {"8", "9", "10"}
+
 
 def slugify(value: str) -> str:
     out = []
@@ -43,143 +71,6 @@ def get_prop(props: dict, key: str):
     return None
 
 
-def unique_items(items: List[str]) -> List[str]:
-    seen = set()
-    out = []
-    for item in items:
-        if item in seen:
-            continue
-        seen.add(item)
-        out.append(item)
-    return out
-
-
-def collect_candidates(
-    grid: Dict[Tuple[int, int], List[str]],
-    cy: int,
-    cx: int,
-    radius: int,
-) -> List[str]:
-    candidates: List[str] = []
-    for dy in range(-radius, radius + 1):
-        for dx in range(-radius, radius + 1):
-            candidates.extend(grid.get((cy + dy, cx + dx), []))
-    return unique_items(candidates)
-
-
-def iter_points(geom: dict) -> Iterable[Point]:
-    geom_type = geom.get("type")
-    coords = geom.get("coordinates")
-    if not coords:
-        return
-    if geom_type == "Point":
-        yield tuple(coords)
-    elif geom_type == "MultiPoint":
-        for pt in coords:
-            yield tuple(pt)
-    elif geom_type == "LineString":
-        for pt in coords:
-            yield tuple(pt)
-    elif geom_type == "MultiLineString":
-        for line in coords:
-            for pt in line:
-                yield tuple(pt)
-    elif geom_type == "Polygon":
-        for ring in coords:
-            for pt in ring:
-                yield tuple(pt)
-    elif geom_type == "MultiPolygon":
-        for poly in coords:
-            for ring in poly:
-                for pt in ring:
-                    yield tuple(pt)
-
-
-def outer_rings(geom: dict) -> List[List[Point]]:
-    geom_type = geom.get("type")
-    coords = geom.get("coordinates")
-    if not coords:
-        return []
-    if geom_type == "Polygon":
-        return [list(map(tuple, coords[0]))] if coords else []
-    if geom_type == "MultiPolygon":
-        rings = []
-        for poly in coords:
-            if poly and poly[0]:
-                rings.append(list(map(tuple, poly[0])))
-        return rings
-    return []
-
-
-def compute_bbox(points: Iterable[Point]) -> Optional[BBox]:
-    min_lon = min_lat = math.inf
-    max_lon = max_lat = -math.inf
-    count = 0
-    for lon, lat in points:
-        count += 1
-        min_lon = min(min_lon, lon)
-        min_lat = min(min_lat, lat)
-        max_lon = max(max_lon, lon)
-        max_lat = max(max_lat, lat)
-    if count == 0:
-        return None
-    return (min_lon, min_lat, max_lon, max_lat)
-
-
-def centroid(points: Iterable[Point]) -> Optional[Point]:
-    sx = sy = 0.0
-    count = 0
-    for lon, lat in points:
-        sx += lon
-        sy += lat
-        count += 1
-    if count == 0:
-        return None
-    return (sx / count, sy / count)
-
-
-def point_on_segment(p: Point, a: Point, b: Point, eps: float = 1e-9) -> bool:
-    (x, y), (x1, y1), (x2, y2) = p, a, b
-    cross = (y - y1) * (x2 - x1) - (x - x1) * (y2 - y1)
-    if abs(cross) > eps:
-        return False
-    dot = (x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)
-    if dot < -eps:
-        return False
-    sq_len = (x2 - x1) ** 2 + (y2 - y1) ** 2
-    return dot <= sq_len + eps
-
-
-def point_in_ring(p: Point, ring: List[Point]) -> bool:
-    x, y = p
-    inside = False
-    n = len(ring)
-    if n < 3:
-        return False
-    for i in range(n):
-        x1, y1 = ring[i]
-        x2, y2 = ring[(i + 1) % n]
-        if point_on_segment(p, (x1, y1), (x2, y2)):
-            return True
-        if (y1 > y) != (y2 > y):
-            x_intersect = (x2 - x1) * (y - y1) / (y2 - y1 + 0.0) + x1
-            if x_intersect > x:
-                inside = not inside
-    return inside
-
-
-def point_in_polygons(p: Point, rings: List[List[Point]]) -> bool:
-    # Rings are only outer rings. If point is in any outer ring, treat as inside.
-    for ring in rings:
-        if point_in_ring(p, ring):
-            return True
-    return False
-
-
-def cell_id(lat: float, lon: float, cell_size: float) -> Tuple[int, int]:
-    return (int(math.floor(lat / cell_size)), int(math.floor(lon / cell_size)))
-
-
 def cells_for_bbox(bbox: BBox, cell_size: float) -> Iterable[Tuple[int, int]]:
     min_lon, min_lat, max_lon, max_lat = bbox
     min_cy = int(math.floor(min_lat / cell_size))
@@ -191,13 +82,44 @@ def cells_for_bbox(bbox: BBox, cell_size: float) -> Iterable[Tuple[int, int]]:
             yield (cy, cx)
 
 
-def load_geojson(path: Path) -> dict:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+def is_admin_boundary(props: dict) -> bool:
+    return (
+        get_prop(props, "boundary") == "administrative"
+        and str(get_prop(props, "admin_level")) in ADMIN_LEVELS
+    )
+
+
+def is_city_boundary(props: dict) -> bool:
+    return (
+        get_prop(props, "boundary") == "administrative"
+        and str(get_prop(props, "admin_level")) == "8"
+    )
+
+
+def city_key(props: dict) -> Optional[str]:
+    # The id build_cities gives this boundary's city.
+    if not is_city_boundary(props):
+        return None
+    name = get_prop(props, "name") or get_prop(props, "name:es")
+    if not name:
+        return None
+    return str(get_prop(props, "ine:municipio") or get_prop(props, "ref:ine") or slugify(name))
+
+
+def load_geojson(path: Path, indexed: bool = False) -> dict:
+    # Only boundaries at the admin levels extracted here get fully decoded.
+    if is_pbf(path):
+        return load_pbf_boundaries(path, keep=is_admin_boundary)
+    loader = load_indexed_features if indexed else load_features
+    return loader(path, keep=is_admin_boundary, hints=(b'"administrative"',))
 
 
 def build_cities(
-    features: List[dict], use_shapely: bool
+    features: List[dict],
+    backend: GeometryBackend,
+    keep_ring_groups: bool = False,
+    geometries: Optional[Dict[str, list]] = None,
+    first_seen: Optional[Dict[str, int]] = None,
 ) -> Tuple[List[dict], Dict[str, dict], Dict[str, dict]]:
     cities_by_id: Dict[str, dict] = {}
     city_polygons: Dict[str, dict] = {}
@@ -211,25 +133,14 @@ def build_cities(
         if not name:
             continue
         geom = feat.get("geometry") or {}
-        if use_shapely and HAS_SHAPELY:
-            try:
-                city_shape = shape(geom)
-            except Exception:
-                continue
-            if city_shape.is_empty:
-                continue
-            bbox = city_shape.bounds
-            center_point = city_shape.representative_point()
-            center = (center_point.x, center_point.y)
-        else:
-            rings = outer_rings(geom)
-            if not rings:
-                # Skip cities without polygon rings for spatial join
-                continue
-            bbox = compute_bbox(iter_points(geom))
-            center = centroid(iter_points(geom))
-            if not bbox or not center:
-                continue
+        fields = backend.prepare(geom)
+        if fields is None:
+            # Skip cities the backend cannot test points against
+            continue
+        located = backend.locate(geom, fields)
+        if located is None:
+            continue
+        bbox, center = located
         ine_municipio = get_prop(props, "ine:municipio")
         ref_ine = get_prop(props, "ref:ine")
         city_id = str(ine_municipio or ref_ine or slugify(name))
@@ -255,21 +166,19 @@ def build_cities(
             "centroid": {"lon": center[0], "lat": center[1]},
             "bbox_area": bbox_area,
         }
+        if first_seen is not None and city_id not in cities_by_id:
+            first_seen[city_id] = idx
         cities_by_id[city_id] = city_entry
-        if use_shapely and HAS_SHAPELY:
-            city_polygons[city_id] = {
-                "prepared": prep(city_shape),
-                "bbox": bbox,
-                "centroid": center,
-                "bbox_area": bbox_area,
-            }
-        else:
-            city_polygons[city_id] = {
-                "rings": rings,
-                "bbox": bbox,
-                "centroid": center,
-                "bbox_area": bbox_area,
-            }
+        if geometries is not None:
+            geometries[city_id] = polygon_ring_groups(geom)
+        city_polygons[city_id] = {
+            **fields,
+            "bbox": bbox,
+            "centroid": center,
+            "bbox_area": bbox_area,
+        }
+        if keep_ring_groups and backend.model == "shapely":
+            city_polygons[city_id]["ring_groups"] = polygon_ring_groups(geom)
 
     cities = []
     for city in cities_by_id.values():
@@ -289,6 +198,18 @@ def build_city_grid(city_polygons: Dict[str, dict], cell_size: float) -> Dict[Tu
     return grid
 
 
+def build_last_hit(
+    city_polygons: Dict[str, dict], cell_size: float, backend: GeometryBackend
+) -> LastHitCache:
+    # Same covers test as match_city, and how far past its bbox each city's
+    # test can reach.
+    def covers(city_id: str, point: Point) -> bool:
+        return backend.covers(city_polygons[city_id], point)
+
+    reach = {city_id: backend.reach(info) for city_id, info in city_polygons.items()}
+    return LastHitCache(city_polygons, covers, reach, cell_size)
+
+
 def extract_areas(
     features: List[dict],
     city_polygons: Dict[str, dict],
@@ -296,14 +217,19 @@ def extract_areas(
     cell_size: float,
     admin_level: str,
     include_place: Optional[set] = None,
-    use_shapely: bool = True,
+    backend: Optional[GeometryBackend] = None,
     candidate_radius: int = 1,
     fallback_radius: int = 2,
     allow_nearest: bool = True,
-) -> Dict[str, List[dict]]:
-    areas_by_city: Dict[str, List[dict]] = {}
-    unknown_areas: List[dict] = []
-
+    lookup: Optional[InteriorLookup] = None,
+    geometries: Optional[Dict[str, list]] = None,
+    curve: str = "none",
+) -> Dict[str, List[AreaRecord]]:
+    backend = backend or get_backend("python")
+    areas_by_city: Dict[str, List[AreaRecord]] = {}
+    unknown_areas: List[AreaRecord] = []
+
+    selected = []
     for idx, feat in enumerate(features):
         props = feat.get("properties") or {}
         if get_prop(props, "boundary") != "administrative":
@@ -316,73 +242,63 @@ def extract_areas(
         place = get_prop(props, "place")
         if include_place and place not in include_place:
             continue
+        selected.append((idx, props, name, place, feat.get("geometry") or {}))
 
-        geom = feat.get("geometry") or {}
-        pts = list(iter_points(geom))
-        if not pts:
-            continue
-        center = centroid(pts)
-        bbox = compute_bbox(pts)
-        if not center or not bbox:
+    all_stats = geometry_stats_many(item[4] for item in selected)
+    pending = []
+    for (idx, props, name, place, geom), stats in zip(selected, all_stats):
+        if stats is None:
             continue
+        bbox, center = stats[0], stats[1]
 
         area_id = f"{slugify(name)}-{admin_level}-{idx}"
-        area_entry = {
-            "id": area_id,
-            "name": name,
-            "admin_level": admin_level,
-            "place": place,
-            "wikidata": get_prop(props, "wikidata"),
-            "wikipedia": get_prop(props, "wikipedia"),
-            "bbox": {
-                "min_lon": bbox[0],
-                "min_lat": bbox[1],
-                "max_lon": bbox[2],
-                "max_lat": bbox[3],
-            },
-            "centroid": {"lon": center[0], "lat": center[1]},
-        }
-
-        def try_match(candidates: List[str]) -> Optional[str]:
-            if use_shapely and HAS_SHAPELY:
-                point = ShPoint(center[0], center[1])
-                for city_id in candidates:
-                    city_info = city_polygons[city_id]
-                    if city_info["prepared"].covers(point):
-                        return city_id
-                return None
-            for city_id in candidates:
-                city_info = city_polygons[city_id]
-                if point_in_polygons(center, city_info["rings"]):
-                    return city_id
-            return None
-
-        cy, cx = cell_id(center[1], center[0], cell_size)
-        candidates = collect_candidates(grid, cy, cx, candidate_radius)
-        matched_city = try_match(candidates)
-
-        if not matched_city and fallback_radius > candidate_radius:
-            candidates = collect_candidates(grid, cy, cx, fallback_radius)
-            matched_city = try_match(candidates)
-
-        if not matched_city and allow_nearest and candidates:
-            best_city = None
-            best_dist = None
-            for city_id in candidates:
-                city_center = city_polygons[city_id]["centroid"]
-                dist = (center[0] - city_center[0]) ** 2 + (
-                    center[1] - city_center[1]
-                ) ** 2
-                if best_dist is None or dist < best_dist:
-                    best_dist = dist
-                    best_city = city_id
-            matched_city = best_city
+        if geometries is not None:
+            groups = polygon_ring_groups(geom)
+            if groups:
+                geometries[area_id] = groups
+        area_entry = AreaRecord(
+            area_id,
+            name,
+            admin_level,
+            place,
+            get_prop(props, "wikidata"),
+            get_prop(props, "wikipedia"),
+            bbox,
+            center,
+        )
+        pending.append(area_entry)
+
+    # Covers answers for every centre at once, in whatever way the backend
+    # batches them; match_city still walks candidates in grid order.
+    covered = backend.point_tester(city_polygons, [area.centroid for area in pending])
+
+    # Matching may run in curve order for locality; areas are still grouped
+    # in feature order below.
+    last_hit = None
+    if curve != "none":
+        last_hit = build_last_hit(city_polygons, cell_size, backend)
+    matches: List[Optional[str]] = [None] * len(pending)
+    for i in curve_order([area.centroid for area in pending], curve):
+        matches[i] = match_city(
+            pending[i].centroid,
+            city_polygons,
+            grid,
+            cell_size,
+            lambda city_id, i=i: covered(i, city_id),
+            candidate_radius,
+            fallback_radius,
+            backend.nearest if allow_nearest else None,
+            lookup=lookup,
+            last_hit=last_hit,
+        )
+    if last_hit is not None:
+        print(f"Level {admin_level}: {last_hit.summary()}")
 
+    for area_entry, matched_city in zip(pending, matches):
         if matched_city:
-            area_entry["city_id"] = matched_city
+            area_entry.city_id = matched_city
             areas_by_city.setdefault(matched_city, []).append(area_entry)
         else:
-            area_entry["city_id"] = None
             unknown_areas.append(area_entry)
 
     if unknown_areas:
@@ -390,18 +306,71 @@ def extract_areas(
     return areas_by_city
 
 
+def tune_city_grid(
+    features: List[dict],
+    city_polygons: Dict[str, dict],
+    backend: GeometryBackend,
+    current: GridSetting,
+    allow_nearest: bool,
+    include_place: Optional[set] = None,
+) -> GridSetting:
+    # Samples the level 9/10 areas extract_areas will match.
+    geoms = []
+    for feat in features:
+        props = feat.get("properties") or {}
+        if get_prop(props, "boundary") != "administrative":
+            continue
+        if str(get_prop(props, "admin_level")) not in {"9", "10"}:
+            continue
+        if not (get_prop(props, "name") or get_prop(props, "name:es")):
+            continue
+        if include_place and get_prop(props, "place") not in include_place:
+            continue
+        geoms.append(feat.get("geometry") or {})
+    geoms = [geoms[i] for i in sample_indexes(len(geoms))]
+    points = [stats[1] for stats in geometry_stats_many(geoms) if stats is not None]
+    reach = {city_id: backend.reach(info) for city_id, info in city_polygons.items()}
+    covers = backend.point_tester(city_polygons, points)
+    nearest = backend.nearest if allow_nearest else None
+    return auto_tune(points, city_polygons, reach, covers, current, nearest)
+
+
 def extract(
     data: dict,
     cell_size: float = 0.25,
     include_place: Optional[set] = None,
-    use_shapely: bool = True,
+    backend: Optional[GeometryBackend] = None,
     candidate_radius: int = 1,
     fallback_radius: int = 2,
     allow_nearest: bool = True,
+    lookup_cell_size: float = 0.0,
+    lookup_path: Optional[Path] = None,
+    geometries: Optional[Dict[str, list]] = None,
+    curve: str = "none",
+    tune: bool = False,
 ) -> Tuple[List[dict], Dict[str, Dict[str, List[dict]]]]:
     features = data.get("features") or []
-    cities, _, city_polygons = build_cities(features, use_shapely)
+    backend = backend or get_backend("python")
+    use_lookup = lookup_cell_size > 0
+    cities, _, city_polygons = build_cities(
+        features, backend, keep_ring_groups=use_lookup, geometries=geometries
+    )
+    if tune:
+        setting = tune_city_grid(
+            features,
+            city_polygons,
+            backend,
+            GridSetting(cell_size, candidate_radius, fallback_radius),
+            allow_nearest,
+            include_place,
+        )
+        cell_size = setting.cell_size
+        candidate_radius = setting.candidate_radius
+        fallback_radius = setting.fallback_radius
     grid = build_city_grid(city_polygons, cell_size)
+    lookup = None
+    if use_lookup:
+        lookup = get_interior_lookup(city_polygons, lookup_cell_size, lookup_path)
 
     areas_by_level = {}
     for level in ("10", "9"):
@@ -412,21 +381,194 @@ def extract(
             cell_size,
             admin_level=level,
             include_place=include_place,
-            use_shapely=use_shapely,
+            backend=backend,
             candidate_radius=candidate_radius,
             fallback_radius=fallback_radius,
             allow_nearest=allow_nearest,
+            lookup=lookup,
+            geometries=geometries,
+            curve=curve,
         )
 
+    if lookup is not None:
+        print(lookup.summary())
     return cities, areas_by_level
 
 
+def run_partition(
+    task: Tuple[List[dict], set, dict]
+) -> Tuple[List[Tuple[int, dict]], Dict[str, Dict[str, List[dict]]], Dict[str, list]]:
+    features, owned_cities, options = task
+    geometries: Optional[Dict[str, list]] = {} if options["geometries"] else None
+    first_seen: Dict[str, int] = {}
+    use_lookup = options["lookup_cell_size"] > 0
+    backend = get_backend(options["backend"])
+    cities, _, city_polygons = build_cities(
+        features,
+        backend,
+        keep_ring_groups=use_lookup,
+        geometries=geometries,
+        first_seen=first_seen,
+    )
+    grid = build_city_grid(city_polygons, options["cell_size"])
+    lookup = None
+    if use_lookup:
+        lookup = get_interior_lookup(city_polygons, options["lookup_cell_size"], None)
+    areas_by_level = {}
+    for level in ("10", "9"):
+        areas_by_level[level] = extract_areas(
+            features,
+            city_polygons,
+            grid,
+            options["cell_size"],
+            admin_level=level,
+            include_place=options["include_place"],
+            backend=backend,
+            candidate_radius=options["candidate_radius"],
+            fallback_radius=options["fallback_radius"],
+            allow_nearest=options["allow_nearest"],
+            lookup=lookup,
+            geometries=geometries,
+            curve=options["curve"],
+        )
+    owned = [(first_seen[city["id"]], city) for city in cities if city["id"] in owned_cities]
+    if geometries is not None:
+        area_ids = {
+            area["id"]
+            for grouped in areas_by_level.values()
+            for entries in grouped.values()
+            for area in entries
+        }
+        geometries = {
+            key: groups
+            for key, groups in geometries.items()
+            if key in owned_cities or key in area_ids
+        }
+    return owned, areas_by_level, geometries or {}
+
+
+def extract_partitioned(
+    features: List[dict],
+    plan_spec: str,
+    repo_root: Path,
+    options: dict,
+    workers: Optional[int] = None,
+    geometries: Optional[Dict[str, list]] = None,
+) -> Tuple[List[dict], Dict[str, Dict[str, List[dict]]]]:
+    # Areas are owned by the partition holding their centroid and cities by
+    # the one holding their first feature's centroid. Each partition also
+    # gets every city within `margin` of its areas, which covers all grid
+    # candidates a single-process run could match, so results are identical.
+    all_stats = geometry_stats_many(f.get("geometry") or {} for f in features)
+    radius = max(options["candidate_radius"], options["fallback_radius"])
+    margin = (radius + 1) * options["cell_size"] + options["lookup_cell_size"]
+    include_place = options["include_place"]
+
+    cities: List[Tuple[int, str, BBox]] = []
+    city_centers: Dict[str, Point] = {}
+    area_centers: List[Optional[Point]] = [None] * len(features)
+    for idx, (feat, stats) in enumerate(zip(features, all_stats)):
+        props = feat.get("properties") or {}
+        name = get_prop(props, "name") or get_prop(props, "name:es")
+        if stats is None or not name or not is_admin_boundary(props):
+            continue
+        if str(get_prop(props, "admin_level")) == "8":
+            city_id = str(
+                get_prop(props, "ine:municipio") or get_prop(props, "ref:ine") or slugify(name)
+            )
+            cities.append((idx, city_id, stats[0]))
+            city_centers.setdefault(city_id, stats[1])
+        elif not include_place or get_prop(props, "place") in include_place:
+            area_centers[idx] = stats[1]
+
+    plan = load_plan(
+        plan_spec,
+        [c for c in area_centers if c] + list(city_centers.values()),
+        repo_root,
+    )
+    owned_areas: Dict[int, set] = {}
+    for idx, owner in enumerate(assign_owners(area_centers, plan)):
+        if owner is not None:
+            owned_areas.setdefault(owner, set()).add(idx)
+    city_ids = list(city_centers)
+    owned_cities: Dict[int, set] = {}
+    for city_id, owner in zip(city_ids, assign_owners([city_centers[c] for c in city_ids], plan)):
+        owned_cities.setdefault(owner, set()).add(city_id)
+
+    tasks = []
+    for owner in sorted(set(owned_areas) | set(owned_cities)):
+        keep = set(owned_areas.get(owner, ()))
+        context = set(owned_cities.get(owner, ()))
+        hull = points_hull(area_centers[idx] for idx in keep)
+        if hull is not None:
+            region = expand(hull, margin)
+            context.update(c[1] for c in cities if intersects(c[2], region))
+        keep.update(c[0] for c in cities if c[1] in context)
+        tasks.append(
+            (
+                sparse_features(features, keep),
+                owned_cities.get(owner, set()),
+                dict(options, geometries=geometries is not None),
+            )
+        )
+
+    print(f"Partitions: {len(tasks)} of {len(plan)} with features (margin {margin:g} deg)")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_partition, tasks))
+
+    owned = sorted((item for result in results for item in result[0]), key=lambda x: x[0])
+    merged_cities: Dict[str, dict] = {}
+    for _, city in owned:
+        merged_cities.setdefault(city["id"], city)
+    merged = sorted(merged_cities.values(), key=lambda c: c["name"])
+    areas_by_level = {
+        level: merge_grouped(result[1][level] for result in results) for level in ("10", "9")
+    }
+    if geometries is not None:
+        for result in results:
+            geometries.update(result[2])
+    return merged, areas_by_level
+
+
+def boundary_layers(
+    cities: List[dict],
+    areas_by_level: Dict[str, Dict[str, List[dict]]],
+    geometries: Dict[str, list],
+) -> Dict[str, List[Tuple[str, dict, list]]]:
+    layers = {
+        "cities": [
+            (city["id"], {"name": city["name"], "admin_level": "8"}, geometries[city["id"]])
+            for city in cities
+            if geometries.get(city["id"])
+        ],
+        "areas": [
+            (
+                area["id"],
+                {
+                    "name": area["name"],
+                    "admin_level": area["admin_level"],
+                    "city_id": area["city_id"],
+                },
+                geometries[area["id"]],
+            )
+            for level in ("9", "10")
+            for entries in areas_by_level[level].values()
+            for area in entries
+            if area["id"] in geometries
+        ],
+    }
+    ids = [item[0] for item in layers["areas"]]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"{len(ids) - len(set(ids))} areas appear twice in the boundary layers")
+    return layers
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--input",
         default="data/geojson/spain-cities-areas.geojson",
-        help="Path to input GeoJSON",
+        help="Path to input GeoJSON or .osm.pbf extract",
     )
     parser.add_argument(
         "--out-dir",
@@ -456,24 +598,115 @@ def main() -> int:
         action="store_true",
         help="Disable nearest fallback when no polygon match is found",
     )
+    add_backend_arguments(parser)
     parser.add_argument(
-        "--no-shapely",
+        "--filter-place",
         action="store_true",
-        help="Disable shapely join even if installed",
+        help="Filter areas by place types (neighbourhood/suburb/quarter/borough/civil_parish)",
     )
     parser.add_argument(
-        "--filter-place",
+        "--lookup-cell-size",
+        type=float,
+        default=0.01,
+        help="Cell size in degrees for the interior-cell lookup table (0 = disabled)",
+    )
+    parser.add_argument(
+        "--lookup-table",
+        default="data/exports/city_lookup.json",
+        help="Cache file for the run-length encoded lookup table (empty = no cache)",
+    )
+    parser.add_argument(
+        "--boundary-tolerances",
+        default="",
+        help="Comma-separated simplification tolerances in degrees for TopoJSON "
+        "boundary exports (e.g. 0.0005,0.002,0.01; empty = disabled)",
+    )
+    parser.add_argument(
+        "--tiles",
+        default="",
+        help="Write city/area vector tiles to this MBTiles file (empty = disabled)",
+    )
+    parser.add_argument(
+        "--tile-zooms",
+        default="5-12",
+        help="Zoom range for --tiles, e.g. 5-12",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=int,
+        default=0,
+        help="Worker processes for tile generation (0 = one per CPU)",
+    )
+    parser.add_argument(
+        "--curve-order",
+        choices=CURVES,
+        default="none",
+        help="Match areas in Hilbert/Morton order, reusing the previous city "
+        "when it provably matches (output order is unchanged)",
+    )
+    parser.add_argument(
+        "--feature-index",
         action="store_true",
-        help="Filter areas by place types (neighbourhood/suburb/quarter/borough/civil_parish)",
+        help="Keep a byte-offset index (<file>.fidx) next to each GeoJSON input and decode "
+        "only the features it selects; built on first use, rebuilt when the file changes",
+    )
+    parser.add_argument(
+        "--auto-tune",
+        action="store_true",
+        help="Replace --cell-size/--candidate-radius/--fallback-radius with the cheapest "
+        "setting matching an exhaustive search on a sample of the areas",
+    )
+    parser.add_argument(
+        "--serialize-workers",
+        type=int,
+        default=0,
+        help="Processes encoding the output by city (0 = auto for large outputs, "
+        "1 = serial)",
     )
+    parser.add_argument(
+        "--partitions",
+        default="",
+        help="Split the run by region: grid:<degrees> or a JSON file of named bboxes "
+        "(empty = single process)",
+    )
+    parser.add_argument(
+        "--partition-workers",
+        type=int,
+        default=0,
+        help="Worker processes for --partitions (0 = one per CPU)",
+    )
+    parser.add_argument(
+        "--geohash-precision",
+        type=int,
+        default=9,
+        help=f"Geohash length for centroid/bbox spatial keys, up to {MAX_PRECISION} (0 = disabled)",
+    )
+    add_profile_arguments(parser)
+    add_region_arguments(parser)
     args = parser.parse_args()
 
     repo_root = Path(__file__).resolve().parent.parent
     input_path = (repo_root / args.input).resolve()
     out_dir = (repo_root / args.out_dir).resolve()
+    if not 0 <= args.geohash_precision <= MAX_PRECISION:
+        parser.error(f"--geohash-precision must be between 0 and {MAX_PRECISION}")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    data = load_geojson(input_path)
+    clip = None
+    backend_name = backend_from_args(args, parser)
+    region = region_from_args(args, parser)
+    if region is not None:
+        if args.partitions.strip() or args.auto_tune:
+            parser.error("--bbox/--city-ids cannot be combined with --partitions or --auto-tune")
+        if is_pbf(input_path):
+            parser.error("--bbox/--city-ids need a GeoJSON input (read through its feature index)")
+        radius = max(args.candidate_radius, args.fallback_radius)
+        margin = (radius + 1) * args.cell_size + max(args.lookup_cell_size, 0.0)
+        clip = plan_clip(input_path, region, margin, is_city_boundary, city_key)
+        print(clip.summary())
+        data = clip.load(input_path, keep=is_admin_boundary, hints=(b'"administrative"',))
+    else:
+        data = load_geojson(input_path, args.feature_index)
     place_filter = None
     if args.filter_place:
         place_filter = {
@@ -483,50 +716,142 @@ def main() -> int:
             "borough",
             "civil_parish",
         }
-    use_shapely = HAS_SHAPELY and not args.no_shapely
-    if not use_shapely and not args.no_shapely:
-        print("Shapely not available, using manual point-in-polygon.")
-
-    cities, areas_by_level = extract(
-        data,
-        cell_size=args.cell_size,
-        include_place=place_filter,
-        use_shapely=use_shapely,
-        candidate_radius=args.candidate_radius,
-        fallback_radius=args.fallback_radius,
-        allow_nearest=not args.no_nearest,
+    backend = select_backend(
+        backend_name,
+        [
+            feat.get("geometry") or {}
+            for feat in data.get("features") or []
+            if str(get_prop(feat.get("properties") or {}, "admin_level")) == "8"
+        ],
+    )
+    print(f"Geometry backend: {backend.name}")
+    lookup_path = None
+    # The cached table is the full run's; a clip builds its own.
+    if args.lookup_table.strip() and clip is None:
+        lookup_path = (repo_root / args.lookup_table).resolve()
+    tolerances = [float(t) for t in args.boundary_tolerances.split(",") if t.strip()]
+    geometries: Optional[Dict[str, list]] = None
+    if tolerances or args.tiles.strip():
+        geometries = {}
+
+    if args.partitions.strip():
+        if args.auto_tune:
+            parser.error("--auto-tune cannot be combined with --partitions")
+        options = {
+            "cell_size": args.cell_size,
+            "include_place": place_filter,
+            "backend": backend.name,
+            "candidate_radius": args.candidate_radius,
+            "fallback_radius": args.fallback_radius,
+            "allow_nearest": not args.no_nearest,
+            "lookup_cell_size": max(args.lookup_cell_size, 0.0),
+            "curve": args.curve_order,
+        }
+        cities, areas_by_level = extract_partitioned(
+            data.get("features") or [],
+            args.partitions,
+            repo_root,
+            options,
+            workers=args.partition_workers or None,
+            geometries=geometries,
+        )
+    else:
+        cities, areas_by_level = extract(
+            data,
+            cell_size=args.cell_size,
+            include_place=place_filter,
+            backend=backend,
+            candidate_radius=args.candidate_radius,
+            fallback_radius=args.fallback_radius,
+            allow_nearest=not args.no_nearest,
+            lookup_cell_size=args.lookup_cell_size,
+            lookup_path=lookup_path,
+            geometries=geometries,
+            curve=args.curve_order,
+            tune=args.auto_tune,
+        )
+    data = None
+    if clip is not None:
+        cities = clip.cities(cities)
+        areas_by_level = {level: clip.grouped(grouped) for level, grouped in areas_by_level.items()}
+    assign_geohashes(
+        cities
+        + [
+            area
+            for level in ("10", "9")
+            for entries in areas_by_level[level].values()
+            for area in entries
+        ],
+        args.geohash_precision,
     )
 
     cities_path = out_dir / "cities.json"
     areas_path = out_dir / "areas_by_city.json"
     areas_level9_path = out_dir / "areas_level9_by_city.json"
 
-    with cities_path.open("w", encoding="utf-8") as f:
-        json.dump(cities, f, ensure_ascii=True, indent=2)
-    with areas_path.open("w", encoding="utf-8") as f:
-        combined = dict(areas_by_level["10"])
-        for city_id, entries in areas_by_level["9"].items():
-            if city_id == "_unassigned":
-                combined.setdefault(city_id, []).extend(entries)
-                continue
-            combined.setdefault(city_id, []).extend(entries)
-        json.dump(combined, f, ensure_ascii=True, indent=2)
-    with areas_level9_path.open("w", encoding="utf-8") as f:
-        json.dump(areas_by_level["9"], f, ensure_ascii=True, indent=2)
-
-    print(f"Wrote {cities_path} ({len(cities)} cities)")
-    total_level10 = sum(
-        len(v) for v in areas_by_level["10"].values() if isinstance(v, list)
+    # Fresh lists: extending the level 10 ones in place would also add the
+    # level 9 areas to areas_by_level["10"].
+    combined = {city_id: list(entries) for city_id, entries in areas_by_level["10"].items()}
+    for city_id, entries in areas_by_level["9"].items():
+        combined.setdefault(city_id, []).extend(entries)
+    combined = canonical_grouped(combined)
+    level9 = canonical_grouped(areas_by_level["9"])
+    profile = profile_from_args(args)
+    city_entries = profile.entries(cities)
+    cities_written = write_json_output(
+        cities_path,
+        city_entries,
+        ensure_ascii=True,
+        indent=profile.indent,
+        groups=entity_hashes(city_entries),
     )
+    areas_written = write_json_output(
+        areas_path,
+        combined,
+        ensure_ascii=True,
+        groups=grouped_hashes(combined, profile.default),
+        workers=args.serialize_workers,
+        indent=profile.indent,
+        default=profile.default,
+    )
+    level9_written = write_json_output(
+        areas_level9_path,
+        level9,
+        ensure_ascii=True,
+        groups=grouped_hashes(level9, profile.default),
+        workers=args.serialize_workers,
+        indent=profile.indent,
+        default=profile.default,
+    )
+
+    print(f"Export profile: {profile.describe()}")
+    print(f"{describe_write(cities_path, cities_written)} ({len(cities)} cities)")
+    total_areas = sum(len(v) for v in combined.values() if isinstance(v, list))
     total_level9 = sum(
         len(v) for v in areas_by_level["9"].values() if isinstance(v, list)
     )
-    print(f"Wrote {areas_path} ({total_level10} areas)")
-    print(f"Wrote {areas_level9_path} ({total_level9} areas)")
+    print(f"{describe_write(areas_path, areas_written)} ({total_areas} areas)")
+    print(f"{describe_write(areas_level9_path, level9_written)} ({total_level9} areas)")
     if "_unassigned" in areas_by_level["10"]:
         print(f"Unassigned level 10 areas: {len(areas_by_level['10']['_unassigned'])}")
     if "_unassigned" in areas_by_level["9"]:
         print(f"Unassigned level 9 areas: {len(areas_by_level['9']['_unassigned'])}")
+    if tolerances or args.tiles.strip():
+        layers = boundary_layers(cities, areas_by_level, geometries)
+    if tolerances:
+        for path, written in write_boundaries(out_dir, layers, tolerances):
+            print(f"{describe_write(path, written)} ({path.stat().st_size} bytes)")
+    if args.tiles.strip():
+        tiles_path = (repo_root / args.tiles).resolve()
+        min_zoom, _, max_zoom = args.tile_zooms.partition("-")
+        tile_count, tiles_written = write_mbtiles(
+            tiles_path,
+            layers,
+            int(min_zoom),
+            int(max_zoom or min_zoom),
+            workers=args.tile_workers or None,
+        )
+        print(f"{describe_write(tiles_path, tiles_written)} ({tile_count} tiles)")
     return 0
 
 
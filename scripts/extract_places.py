@@ -1,26 +1,62 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import math
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
-
-try:
-    from shapely.geometry import Point as ShPoint
-    from shapely.geometry import shape
-    from shapely.prepared import prep
-
-    HAS_SHAPELY = True
-except Exception:
-    HAS_SHAPELY = False
-    ShPoint = None
-    shape = None
-    prep = None
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from area_hierarchy import AreaChildren, build_area_hierarchy, resolve_area_chain
+from city_index_file import (
+    EDGE_EPS,
+    MappedCityIndex,
+    open_city_index,
+    source_stamp,
+    write_city_index,
+)
+from city_lookup import InteriorLookup, get_interior_lookup, polygon_ring_groups
+from city_match import match_city
+from city_shards import previous_shards, write_city_shards
+from export_profile import add_profile_arguments, profile_from_args
+from external_groups import ExternalGroups
+from feature_index import load_indexed_features
+from geojson_stream import load_features
+from geometry_backends import (
+    GeometryBackend,
+    add_backend_arguments,
+    backend_from_args,
+    get_backend,
+    select_backend,
+)
+from geometry_kernels import geometry_stats_many
+from grid_tuning import GridSetting, auto_tune, build_grid, sample_indexes
+from osm_pbf import is_pbf, load_pbf_boundaries, load_pbf_places
+from output_manifest import (
+    canonical_grouped,
+    describe_write,
+    grouped_hashes,
+    write_grouped_output,
+    write_json_output,
+)
+from partitions import (
+    assign_owners,
+    expand,
+    intersects,
+    load_plan,
+    merge_grouped,
+    points_hull,
+    sparse_features,
+)
+from records import PlaceRecord
+from region_clip import add_region_arguments, plan_clip, region_from_args
+from spatial_keys import MAX_PRECISION, assign_geohashes
+from spatial_order import CURVES, LastHitCache, curve_order
 
 Point = Tuple[float, float]
 BBox = Tuple[float, float, float, float]
 
+ADMIN_LEVELS = {"8", "9", "10"}
+
 
 def slugify(value: str) -> str:
     out = []
@@ -44,142 +80,6 @@ def get_prop(props: dict, key: str):
     return None
 
 
-def unique_items(items: List[str]) -> List[str]:
-    seen = set()
-    out = []
-    for item in items:
-        if item in seen:
-            continue
-        seen.add(item)
-        out.append(item)
-    return out
-
-
-def collect_candidates(
-    grid: Dict[Tuple[int, int], List[str]],
-    cy: int,
-    cx: int,
-    radius: int,
-) -> List[str]:
-    candidates: List[str] = []
-    for dy in range(-radius, radius + 1):
-        for dx in range(-radius, radius + 1):
-            candidates.extend(grid.get((cy + dy, cx + dx), []))
-    return unique_items(candidates)
-
-
-def iter_points(geom: dict) -> Iterable[Point]:
-    geom_type = geom.get("type")
-    coords = geom.get("coordinates")
-    if not coords:
-        return
-    if geom_type == "Point":
-        yield tuple(coords)
-    elif geom_type == "MultiPoint":
-        for pt in coords:
-            yield tuple(pt)
-    elif geom_type == "LineString":
-        for pt in coords:
-            yield tuple(pt)
-    elif geom_type == "MultiLineString":
-        for line in coords:
-            for pt in line:
-                yield tuple(pt)
-    elif geom_type == "Polygon":
-        for ring in coords:
-            for pt in ring:
-                yield tuple(pt)
-    elif geom_type == "MultiPolygon":
-        for poly in coords:
-            for ring in poly:
-                for pt in ring:
-                    yield tuple(pt)
-
-
-def outer_rings(geom: dict) -> List[List[Point]]:
-    geom_type = geom.get("type")
-    coords = geom.get("coordinates")
-    if not coords:
-        return []
-    if geom_type == "Polygon":
-        return [list(map(tuple, coords[0]))] if coords else []
-    if geom_type == "MultiPolygon":
-        rings = []
-        for poly in coords:
-            if poly and poly[0]:
-                rings.append(list(map(tuple, poly[0])))
-        return rings
-    return []
-
-
-def compute_bbox(points: Iterable[Point]) -> Optional[BBox]:
-    min_lon = min_lat = math.inf
-    max_lon = max_lat = -math.inf
-    count = 0
-    for lon, lat in points:
-        count += 1
-        min_lon = min(min_lon, lon)
-        min_lat = min(min_lat, lat)
-        max_lon = max(max_lon, lon)
-        max_lat = max(max_lat, lat)
-    if count == 0:
-        return None
-    return (min_lon, min_lat, max_lon, max_lat)
-
-
-def centroid(points: Iterable[Point]) -> Optional[Point]:
-    sx = sy = 0.0
-    count = 0
-    for lon, lat in points:
-        sx += lon
-        sy += lat
-        count += 1
-    if count == 0:
-        return None
-    return (sx / count, sy / count)
-
-
-def point_on_segment(p: Point, a: Point, b: Point, eps: float = 1e-9) -> bool:
-    (x, y), (x1, y1), (x2, y2) = p, a, b
-    cross = (y - y1) * (x2 - x1) - (x - x1) * (y2 - y1)
-    if abs(cross) > eps:
-        return False
-    dot = (x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)
-    if dot < -eps:
-        return False
-    sq_len = (x2 - x1) ** 2 + (y2 - y1) ** 2
-    return dot <= sq_len + eps
-
-
-def point_in_ring(p: Point, ring: List[Point]) -> bool:
-    x, y = p
-    inside = False
-    n = len(ring)
-    if n < 3:
-        return False
-    for i in range(n):
-        x1, y1 = ring[i]
-        x2, y2 = ring[(i + 1) % n]
-        if point_on_segment(p, (x1, y1), (x2, y2)):
-            return True
-        if (y1 > y) != (y2 > y):
-            x_intersect = (x2 - x1) * (y - y1) / (y2 - y1 + 0.0) + x1
-            if x_intersect > x:
-                inside = not inside
-    return inside
-
-
-def point_in_polygons(p: Point, rings: List[List[Point]]) -> bool:
-    for ring in rings:
-        if point_in_ring(p, ring):
-            return True
-    return False
-
-
-def cell_id(lat: float, lon: float, cell_size: float) -> Tuple[int, int]:
-    return (int(math.floor(lat / cell_size)), int(math.floor(lon / cell_size)))
-
-
 def cells_for_bbox(bbox: BBox, cell_size: float) -> Iterable[Tuple[int, int]]:
     min_lon, min_lat, max_lon, max_lat = bbox
     min_cy = int(math.floor(min_lat / cell_size))
@@ -192,7 +92,10 @@ def cells_for_bbox(bbox: BBox, cell_size: float) -> Iterable[Tuple[int, int]]:
 
 
 def build_city_index(
-    city_geojson: dict, cell_size: float, use_shapely: bool
+    city_geojson: dict,
+    cell_size: float,
+    backend: GeometryBackend,
+    keep_ring_groups: bool = False,
 ) -> Tuple[Dict[str, dict], Dict[Tuple[int, int], List[str]]]:
     features = city_geojson.get("features") or []
     city_polygons: Dict[str, dict] = {}
@@ -206,24 +109,13 @@ def build_city_index(
         if not name:
             continue
         geom = feat.get("geometry") or {}
-        if use_shapely and HAS_SHAPELY:
-            try:
-                city_shape = shape(geom)
-            except Exception:
-                continue
-            if city_shape.is_empty:
-                continue
-            bbox = city_shape.bounds
-            center_point = city_shape.representative_point()
-            center = (center_point.x, center_point.y)
-        else:
-            rings = outer_rings(geom)
-            if not rings:
-                continue
-            bbox = compute_bbox(iter_points(geom))
-            center = centroid(iter_points(geom))
-            if not bbox or not center:
-                continue
+        fields = backend.prepare(geom)
+        if fields is None:
+            continue
+        located = backend.locate(geom, fields)
+        if located is None:
+            continue
+        bbox, center = located
         city_id = str(
             get_prop(props, "ine:municipio")
             or get_prop(props, "ref:ine")
@@ -233,22 +125,15 @@ def build_city_index(
         existing = city_polygons.get(city_id)
         if existing and bbox_area <= existing["bbox_area"]:
             continue
-        if use_shapely and HAS_SHAPELY:
-            city_polygons[city_id] = {
-                "name": name,
-                "prepared": prep(city_shape),
-                "bbox": bbox,
-                "centroid": center,
-                "bbox_area": bbox_area,
-            }
-        else:
-            city_polygons[city_id] = {
-                "name": name,
-                "rings": rings,
-                "bbox": bbox,
-                "centroid": center,
-                "bbox_area": bbox_area,
-            }
+        city_polygons[city_id] = {
+            "name": name,
+            **fields,
+            "bbox": bbox,
+            "centroid": center,
+            "bbox_area": bbox_area,
+        }
+        if keep_ring_groups and backend.model == "shapely":
+            city_polygons[city_id]["ring_groups"] = polygon_ring_groups(geom)
 
     grid: Dict[Tuple[int, int], List[str]] = {}
     for city_id, city_info in city_polygons.items():
@@ -257,19 +142,202 @@ def build_city_index(
     return city_polygons, grid
 
 
+def is_admin_boundary(props: dict) -> bool:
+    return (
+        get_prop(props, "boundary") == "administrative"
+        and str(get_prop(props, "admin_level")) in ADMIN_LEVELS
+    )
+
+
+def is_city_boundary(props: dict) -> bool:
+    return (
+        get_prop(props, "boundary") == "administrative"
+        and str(get_prop(props, "admin_level")) == "8"
+    )
+
+
+def city_key(props: dict) -> Optional[str]:
+    # The id build_city_index gives this boundary's city.
+    if not is_city_boundary(props):
+        return None
+    name = get_prop(props, "name") or get_prop(props, "name:es")
+    if not name:
+        return None
+    return str(get_prop(props, "ine:municipio") or get_prop(props, "ref:ine") or slugify(name))
+
+
+def load_city_geojson(path: Path, indexed: bool = False) -> dict:
+    # Cities (8) and their areas (9/10) are the only features read from here.
+    if is_pbf(path):
+        return load_pbf_boundaries(path, keep=is_admin_boundary)
+    loader = load_indexed_features if indexed else load_features
+    return loader(path, keep=is_admin_boundary, hints=(b'"administrative"',))
+
+
+def city_geometries(city_geojson: dict) -> List[dict]:
+    return [
+        feat.get("geometry") or {}
+        for feat in city_geojson.get("features") or []
+        if str(get_prop(feat.get("properties") or {}, "admin_level")) == "8"
+    ]
+
+
+def city_covers(
+    city_polygons: Dict[str, dict],
+    backend: GeometryBackend,
+    city_index: Optional[MappedCityIndex] = None,
+) -> Callable[[str, Point], bool]:
+    if city_index is not None:
+        return city_index.covers
+
+    def covers(city_id: str, point: Point) -> bool:
+        return backend.covers(city_polygons[city_id], point)
+
+    return covers
+
+
+def build_area_index(
+    city_geojson: dict,
+    backend: GeometryBackend,
+    assign_city: Callable[[Point], Optional[str]],
+) -> AreaChildren:
+    features = city_geojson.get("features") or []
+    selected = []
+    for idx, feat in enumerate(features):
+        props = feat.get("properties") or {}
+        if get_prop(props, "boundary") != "administrative":
+            continue
+        admin_level = str(get_prop(props, "admin_level"))
+        if admin_level not in {"9", "10"}:
+            continue
+        name = get_prop(props, "name") or get_prop(props, "name:es")
+        if not name:
+            continue
+        selected.append((idx, props, admin_level, name, feat.get("geometry") or {}))
+
+    areas: List[dict] = []
+    all_stats = geometry_stats_many(item[4] for item in selected)
+    for (idx, props, admin_level, name, geom), stats in zip(selected, all_stats):
+        if stats is None:
+            continue
+        bbox, center = stats[0], stats[1]
+        # Same id and centroid as extract_geojson.extract_areas for this file.
+        area = {
+            "id": f"{slugify(name)}-{admin_level}-{idx}",
+            "name": name,
+            "admin_level": admin_level,
+            "place": get_prop(props, "place"),
+            "bbox": bbox,
+            "centroid": center,
+        }
+        fields = backend.prepare(geom)
+        if fields is None:
+            continue
+        area.update(fields)
+        area["city_id"] = assign_city(center)
+        areas.append(area)
+    return build_area_hierarchy(areas, backend.covers)
+
+
+def group_area_records(area_children: AreaChildren) -> Dict[str, List[dict]]:
+    areas_by_city: Dict[str, List[dict]] = {}
+    for areas in area_children.values():
+        for area in areas:
+            bbox, center = area["bbox"], area["centroid"]
+            areas_by_city.setdefault(area["city_id"], []).append(
+                {
+                    "id": area["id"],
+                    "name": area["name"],
+                    "admin_level": area["admin_level"],
+                    "place": area["place"],
+                    "area9_id": area.get("area9_id"),
+                    "bbox": {
+                        "min_lon": bbox[0],
+                        "min_lat": bbox[1],
+                        "max_lon": bbox[2],
+                        "max_lat": bbox[3],
+                    },
+                    "centroid": {"lon": center[0], "lat": center[1]},
+                }
+            )
+    for items in areas_by_city.values():
+        items.sort(key=lambda item: (item["admin_level"], item["name"], item["id"]))
+    return areas_by_city
+
+
+def build_last_hit(
+    city_polygons: Dict[str, dict],
+    cell_size: float,
+    backend: GeometryBackend,
+    city_index: Optional[MappedCityIndex] = None,
+) -> LastHitCache:
+    # Same covers test as match_city, and how far past its bbox each city's
+    # test can reach.
+    covers = city_covers(city_polygons, backend, city_index)
+    reach = city_reach(city_polygons, backend, city_index)
+    return LastHitCache(city_polygons, covers, reach, cell_size)
+
+
+def city_reach(
+    city_polygons: Dict[str, dict],
+    backend: GeometryBackend,
+    city_index: Optional[MappedCityIndex] = None,
+) -> Dict[str, float]:
+    if city_index is not None:
+        return {city_id: EDGE_EPS for city_id in city_polygons}
+    return {city_id: backend.reach(info) for city_id, info in city_polygons.items()}
+
+
+def tune_city_grid(
+    features: List[dict],
+    city_polygons: Dict[str, dict],
+    backend: GeometryBackend,
+    current: GridSetting,
+    allow_nearest: bool,
+    city_index: Optional[MappedCityIndex] = None,
+) -> GridSetting:
+    # A city index file fixes the cell size; only the radii are tuned then.
+    geoms = [features[i].get("geometry") or {} for i in sample_indexes(len(features))]
+    points = [stats[1] for stats in geometry_stats_many(geoms) if stats is not None]
+    if city_index is not None:
+
+        def covers(i: int, city_id: str) -> bool:
+            return city_index.covers(city_id, points[i])
+
+    else:
+        covers = backend.point_tester(city_polygons, points)
+    return auto_tune(
+        points,
+        city_polygons,
+        city_reach(city_polygons, backend, city_index),
+        covers,
+        current,
+        backend.nearest if allow_nearest else None,
+        fixed_cell_size=city_index is not None,
+    )
+
+
 def extract_places_by_city(
     features: List[dict],
     include_types: Optional[set],
     city_polygons: Dict[str, dict],
     grid: Dict[Tuple[int, int], List[str]],
     cell_size: float,
-    use_shapely: bool,
+    backend: GeometryBackend,
     candidate_radius: int,
     fallback_radius: int,
     allow_nearest: bool,
-) -> Dict[str, List[dict]]:
-    places_by_city: Dict[str, List[dict]] = {}
-    unassigned: List[dict] = []
+    lookup: Optional[InteriorLookup] = None,
+    city_index: Optional[MappedCityIndex] = None,
+    area_children: Optional[AreaChildren] = None,
+    curve: str = "none",
+    grouper: Optional[ExternalGroups] = None,
+) -> Dict[str, List[PlaceRecord]]:
+    # With a grouper, entries are handed to it (sorted by name within each
+    # city, possibly on disk) and the returned dict stays empty.
+    places_by_city: Dict[str, List[PlaceRecord]] = {}
+    unassigned: List[PlaceRecord] = []
+    selected = []
     for idx, feat in enumerate(features):
         props = feat.get("properties") or {}
         place = get_prop(props, "place")
@@ -286,100 +354,215 @@ def extract_places_by_city(
         )
         if not name:
             continue
-        geom = feat.get("geometry") or {}
-        pts = list(iter_points(geom))
-        if not pts:
-            continue
-        center = centroid(pts)
-        bbox = compute_bbox(pts)
-        if not center or not bbox:
+        selected.append((idx, props, place, name, feat.get("geometry") or {}))
+
+    all_stats = geometry_stats_many(item[4] for item in selected)
+    pending = []
+    for (idx, props, place, name, geom), stats in zip(selected, all_stats):
+        if stats is None:
             continue
+        bbox, center = stats[0], stats[1]
         place_id = f"{slugify(name)}-{place}-{idx}"
-        entry = {
-            "id": place_id,
-            "name": name,
-            "place": place,
-            "admin_level": get_prop(props, "admin_level"),
-            "ref_ine": get_prop(props, "ref:ine"),
-            "wikidata": get_prop(props, "wikidata"),
-            "wikipedia": get_prop(props, "wikipedia"),
-            "population": get_prop(props, "population"),
-            "population_date": get_prop(props, "population:date"),
-            "name_es": get_prop(props, "name:es"),
-            "name_eu": get_prop(props, "name:eu"),
-            "bbox": {
-                "min_lon": bbox[0],
-                "min_lat": bbox[1],
-                "max_lon": bbox[2],
-                "max_lat": bbox[3],
-            },
-            "centroid": {"lon": center[0], "lat": center[1]},
-        }
+        entry = PlaceRecord(
+            place_id,
+            name,
+            place,
+            get_prop(props, "admin_level"),
+            get_prop(props, "ref:ine"),
+            get_prop(props, "wikidata"),
+            get_prop(props, "wikipedia"),
+            get_prop(props, "population"),
+            get_prop(props, "population:date"),
+            get_prop(props, "name:es"),
+            get_prop(props, "name:eu"),
+            bbox,
+            center,
+        )
+        pending.append(entry)
+
+    # Matching may run in curve order for locality; results are still
+    # grouped in feature order below.
+    last_hit = None
+    if curve != "none":
+        last_hit = build_last_hit(city_polygons, cell_size, backend, city_index)
+    centers = [entry.centroid for entry in pending]
+    if city_index is not None:
+
+        def covered(i: int, city_id: str) -> bool:
+            return city_index.covers(city_id, centers[i])
+
+    else:
+        # Covers answers for every centre at once, in whatever way the
+        # backend batches them; match_city still walks candidates in order.
+        covered = backend.point_tester(city_polygons, centers)
+    matches: List[Optional[str]] = [None] * len(pending)
+    for i in curve_order(centers, curve):
+        matches[i] = match_city(
+            centers[i],
+            city_polygons,
+            grid,
+            cell_size,
+            lambda city_id, i=i: covered(i, city_id),
+            candidate_radius,
+            fallback_radius,
+            backend.nearest if allow_nearest else None,
+            lookup=lookup,
+            last_hit=last_hit,
+        )
+    if last_hit is not None:
+        print(last_hit.summary())
 
-        def try_match(candidates: List[str]) -> Optional[str]:
-            if use_shapely and HAS_SHAPELY:
-                point = ShPoint(center[0], center[1])
-                for city_id in candidates:
-                    city_info = city_polygons[city_id]
-                    if city_info["prepared"].covers(point):
-                        return city_id
-                return None
-            for city_id in candidates:
-                city_info = city_polygons[city_id]
-                if point_in_polygons(center, city_info["rings"]):
-                    return city_id
-            return None
-
-        cy, cx = cell_id(center[1], center[0], cell_size)
-        candidates = collect_candidates(grid, cy, cx, candidate_radius)
-        matched_city = try_match(candidates)
-
-        if not matched_city and fallback_radius > candidate_radius:
-            candidates = collect_candidates(grid, cy, cx, fallback_radius)
-            matched_city = try_match(candidates)
-
-        if not matched_city and allow_nearest and candidates:
-            best_city = None
-            best_dist = None
-            for city_id in candidates:
-                city_center = city_polygons[city_id]["centroid"]
-                dist = (center[0] - city_center[0]) ** 2 + (
-                    center[1] - city_center[1]
-                ) ** 2
-                if best_dist is None or dist < best_dist:
-                    best_dist = dist
-                    best_city = city_id
-            matched_city = best_city
+    for i, matched_city in enumerate(matches):
+        entry = pending[i]
+        area9_id = area10_id = None
+        if area_children is not None:
+            area9_id, area10_id = resolve_area_chain(
+                area_children, matched_city, entry.centroid, backend.covers
+            )
 
         if matched_city:
-            entry_with_city = dict(entry)
-            entry_with_city["city_id"] = matched_city
-            entry_with_city["city_name"] = city_polygons[matched_city]["name"]
-            places_by_city.setdefault(matched_city, []).append(entry_with_city)
+            entry.city_id = matched_city
+            entry.city_name = city_polygons[matched_city]["name"]
+            entry.area9_id = area9_id
+            entry.area10_id = area10_id
+            if grouper is not None:
+                grouper.add(matched_city, entry.name, entry)
+            else:
+                places_by_city.setdefault(matched_city, []).append(entry)
+        elif grouper is not None:
+            # Unassigned entries keep feature order: one constant sort key.
+            grouper.add("_unassigned", "", entry)
         else:
-            entry_with_city = dict(entry)
-            entry_with_city["city_id"] = None
-            entry_with_city["city_name"] = None
-            unassigned.append(entry_with_city)
+            unassigned.append(entry)
+        if grouper is not None:
+            pending[i] = None
 
     for city_id, items in places_by_city.items():
-        items.sort(key=lambda item: item["name"])
+        items.sort(key=lambda item: item.name)
     if unassigned:
         places_by_city["_unassigned"] = unassigned
     return places_by_city
 
 
+def run_partition(task: Tuple[List[dict], List[dict], dict]) -> Dict[str, List[dict]]:
+    city_features, place_features, options = task
+    city_data = {"features": city_features}
+    cell_size = options["cell_size"]
+    backend = get_backend(options["backend"])
+    use_lookup = options["lookup_cell_size"] > 0
+    city_polygons, grid = build_city_index(
+        city_data, cell_size, backend, keep_ring_groups=use_lookup
+    )
+    covers = city_covers(city_polygons, backend)
+    lookup = None
+    if use_lookup:
+        lookup = get_interior_lookup(city_polygons, options["lookup_cell_size"], None)
+
+    def assign_city(center: Point) -> Optional[str]:
+        return match_city(
+            center,
+            city_polygons,
+            grid,
+            cell_size,
+            lambda city_id: covers(city_id, center),
+            options["candidate_radius"],
+            options["fallback_radius"],
+            backend.nearest if options["allow_nearest"] else None,
+        )
+
+    area_children = None
+    if options["area_chain"]:
+        area_children = build_area_index(city_data, backend, assign_city)
+    return extract_places_by_city(
+        place_features,
+        options["include_types"],
+        city_polygons,
+        grid,
+        cell_size,
+        backend=backend,
+        candidate_radius=options["candidate_radius"],
+        fallback_radius=options["fallback_radius"],
+        allow_nearest=options["allow_nearest"],
+        lookup=lookup,
+        area_children=area_children,
+        curve=options["curve"],
+    )
+
+
+def extract_partitioned(
+    features: List[dict],
+    city_features: List[dict],
+    plan_spec: str,
+    repo_root: Path,
+    options: dict,
+    workers: Optional[int] = None,
+) -> Dict[str, List[dict]]:
+    # Every place has one owner partition. A partition also gets the cities
+    # and areas within `margin` of its places, which covers every grid
+    # candidate the single-process match could consider, so results match.
+    centers = [s[1] if s else None for s in geometry_stats_many(f.get("geometry") or {} for f in features)]
+    city_stats = geometry_stats_many(f.get("geometry") or {} for f in city_features)
+    plan = load_plan(plan_spec, [c for c in centers if c], repo_root)
+    owners = assign_owners(centers, plan)
+    radius = max(options["candidate_radius"], options["fallback_radius"])
+    margin = (radius + 1) * options["cell_size"] + options["lookup_cell_size"]
+
+    cities: List[Tuple[int, str, BBox]] = []
+    areas: List[Tuple[int, str, BBox, Point]] = []
+    for idx, (feat, stats) in enumerate(zip(city_features, city_stats)):
+        props = feat.get("properties") or {}
+        name = get_prop(props, "name") or get_prop(props, "name:es")
+        if stats is None or not name or not is_admin_boundary(props):
+            continue
+        level = str(get_prop(props, "admin_level"))
+        if level == "8":
+            city_id = str(
+                get_prop(props, "ine:municipio") or get_prop(props, "ref:ine") or slugify(name)
+            )
+            cities.append((idx, city_id, stats[0]))
+        else:
+            areas.append((idx, level, stats[0], stats[1]))
+
+    owned: Dict[int, set] = {}
+    for idx, owner in enumerate(owners):
+        if owner is not None:
+            owned.setdefault(owner, set()).add(idx)
+    tasks = []
+    for owner in sorted(owned):
+        region = expand(points_hull(centers[idx] for idx in owned[owner]), margin)
+        keep = {a[0] for a in areas if intersects(a[2], region)}
+        # Parents of level 10 areas are the level 9 areas holding their centroid.
+        level10 = points_hull(a[3] for a in areas if a[0] in keep and a[1] == "10")
+        if level10 is not None:
+            parents = expand(level10, margin)
+            keep.update(a[0] for a in areas if a[1] == "9" and intersects(a[2], parents))
+        boxes = [region]
+        area_hull = points_hull(a[3] for a in areas if a[0] in keep)
+        if area_hull is not None:
+            boxes.append(expand(area_hull, margin))
+        city_ids = {c[1] for c in cities if any(intersects(c[2], box) for box in boxes)}
+        keep.update(c[0] for c in cities if c[1] in city_ids)
+        tasks.append(
+            (sparse_features(city_features, keep), sparse_features(features, owned[owner]), options)
+        )
+
+    print(f"Partitions: {len(tasks)} of {len(plan)} with places (margin {margin:g} deg)")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_partition, tasks))
+    return merge_grouped(results, sort_by_name=True)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--input",
         default="data/geojson/spain-places.geojson",
-        help="Path to input places GeoJSON",
+        help="Path to input places GeoJSON or .osm.pbf extract",
     )
     parser.add_argument(
         "--cities",
         default="data/geojson/spain-cities-areas.geojson",
-        help="Path to GeoJSON with admin_level=8 city polygons",
+        help="Path to GeoJSON or .osm.pbf with admin_level=8 city polygons",
     )
     parser.add_argument(
         "--out",
@@ -414,48 +597,322 @@ def main() -> int:
         action="store_true",
         help="Disable nearest fallback when no polygon match is found",
     )
+    add_backend_arguments(parser)
+    parser.add_argument(
+        "--lookup-cell-size",
+        type=float,
+        default=0.01,
+        help="Cell size in degrees for the interior-cell lookup table (0 = disabled)",
+    )
     parser.add_argument(
-        "--no-shapely",
+        "--lookup-table",
+        default="data/exports/city_lookup.json",
+        help="Cache file for the run-length encoded lookup table (empty = no cache)",
+    )
+    parser.add_argument(
+        "--city-index",
+        default="",
+        help="Memory-mapped city index file; built from --cities when missing or stale. "
+        "The index holds no level 9/10 areas, so it implies --no-area-chain",
+    )
+    parser.add_argument(
+        "--no-area-chain",
         action="store_true",
-        help="Disable shapely join even if installed",
+        help="Skip assigning places to level 9/10 areas (area9_id/area10_id)",
+    )
+    parser.add_argument(
+        "--shards-dir",
+        default="",
+        help="Also write content-hashed per-city files plus manifest.json here",
+    )
+    parser.add_argument(
+        "--geohash-precision",
+        type=int,
+        default=9,
+        help=f"Geohash length for centroid/bbox spatial keys, up to {MAX_PRECISION} (0 = disabled)",
     )
+    parser.add_argument(
+        "--curve-order",
+        choices=CURVES,
+        default="none",
+        help="Match places in Hilbert/Morton order, reusing the previous city "
+        "when it provably matches (output order is unchanged)",
+    )
+    parser.add_argument(
+        "--feature-index",
+        action="store_true",
+        help="Keep a byte-offset index (<file>.fidx) next to each GeoJSON input and decode "
+        "only the features it selects; built on first use, rebuilt when the file changes",
+    )
+    parser.add_argument(
+        "--auto-tune",
+        action="store_true",
+        help="Replace --cell-size/--candidate-radius/--fallback-radius with the cheapest "
+        "setting matching an exhaustive search on a sample of the places",
+    )
+    parser.add_argument(
+        "--serialize-workers",
+        type=int,
+        default=0,
+        help="Processes encoding the output by city (0 = auto for large outputs, "
+        "1 = serial)",
+    )
+    parser.add_argument(
+        "--partitions",
+        default="",
+        help="Split the run by region: grid:<degrees> or a JSON file of named bboxes "
+        "(empty = single process)",
+    )
+    parser.add_argument(
+        "--partition-workers",
+        type=int,
+        default=0,
+        help="Worker processes for --partitions (0 = one per CPU)",
+    )
+    parser.add_argument(
+        "--group-budget",
+        type=int,
+        default=0,
+        help="Places held in memory while grouping by city; beyond that sorted runs "
+        "are spilled to temporary files (0 = group everything in memory)",
+    )
+    add_profile_arguments(parser)
+    add_region_arguments(parser)
     args = parser.parse_args()
 
     repo_root = Path(__file__).resolve().parent.parent
     input_path = (repo_root / args.input).resolve()
     cities_path = (repo_root / args.cities).resolve()
     out_path = (repo_root / args.out).resolve()
+    if not 0 <= args.geohash_precision <= MAX_PRECISION:
+        parser.error(f"--geohash-precision must be between 0 and {MAX_PRECISION}")
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    shards_dir = None
+    if args.shards_dir.strip():
+        shards_dir = (repo_root / args.shards_dir).resolve()
+        if shards_dir == out_path.parent:
+            parser.error("--shards-dir must not be the directory of --out")
+        try:
+            previous_shards(shards_dir)
+        except ValueError as exc:
+            parser.error(str(exc))
 
-    with input_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    with cities_path.open("r", encoding="utf-8") as f:
-        city_data = json.load(f)
-
-    features = data.get("features") or []
     include_types = None
     if args.types.strip():
         include_types = {t.strip() for t in args.types.split(",") if t.strip()}
 
-    use_shapely = HAS_SHAPELY and not args.no_shapely
-    if not use_shapely and not args.no_shapely:
-        print("Shapely not available, using manual point-in-polygon.")
+    def keep_place(props: dict) -> bool:
+        place = get_prop(props, "place")
+        return bool(place) and (not include_types or place in include_types)
+
+    clip = None
+    backend_name = backend_from_args(args, parser)
+    region = region_from_args(args, parser)
+    if region is not None:
+        if args.partitions.strip() or args.city_index.strip() or args.auto_tune:
+            parser.error(
+                "--bbox/--city-ids cannot be combined with --partitions, --city-index "
+                "or --auto-tune"
+            )
+        if is_pbf(input_path) or is_pbf(cities_path):
+            parser.error("--bbox/--city-ids need GeoJSON inputs (read through their feature index)")
+        radius = max(args.candidate_radius, args.fallback_radius)
+        margin = (radius + 1) * args.cell_size + max(args.lookup_cell_size, 0.0)
+        clip = plan_clip(cities_path, region, margin, is_city_boundary, city_key)
+        print(clip.summary())
+
+    if is_pbf(input_path):
+        data = load_pbf_places(input_path, keep=keep_place)
+    elif clip is not None:
+        data = clip.load(input_path, keep=keep_place, hints=(b'"place"',))
+    else:
+        loader = load_indexed_features if args.feature_index else load_features
+        data = loader(input_path, keep=keep_place, hints=(b'"place"',))
+    features = data.get("features") or []
 
-    city_polygons, grid = build_city_index(city_data, args.cell_size, use_shapely)
-    places_by_city = extract_places_by_city(
-        features,
-        include_types,
-        city_polygons,
-        grid,
-        args.cell_size,
-        use_shapely=use_shapely,
-        candidate_radius=args.candidate_radius,
-        fallback_radius=args.fallback_radius,
-        allow_nearest=not args.no_nearest,
+    def choose_backend(city_data: Optional[dict]) -> GeometryBackend:
+        # A valid --city-index means the cities may never be loaded; auto
+        # then takes the first engine of the model without timing.
+        geoms = city_geometries(city_data) if city_data is not None else []
+        backend = select_backend(backend_name, geoms)
+        print(f"Geometry backend: {backend.name}")
+        return backend
+
+    grouper = None
+    if args.group_budget > 0:
+        if args.partitions.strip() or args.shards_dir.strip():
+            parser.error("--group-budget cannot be combined with --partitions or --shards-dir")
+        grouper = ExternalGroups(
+            args.group_budget,
+            prepare=lambda records: assign_geohashes(records, args.geohash_precision),
+        )
+
+    lookup = None
+    if args.partitions.strip():
+        if args.city_index.strip() or args.shards_dir.strip():
+            parser.error("--partitions cannot be combined with --city-index or --shards-dir")
+        if args.auto_tune:
+            parser.error("--auto-tune cannot be combined with --partitions")
+        city_data = load_city_geojson(cities_path, args.feature_index)
+        backend = choose_backend(city_data)
+        options = {
+            "include_types": include_types,
+            "cell_size": args.cell_size,
+            "backend": backend.name,
+            "candidate_radius": args.candidate_radius,
+            "fallback_radius": args.fallback_radius,
+            "allow_nearest": not args.no_nearest,
+            "lookup_cell_size": max(args.lookup_cell_size, 0.0),
+            "area_chain": not args.no_area_chain,
+            "curve": args.curve_order,
+        }
+        places_by_city = extract_partitioned(
+            features,
+            city_data.get("features") or [],
+            args.partitions,
+            repo_root,
+            options,
+            workers=args.partition_workers or None,
+        )
+    else:
+        use_lookup = args.lookup_cell_size > 0
+        cell_size = args.cell_size
+        city_index = None
+        city_data = None
+        if args.city_index.strip():
+            index_path = (repo_root / args.city_index).resolve()
+            city_index = open_city_index(index_path, cities_path)
+            if city_index is None:
+                city_data = load_city_geojson(cities_path, args.feature_index)
+            backend = choose_backend(city_data)
+            if city_index is None:
+                city_polygons, grid = build_city_index(
+                    city_data, cell_size, backend, keep_ring_groups=True
+                )
+                write_city_index(
+                    index_path, city_polygons, grid, cell_size, source_stamp(cities_path)
+                )
+                print(f"Wrote {index_path} ({len(city_polygons)} cities)")
+                city_index = open_city_index(index_path)
+            if city_index.cell_size != cell_size:
+                print(f"Using cell size {city_index.cell_size} from {index_path}")
+                cell_size = city_index.cell_size
+            city_polygons, grid = city_index.city_polygons, city_index.grid
+        else:
+            if clip is not None:
+                city_data = clip.load(
+                    cities_path, keep=is_admin_boundary, hints=(b'"administrative"',)
+                )
+            else:
+                city_data = load_city_geojson(cities_path, args.feature_index)
+            backend = choose_backend(city_data)
+            city_polygons, grid = build_city_index(
+                city_data, cell_size, backend, keep_ring_groups=use_lookup
+            )
+        if use_lookup:
+            lookup_path = None
+            # The cached table is the full run's; a clip builds its own.
+            if args.lookup_table.strip() and clip is None:
+                lookup_path = (repo_root / args.lookup_table).resolve()
+            lookup = get_interior_lookup(city_polygons, args.lookup_cell_size, lookup_path)
+
+        covers = city_covers(city_polygons, backend, city_index)
+        candidate_radius = args.candidate_radius
+        fallback_radius = args.fallback_radius
+        if args.auto_tune:
+            setting = tune_city_grid(
+                features,
+                city_polygons,
+                backend,
+                GridSetting(cell_size, candidate_radius, fallback_radius),
+                not args.no_nearest,
+                city_index,
+            )
+            if setting.cell_size != cell_size:
+                cell_size = setting.cell_size
+                grid = build_grid(city_polygons, cell_size)
+            candidate_radius = setting.candidate_radius
+            fallback_radius = setting.fallback_radius
+
+        def assign_city(center: Point) -> Optional[str]:
+            return match_city(
+                center,
+                city_polygons,
+                grid,
+                cell_size,
+                lambda city_id: covers(city_id, center),
+                candidate_radius,
+                fallback_radius,
+                None if args.no_nearest else backend.nearest,
+            )
+
+        area_children = None
+        if args.city_index.strip() and not args.no_area_chain:
+            # The cities are only parsed when the index is (re)built.
+            print("Area chain skipped: --city-index implies --no-area-chain")
+        elif not args.no_area_chain:
+            area_children = build_area_index(city_data, backend, assign_city)
+        city_data = None
+        places_by_city = extract_places_by_city(
+            features,
+            include_types,
+            city_polygons,
+            grid,
+            cell_size,
+            backend=backend,
+            candidate_radius=candidate_radius,
+            fallback_radius=fallback_radius,
+            allow_nearest=not args.no_nearest,
+            lookup=lookup,
+            city_index=city_index,
+            area_children=area_children,
+            curve=args.curve_order,
+            grouper=grouper,
+        )
+
+    profile = profile_from_args(args)
+    if grouper is not None:
+        # Only one city's places are decoded at a time from here on.
+        data = features = None
+        counts = Counter()
+        total_places = 0
+
+        def counted_groups():
+            nonlocal total_places
+            groups = grouper.groups()
+            if clip is not None:
+                groups = clip.groups(groups)
+            for city_id, items in groups:
+                counts.update(p["place"] for p in items)
+                total_places += len(items)
+                yield city_id, items
+
+        written = write_grouped_output(
+            out_path, counted_groups(), indent=profile.indent, default=profile.default
+        )
+        print(f"Export profile: {profile.describe()}")
+        print(f"{describe_write(out_path, written)} ({total_places} places grouped)")
+        print(grouper.summary())
+        print("Place counts:", dict(counts.most_common(10)))
+        if lookup is not None:
+            print(lookup.summary())
+        return 0
+
+    if clip is not None:
+        places_by_city = clip.grouped(places_by_city)
+    assign_geohashes(
+        [p for items in places_by_city.values() for p in items], args.geohash_precision
     )
 
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(places_by_city, f, ensure_ascii=False, indent=2)
+    places_by_city = canonical_grouped(places_by_city)
+    written = write_json_output(
+        out_path,
+        places_by_city,
+        groups=grouped_hashes(places_by_city, profile.default),
+        workers=args.serialize_workers,
+        indent=profile.indent,
+        default=profile.default,
+    )
 
     counts = Counter(
         p["place"]
@@ -466,8 +923,32 @@ def main() -> int:
     total_places = sum(
         len(items) for items in places_by_city.values() if isinstance(items, list)
     )
-    print(f"Wrote {out_path} ({total_places} places grouped)")
+    print(f"Export profile: {profile.describe()}")
+    print(f"{describe_write(out_path, written)} ({total_places} places grouped)")
+    if shards_dir is not None:
+        cities = [
+            {
+                "id": city_id,
+                "name": info["name"],
+                "bbox": {
+                    "min_lon": info["bbox"][0],
+                    "min_lat": info["bbox"][1],
+                    "max_lon": info["bbox"][2],
+                    "max_lat": info["bbox"][3],
+                },
+                "centroid": {"lon": info["centroid"][0], "lat": info["centroid"][1]},
+            }
+            for city_id, info in city_polygons.items()
+            if clip is None or city_id in clip.city_ids
+        ]
+        areas_by_city = group_area_records(area_children) if area_children else {}
+        if clip is not None:
+            areas_by_city = clip.grouped(areas_by_city)
+        manifest = write_city_shards(shards_dir, cities, places_by_city, areas_by_city)
+        print(f"Wrote {shards_dir} ({len(manifest['cities'])} city shards)")
     print("Place counts:", dict(counts.most_common(10)))
+    if lookup is not None:
+        print(lookup.summary())
     return 0
 
 
@@ -0,0 +1,232 @@
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from city_index_file import source_stamp
+from geojson_stream import iter_feature_spans, load_features
+from geometry_kernels import geometry_stats_many
+
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+Span = Optional[Tuple[int, int]]
+
+MAGIC = b"HFIX"
+VERSION = 1
+SUFFIX = ".fidx"
+# magic, version, source size, source mtime_ns, features, strings, string bytes.
+HEADER = struct.Struct("<4sIqq3q")
+SECTIONS = (
+    ("spans", "q"),
+    ("bboxes", "d"),
+    ("tag_slots", "i"),
+    ("string_offsets", "q"),
+    ("strings", "B"),
+)
+# Filters run on the index may only read these properties.
+INDEXED_TAGS = ("place", "admin_level", "boundary")
+NO_SPAN = -1
+NO_VALUE = -1
+# The value is not a string; the feature is always decoded.
+OPAQUE = -2
+BUILD_BATCH = 4096
+
+
+def sidecar_path(source: Path) -> Path:
+    return source.with_name(source.name + SUFFIX)
+
+
+def tag_value(props: dict, key: str):
+    # Same lookup as the extractors' get_prop.
+    if key in props:
+        return props.get(key)
+    tags = props.get("tags")
+    if isinstance(tags, dict):
+        return tags.get(key)
+    return None
+
+
+def write_feature_index(source: Path, path: Path) -> int:
+    # One pass over the source: spans of each feature's properties and
+    # geometry, its indexed tags and its bbox (NaN when it has none).
+    sections = {name: array(code) for name, code in SECTIONS}
+    slots: Dict[str, int] = {}
+    strings = bytearray()
+    sections["string_offsets"].append(0)
+    geoms: List[dict] = []
+
+    def flush_bboxes() -> None:
+        for stats in geometry_stats_many(geoms):
+            sections["bboxes"].extend(stats[0] if stats is not None else (math.nan,) * 4)
+        geoms.clear()
+
+    def slot(value) -> int:
+        if value is None:
+            return NO_VALUE
+        if not isinstance(value, str):
+            return OPAQUE
+        if value not in slots:
+            slots[value] = len(slots)
+            strings.extend(value.encode("utf-8"))
+            sections["string_offsets"].append(len(strings))
+        return slots[value]
+
+    count = 0
+    with source.open("rb") as f:
+        if source.stat().st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for props_span, geom_span in iter_feature_spans(buf):
+                    count += 1
+                    for span in (props_span, geom_span):
+                        sections["spans"].extend(span if span else (NO_SPAN, NO_SPAN))
+                    props = json.loads(buf[props_span[0] : props_span[1]]) if props_span else {}
+                    if not isinstance(props, dict):
+                        props = {}
+                    sections["tag_slots"].extend(slot(tag_value(props, key)) for key in INDEXED_TAGS)
+                    geom = json.loads(buf[geom_span[0] : geom_span[1]]) if geom_span else None
+                    geoms.append(geom if isinstance(geom, dict) else {})
+                    if len(geoms) >= BUILD_BATCH:
+                        flush_bboxes()
+    flush_bboxes()
+    sections["strings"].frombytes(bytes(strings))
+
+    size, mtime = source_stamp(source)
+    header = HEADER.pack(MAGIC, VERSION, size, mtime, count, len(slots), len(strings))
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with tmp_path.open("wb") as f:
+        f.write(header)
+        for name, _ in SECTIONS:
+            data = sections[name]
+            if sys.byteorder != "little" and data.itemsize > 1:
+                data.byteswap()
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(data.tobytes())
+    tmp_path.replace(path)
+    return count
+
+
+class FeatureIndex:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = path.open("rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mm)
+        magic, version, source_size, source_mtime, count, n_strings, n_bytes = (
+            HEADER.unpack_from(view, 0)
+        )
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a feature index (version {VERSION})")
+        if sys.byteorder != "little":
+            raise ValueError("Feature index files can only be mapped on little-endian hosts")
+        self.source = (source_size, source_mtime)
+        self.count = count
+        lengths = {
+            "spans": count * 4,
+            "bboxes": count * 4,
+            "tag_slots": count * len(INDEXED_TAGS),
+            "string_offsets": n_strings + 1,
+            "strings": n_bytes,
+        }
+        offset = HEADER.size
+        for name, code in SECTIONS:
+            offset += -offset % 8
+            size = lengths[name] * struct.calcsize(code)
+            if offset + size > len(view):
+                raise ValueError(f"{path} is truncated")
+            setattr(self, name, view[offset : offset + size].cast(code))
+            offset += size
+        self.values = [
+            bytes(self.strings[self.string_offsets[i] : self.string_offsets[i + 1]]).decode("utf-8")
+            for i in range(n_strings)
+        ]
+
+    def feature_spans(self) -> Iterator[Tuple[Span, Span]]:
+        # Same (properties, geometry) spans iter_feature_spans yields.
+        spans = self.spans
+        for i in range(self.count):
+            p0, p1, g0, g1 = spans[i * 4 : i * 4 + 4]
+            yield (p0, p1) if p0 != NO_SPAN else None, (g0, g1) if g0 != NO_SPAN else None
+
+    def tags(self, i: int) -> Optional[dict]:
+        # The indexed properties of feature i (absent when null), or None
+        # when one of them is not a string and only decoding can tell.
+        props = {}
+        n = len(INDEXED_TAGS)
+        for key, value in zip(INDEXED_TAGS, self.tag_slots[i * n : i * n + n]):
+            if value == OPAQUE:
+                return None
+            if value != NO_VALUE:
+                props[key] = self.values[value]
+        return props
+
+    def bbox(self, i: int) -> Optional[BBox]:
+        box = tuple(self.bboxes[i * 4 : i * 4 + 4])
+        return None if math.isnan(box[0]) else box
+
+    def may_keep(self, i: int, keep: Optional[Callable[[dict], bool]]) -> bool:
+        if keep is None:
+            return True
+        props = self.tags(i)
+        return props is None or keep(props)
+
+    def close(self) -> None:
+        for name, _ in SECTIONS:
+            getattr(self, name).release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+
+
+def open_feature_index(path: Path, source: Optional[Path] = None) -> Optional[FeatureIndex]:
+    if not path.exists():
+        return None
+    try:
+        index = FeatureIndex(path)
+    except (ValueError, struct.error):
+        return None
+    if source is not None and index.source != source_stamp(source):
+        index.close()
+        return None
+    return index
+
+
+def get_feature_index(source: Path) -> FeatureIndex:
+    # The sidecar next to the source, rebuilt when missing or stale.
+    path = sidecar_path(source)
+    index = open_feature_index(path, source)
+    if index is None:
+        count = write_feature_index(source, path)
+        print(f"Wrote {path} ({count} features)")
+        index = FeatureIndex(path)
+    return index
+
+
+def iter_properties(
+    source: Path, index: FeatureIndex, keep: Optional[Callable[[dict], bool]] = None
+) -> Iterator[Tuple[int, dict]]:
+    # (feature index, properties) for the features whose indexed tags pass
+    # keep; geometries are never decoded.
+    with source.open("rb") as f:
+        if source.stat().st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for i, (props_span, _) in enumerate(index.feature_spans()):
+                if props_span is None or not index.may_keep(i, keep):
+                    continue
+                props = json.loads(buf[props_span[0] : props_span[1]])
+                if isinstance(props, dict):
+                    yield i, props
+
+
+def load_indexed_features(
+    path: Path, keep: Optional[Callable[[dict], bool]] = None, hints: Sequence[bytes] = ()
+) -> dict:
+    # load_features through the file's sidecar index (built on first use).
+    index = get_feature_index(path)
+    try:
+        return load_features(path, keep=keep, hints=hints, index=index)
+    finally:
+        index.close()
@@ -4,6 +4,8 @@ import json
 from pathlib import Path
 from typing import Dict, List, Set
 
+from output_manifest import entity_hashes, write_json_output
+
 
 def load_json(path: Path):
     with path.open("r", encoding="utf-8") as f:
@@ -48,12 +50,11 @@ def main() -> int:
     filtered = [city for city in cities if str(city.get("id")) in valid_city_ids]
     filtered.sort(key=lambda c: (c.get("name") or "").lower())
 
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(filtered, f, ensure_ascii=False, indent=2)
+    written = write_json_output(out_path, filtered, groups=entity_hashes(filtered))
 
     print(f"Input cities: {len(cities)}")
     print(f"Filtered cities: {len(filtered)}")
-    print(f"Wrote: {out_path}")
+    print(f"{'Wrote' if written else 'Unchanged'}: {out_path}")
     return 0
 
 
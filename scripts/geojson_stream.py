@@ -0,0 +1,156 @@
+import json
+import mmap
+import re
+from pathlib import Path
+from typing import Callable, Container, Iterator, Optional, Sequence, Tuple
+
+# Structural scan over the raw bytes. Coordinate arrays hold no braces or
+# quotes, so regex searches for [{}"] jump over them at C speed instead of
+# the JSON decoder materialising every coordinate.
+STRUCTURE = re.compile(rb'[{}"]')
+NESTING = re.compile(rb'[\[\]{}"]')
+STRING_BODY = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+WHITESPACE = re.compile(rb"\s*")
+SCALAR = re.compile(rb"[^,}\]\s]*")
+
+OPEN_OBJECT = ord("{")
+CLOSE_OBJECT = ord("}")
+OPEN_ARRAY = ord("[")
+CLOSE_ARRAY = ord("]")
+QUOTE = ord('"')
+
+# Placeholder for features rejected before decoding; keeps feature indexes
+# (and ids derived from them) unchanged. Never mutated.
+SKIPPED: dict = {}
+
+
+def skip_ws(buf, pos: int) -> int:
+    return WHITESPACE.match(buf, pos).end()
+
+
+def string_end(buf, pos: int) -> int:
+    match = STRING_BODY.match(buf, pos + 1)
+    if match is None:
+        raise ValueError(f"Unterminated string at byte {pos}")
+    return match.end()
+
+
+def container_end(buf, pos: int, pattern) -> int:
+    depth = 0
+    while True:
+        match = pattern.search(buf, pos)
+        if match is None:
+            raise ValueError(f"Unterminated value at byte {pos}")
+        ch = buf[match.start()]
+        if ch == QUOTE:
+            pos = string_end(buf, match.start())
+            continue
+        pos = match.end()
+        if ch in (OPEN_OBJECT, OPEN_ARRAY):
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+
+def skip_value(buf, pos: int) -> int:
+    ch = buf[pos]
+    if ch == OPEN_OBJECT:
+        # Brackets inside an object can be ignored when matching braces.
+        return container_end(buf, pos, STRUCTURE)
+    if ch == OPEN_ARRAY:
+        return container_end(buf, pos, NESTING)
+    if ch == QUOTE:
+        return string_end(buf, pos)
+    return SCALAR.match(buf, pos).end()
+
+
+def iter_members(buf, pos: int) -> Iterator[Tuple[bytes, int, int]]:
+    pos = skip_ws(buf, pos + 1)
+    if buf[pos] == CLOSE_OBJECT:
+        return
+    while True:
+        key_end = string_end(buf, pos)
+        key = bytes(buf[pos + 1 : key_end - 1])
+        pos = skip_ws(buf, key_end)
+        value_start = skip_ws(buf, pos + 1)
+        value_end = skip_value(buf, value_start)
+        yield key, value_start, value_end
+        pos = skip_ws(buf, value_end)
+        if buf[pos] == CLOSE_OBJECT:
+            return
+        pos = skip_ws(buf, pos + 1)
+
+
+def iter_feature_spans(buf) -> Iterator[Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]]:
+    pos = skip_ws(buf, skip_ws(buf, 0) + 1)
+    while buf[pos] != CLOSE_OBJECT:
+        key_end = string_end(buf, pos)
+        key = bytes(buf[pos + 1 : key_end - 1])
+        pos = skip_ws(buf, skip_ws(buf, key_end) + 1)
+        if key == b"features" and buf[pos] == OPEN_ARRAY:
+            pos = skip_ws(buf, pos + 1)
+            while buf[pos] != CLOSE_ARRAY:
+                props = geom = None
+                end = pos + 1
+                for member, value_start, value_end in iter_members(buf, pos):
+                    if member == b"properties":
+                        props = (value_start, value_end)
+                    elif member == b"geometry":
+                        geom = (value_start, value_end)
+                    end = value_end
+                yield props, geom
+                # end now sits before the feature's closing brace.
+                pos = skip_ws(buf, skip_ws(buf, end) + 1)
+                if buf[pos] == ord(","):
+                    pos = skip_ws(buf, pos + 1)
+            pos += 1
+        else:
+            pos = skip_value(buf, pos)
+        pos = skip_ws(buf, pos)
+        if buf[pos] == ord(","):
+            pos = skip_ws(buf, pos + 1)
+
+
+def load_features(
+    path: Path,
+    keep: Optional[Callable[[dict], bool]] = None,
+    hints: Sequence[bytes] = (),
+    index=None,
+    only: Optional[Container[int]] = None,
+) -> dict:
+    # Features whose raw properties lack any of the hint tokens, or whose
+    # decoded properties fail keep(), are never fully decoded; they are
+    # returned as SKIPPED so enumerate() still sees the file's indexes.
+    # With a feature_index.FeatureIndex for the file, the structural scan is
+    # skipped and keep() first runs on the indexed tags alone, so keep must
+    # only read feature_index.INDEXED_TAGS. Features whose index is not in
+    # `only` are skipped without being read.
+    features = []
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            return {"type": "FeatureCollection", "features": features}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            spans = index.feature_spans() if index is not None else iter_feature_spans(buf)
+            for i, (props_span, geom_span) in enumerate(spans):
+                if only is not None and i not in only:
+                    features.append(SKIPPED)
+                    continue
+                if index is not None and not index.may_keep(i, keep):
+                    features.append(SKIPPED)
+                    continue
+                if props_span is None:
+                    features.append(SKIPPED)
+                    continue
+                start, end = props_span
+                if any(buf.find(hint, start, end) < 0 for hint in hints):
+                    features.append(SKIPPED)
+                    continue
+                props = json.loads(buf[start:end]) or {}
+                if keep is not None and not keep(props):
+                    features.append(SKIPPED)
+                    continue
+                geom = json.loads(buf[geom_span[0] : geom_span[1]]) if geom_span else None
+                features.append({"type": "Feature", "properties": props, "geometry": geom})
+    return {"type": "FeatureCollection", "features": features}
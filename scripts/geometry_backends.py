@@ -0,0 +1,419 @@
+import argparse
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from geometry_kernels import geometry_stats
+from spatial_order import segment_reach
+
+try:
+    from shapely.geometry import Point as ShPoint
+    from shapely.geometry import shape
+    from shapely.prepared import prep
+
+    HAS_SHAPELY = True
+except Exception:
+    HAS_SHAPELY = False
+    ShPoint = None
+    shape = None
+    prep = None
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None
+
+try:
+    import shapely
+    from shapely import STRtree
+
+    HAS_STRTREE = HAS_NUMPY
+except Exception:
+    HAS_STRTREE = False
+    shapely = None
+    STRtree = None
+
+Point = Tuple[float, float]
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+# point_tester(polygons, points)(i, key): does polygons[key] cover points[i]?
+PointTest = Callable[[int, str], bool]
+# nearest(polygons, keys, point): the key whose polygon is closest to point.
+Nearest = Callable[[Dict[str, dict], Sequence[str], Point], Optional[str]]
+
+EDGE_EPS = 1e-9
+CALIBRATION_POLYGONS = 64
+CALIBRATION_POINTS = 4000
+
+
+def outer_rings(geom: dict) -> List[List[Point]]:
+    geom_type = geom.get("type")
+    coords = geom.get("coordinates")
+    if not coords:
+        return []
+    if geom_type == "Polygon":
+        return [list(map(tuple, coords[0]))] if coords else []
+    if geom_type == "MultiPolygon":
+        rings = []
+        for poly in coords:
+            if poly and poly[0]:
+                rings.append(list(map(tuple, poly[0])))
+        return rings
+    return []
+
+
+def point_on_segment(p: Point, a: Point, b: Point, eps: float = EDGE_EPS) -> bool:
+    (x, y), (x1, y1), (x2, y2) = p, a, b
+    sq_len = (x2 - x1) ** 2 + (y2 - y1) ** 2
+    if sq_len == 0:
+        # Closed rings repeat their first vertex; a zero-length segment only
+        # contains the vertex itself.
+        return abs(x - x1) <= eps and abs(y - y1) <= eps
+    cross = (y - y1) * (x2 - x1) - (x - x1) * (y2 - y1)
+    if abs(cross) > eps:
+        return False
+    dot = (x - x1) * (x2 - x1) + (y - y1) * (y2 - y1)
+    if dot < -eps:
+        return False
+    return dot <= sq_len + eps
+
+
+def point_in_ring(p: Point, ring: List[Point]) -> bool:
+    x, y = p
+    inside = False
+    n = len(ring)
+    if n < 3:
+        return False
+    for i in range(n):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % n]
+        if point_on_segment(p, (x1, y1), (x2, y2)):
+            return True
+        if (y1 > y) != (y2 > y):
+            x_intersect = (x2 - x1) * (y - y1) / (y2 - y1 + 0.0) + x1
+            if x_intersect > x:
+                inside = not inside
+    return inside
+
+
+def point_in_polygons(p: Point, rings: List[List[Point]]) -> bool:
+    # Rings are only outer rings. If point is in any outer ring, treat as inside.
+    for ring in rings:
+        if point_in_ring(p, ring):
+            return True
+    return False
+
+
+class GeometryBackend(ABC):
+    # A backend owns the fields it adds to a polygon's info dict (prepare)
+    # and the covers test over them. Backends sharing a model give identical
+    # bboxes, centres and covers results, so they can be swapped freely;
+    # they differ only in speed.
+    name = ""
+    model = ""
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def prepare(self, geom: dict) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def locate(self, geom: dict, fields: dict) -> Optional[Tuple[BBox, Point]]:
+        ...
+
+    @abstractmethod
+    def covers(self, info: dict, point: Point) -> bool:
+        ...
+
+    def reach(self, info: dict) -> float:
+        # How far outside its bbox covers() can still report a hit.
+        return 0.0
+
+    def nearest(
+        self, polygons: Dict[str, dict], keys: Sequence[str], point: Point
+    ) -> Optional[str]:
+        # Fallback for points no candidate covers: the closest centre, first
+        # key on ties. Every model uses the centre its locate() gave.
+        best_key = None
+        best_dist = None
+        for key in keys:
+            center = polygons[key]["centroid"]
+            dist = (point[0] - center[0]) ** 2 + (point[1] - center[1]) ** 2
+            if best_dist is None or dist < best_dist:
+                best_dist = dist
+                best_key = key
+        return best_key
+
+    def point_tester(self, polygons: Dict[str, dict], points: Sequence[Point]) -> PointTest:
+        def test(i: int, key: str) -> bool:
+            return self.covers(polygons[key], points[i])
+
+        return test
+
+
+class PythonBackend(GeometryBackend):
+    # Outer rings only, even-odd with points on edges covered; bbox and
+    # centre come from the geometry kernel.
+    name = "python"
+    model = "rings"
+
+    def prepare(self, geom: dict) -> Optional[dict]:
+        rings = outer_rings(geom)
+        if not rings:
+            return None
+        return {"rings": rings}
+
+    def locate(self, geom: dict, fields: dict) -> Optional[Tuple[BBox, Point]]:
+        stats = geometry_stats(geom)
+        if stats is None:
+            return None
+        return stats[0], stats[1]
+
+    def covers(self, info: dict, point: Point) -> bool:
+        return point_in_polygons(point, info["rings"])
+
+    def reach(self, info: dict) -> float:
+        return segment_reach(info["rings"], EDGE_EPS)
+
+
+class NumpyBackend(PythonBackend):
+    # Same test as PythonBackend, evaluated for every point inside a
+    # polygon's (reach-widened) bbox at once. Every float operation matches
+    # point_on_segment / point_in_ring, so results are bit-identical.
+    name = "numpy"
+    CHUNK = 1 << 20
+
+    def available(self) -> bool:
+        return HAS_NUMPY
+
+    def point_tester(self, polygons: Dict[str, dict], points: Sequence[Point]) -> PointTest:
+        covered: Dict[int, set] = {}
+        if points:
+            xy = np.asarray(points, dtype=np.float64)
+            order = np.argsort(xy[:, 0], kind="stable")
+            xs = xy[order, 0]
+            for key, info in polygons.items():
+                bbox = info["bbox"]
+                r = self.reach(info)
+                lo = np.searchsorted(xs, bbox[0] - r, side="left")
+                hi = np.searchsorted(xs, bbox[2] + r, side="right")
+                if lo == hi:
+                    continue
+                idx = order[lo:hi]
+                y = xy[idx, 1]
+                idx = idx[(y >= bbox[1] - r) & (y <= bbox[3] + r)]
+                if not len(idx):
+                    continue
+                hit = np.zeros(len(idx), dtype=bool)
+                for ring in info["rings"]:
+                    if len(ring) >= 3:
+                        hit |= self.ring_hits(ring, xy[idx])
+                for i in idx[hit].tolist():
+                    covered.setdefault(i, set()).add(key)
+
+        def test(i: int, key: str) -> bool:
+            return key in covered.get(i, ())
+
+        return test
+
+    def ring_hits(self, ring: List[Point], pts):
+        n = len(ring)
+        edges = [(ring[i], ring[(i + 1) % n]) for i in range(n)]
+        # Squared lengths go through Python's float pow, as in
+        # point_on_segment; numpy's pow can differ in the last bit.
+        sq_len = np.array([(b[0] - a[0]) ** 2 + (b[1] - a[1]) ** 2 for a, b in edges])
+        x1 = np.array([a[0] for a, _ in edges])
+        y1 = np.array([a[1] for a, _ in edges])
+        x2 = np.array([b[0] for _, b in edges])
+        y2 = np.array([b[1] for _, b in edges])
+        dx = x2 - x1
+        dy = y2 - y1
+        degenerate = sq_len == 0
+        out = np.zeros(len(pts), dtype=bool)
+        step = max(1, self.CHUNK // n)
+        for start in range(0, len(pts), step):
+            x = pts[start : start + step, 0:1]
+            y = pts[start : start + step, 1:2]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cross = (y - y1) * dx - (x - x1) * dy
+                dot = (x - x1) * dx + (y - y1) * dy
+                on_edge = np.where(
+                    degenerate,
+                    (np.abs(x - x1) <= EDGE_EPS) & (np.abs(y - y1) <= EDGE_EPS),
+                    (np.abs(cross) <= EDGE_EPS)
+                    & (dot >= -EDGE_EPS)
+                    & (dot <= sq_len + EDGE_EPS),
+                )
+                straddles = (y1 > y) != (y2 > y)
+                x_intersect = dx * (y - y1) / (y2 - y1 + 0.0) + x1
+                crossings = np.count_nonzero(straddles & (x_intersect > x), axis=1)
+            out[start : start + step] = on_edge.any(axis=1) | (crossings % 2 == 1)
+        return out
+
+
+class ShapelyPreparedBackend(GeometryBackend):
+    # Full geometry (holes included) via prepared GEOS predicates; bbox is
+    # the shape bounds and the centre its representative point.
+    name = "shapely-prepared"
+    model = "shapely"
+
+    def available(self) -> bool:
+        return HAS_SHAPELY
+
+    def prepare(self, geom: dict) -> Optional[dict]:
+        try:
+            poly = shape(geom)
+        except Exception:
+            return None
+        if poly.is_empty:
+            return None
+        return {"prepared": prep(poly)}
+
+    def locate(self, geom: dict, fields: dict) -> Optional[Tuple[BBox, Point]]:
+        poly = fields["prepared"].context
+        center = poly.representative_point()
+        return poly.bounds, (center.x, center.y)
+
+    def covers(self, info: dict, point: Point) -> bool:
+        return info["prepared"].covers(ShPoint(point[0], point[1]))
+
+
+class ShapelyTreeBackend(ShapelyPreparedBackend):
+    # Same predicate as ShapelyPreparedBackend, answered for all points in
+    # one STRtree bulk query.
+    name = "shapely-strtree"
+
+    def available(self) -> bool:
+        return HAS_STRTREE
+
+    def point_tester(self, polygons: Dict[str, dict], points: Sequence[Point]) -> PointTest:
+        covered: Dict[int, set] = {}
+        keys = list(polygons)
+        if points and keys:
+            tree = STRtree([polygons[key]["prepared"].context for key in keys])
+            xy = np.asarray(points, dtype=np.float64)
+            point_idx, poly_idx = tree.query(shapely.points(xy), predicate="covered_by")
+            for i, k in zip(point_idx.tolist(), poly_idx.tolist()):
+                covered.setdefault(i, set()).add(keys[k])
+
+        def test(i: int, key: str) -> bool:
+            return key in covered.get(i, ())
+
+        return test
+
+
+BACKENDS: Dict[str, GeometryBackend] = {
+    backend.name: backend
+    for backend in (
+        ShapelyPreparedBackend(),
+        ShapelyTreeBackend(),
+        PythonBackend(),
+        NumpyBackend(),
+    )
+}
+MODELS = ("shapely", "rings")
+# "auto" times the engines of the default model (shapely when installed);
+# "auto-<model>" the engines of that model.
+AUTO_CHOICES = ("auto",) + tuple(f"auto-{model}" for model in MODELS)
+BACKEND_CHOICES = AUTO_CHOICES + tuple(BACKENDS)
+
+
+def get_backend(name: str) -> GeometryBackend:
+    backend = BACKENDS[name]
+    if not backend.available():
+        raise SystemExit(f"Geometry backend {name} is not available here")
+    return backend
+
+
+def calibrate(backends: Sequence[GeometryBackend], geoms: Sequence[dict]) -> GeometryBackend:
+    # Times prepare + point tests on a fixed sample; all candidates share a
+    # model, so whichever wins the output is the same.
+    step = max(1, len(geoms) // CALIBRATION_POLYGONS)
+    sample = list(geoms[::step][:CALIBRATION_POLYGONS])
+    best = None
+    best_time = None
+    for backend in backends:
+        start = time.perf_counter()
+        polygons: Dict[str, dict] = {}
+        for i, geom in enumerate(sample):
+            fields = backend.prepare(geom)
+            if fields is None:
+                continue
+            located = backend.locate(geom, fields)
+            if located is None:
+                continue
+            fields["bbox"] = located[0]
+            polygons[str(i)] = fields
+        if not polygons:
+            return backends[0]
+        boxes = [info["bbox"] for info in polygons.values()]
+        rng = random.Random(0)
+        min_x = min(b[0] for b in boxes)
+        min_y = min(b[1] for b in boxes)
+        max_x = max(b[2] for b in boxes)
+        max_y = max(b[3] for b in boxes)
+        points = [
+            (rng.uniform(min_x, max_x), rng.uniform(min_y, max_y))
+            for _ in range(CALIBRATION_POINTS)
+        ]
+        test = backend.point_tester(polygons, points)
+        for i, (x, y) in enumerate(points):
+            for key, info in polygons.items():
+                bbox = info["bbox"]
+                if bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3] and test(i, key):
+                    break
+        elapsed = time.perf_counter() - start
+        if best_time is None or elapsed < best_time:
+            best, best_time = backend, elapsed
+    return best
+
+
+def select_backend(name: str, geoms: Sequence[dict]) -> GeometryBackend:
+    # Autos calibrate among the available engines of their model.
+    if name not in AUTO_CHOICES:
+        return get_backend(name)
+    if name == "auto":
+        model = "shapely" if HAS_SHAPELY else "rings"
+    else:
+        model = name[len("auto-") :]
+    candidates = [b for b in BACKENDS.values() if b.model == model and b.available()]
+    if not candidates:
+        raise SystemExit(f"No {model} geometry backend is available here")
+    if len(candidates) == 1:
+        return candidates[0]
+    return calibrate(candidates, geoms)
+
+
+def add_backend_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--no-shapely",
+        action="store_true",
+        help="Disable shapely join even if installed (same as --backend auto-rings)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKEND_CHOICES,
+        default="auto",
+        help="Point-in-polygon engine (auto = fastest engine for the default "
+        "geometry model, timed on a sample of the cities; auto-MODEL = fastest "
+        "engine for that model)",
+    )
+
+
+def backend_from_args(args: argparse.Namespace, parser: argparse.ArgumentParser) -> str:
+    # The one place --no-shapely is read: it narrows --backend to the rings
+    # model.
+    name = args.backend
+    if args.no_shapely:
+        if name == "auto":
+            return "auto-rings"
+        if name == "auto-shapely" or (name in BACKENDS and BACKENDS[name].model == "shapely"):
+            parser.error(f"--no-shapely cannot be combined with --backend {name}")
+    elif name == "auto" and not HAS_SHAPELY:
+        print("Shapely not available, using manual point-in-polygon.")
+    return name
@@ -0,0 +1,186 @@
+import math
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None
+
+Point = Tuple[float, float]
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+# bbox, centroid, planar area in square degrees, vertex count
+GeometryStats = Tuple[BBox, Point, float, int]
+# Ring role: 1 = polygon shell, -1 = hole, 0 = points/lines (no area)
+Rings = List[Tuple[list, int]]
+
+BATCH_SIZE = 1024
+
+
+def geometry_rings(geom: dict) -> Rings:
+    geom_type = geom.get("type")
+    coords = geom.get("coordinates")
+    if not coords:
+        return []
+    if geom_type == "Point":
+        rings = [([coords], 0)]
+    elif geom_type in ("MultiPoint", "LineString"):
+        rings = [(coords, 0)]
+    elif geom_type == "MultiLineString":
+        rings = [(line, 0) for line in coords]
+    elif geom_type == "Polygon":
+        rings = [(ring, 1 if i == 0 else -1) for i, ring in enumerate(coords)]
+    elif geom_type == "MultiPolygon":
+        rings = [
+            (ring, 1 if i == 0 else -1) for poly in coords for i, ring in enumerate(poly)
+        ]
+    else:
+        return []
+    return [(ring, role) for ring, role in rings if ring]
+
+
+def finish_stats(
+    bbox: BBox, sx: float, sy: float, count: int, weight: float, wx: float, wy: float
+) -> GeometryStats:
+    # Area-weighted centroid when the rings enclose any area; points, lines
+    # and degenerate polygons fall back to the vertex average.
+    if weight > 0:
+        center = (wx / weight, wy / weight)
+    else:
+        center = (sx / count, sy / count)
+    return bbox, center, weight / 2, count
+
+
+def stats_python(rings: Rings) -> Optional[GeometryStats]:
+    min_lon = min_lat = math.inf
+    max_lon = max_lat = -math.inf
+    sx = sy = 0.0
+    count = 0
+    weight = wx = wy = 0.0
+    for ring, role in rings:
+        for pt in ring:
+            lon, lat = pt[0], pt[1]
+            min_lon = min(min_lon, lon)
+            min_lat = min(min_lat, lat)
+            max_lon = max(max_lon, lon)
+            max_lat = max(max_lat, lat)
+            sx += lon
+            sy += lat
+            count += 1
+        if not role:
+            continue
+        # Shoelace sums relative to the first vertex to limit cancellation.
+        x0, y0 = ring[0][0], ring[0][1]
+        a2 = cx = cy = 0.0
+        n = len(ring)
+        for i in range(n):
+            x1 = ring[i][0] - x0
+            y1 = ring[i][1] - y0
+            x2 = ring[(i + 1) % n][0] - x0
+            y2 = ring[(i + 1) % n][1] - y0
+            cross = x1 * y2 - x2 * y1
+            a2 += cross
+            cx += (x1 + x2) * cross
+            cy += (y1 + y2) * cross
+        if a2:
+            w = role * abs(a2)
+            weight += w
+            wx += w * (cx / (3 * a2) + x0)
+            wy += w * (cy / (3 * a2) + y0)
+    if count == 0:
+        return None
+    return finish_stats((min_lon, min_lat, max_lon, max_lat), sx, sy, count, weight, wx, wy)
+
+
+def stats_numpy(ring_lists: List[Rings]) -> List[Optional[GeometryStats]]:
+    pts: list = []
+    ring_sizes: List[int] = []
+    ring_roles: List[int] = []
+    ring_owner: List[int] = []
+    sizes: List[int] = []
+    for owner, rings in enumerate(ring_lists):
+        size = 0
+        for ring, role in rings:
+            pts.extend(ring)
+            ring_sizes.append(len(ring))
+            ring_roles.append(role)
+            ring_owner.append(owner)
+            size += len(ring)
+        sizes.append(size)
+    out: List[Optional[GeometryStats]] = [None] * len(ring_lists)
+    if not pts:
+        return out
+    try:
+        coords = np.array(pts, dtype=np.float64)
+    except ValueError:
+        coords = np.array([pt[:2] for pt in pts], dtype=np.float64)
+    x = np.ascontiguousarray(coords[:, 0])
+    y = np.ascontiguousarray(coords[:, 1])
+
+    # bincount sums sequentially, so these match stats_python bit for bit.
+    n_rings = len(ring_sizes)
+    ring_len = np.array(ring_sizes, dtype=np.int64)
+    ring_start = np.concatenate(([0], np.cumsum(ring_len)[:-1]))
+    ring_id = np.repeat(np.arange(n_rings), ring_len)
+    nxt = np.arange(len(x)) + 1
+    nxt[ring_start + ring_len - 1] = ring_start
+    x0 = x[ring_start]
+    y0 = y[ring_start]
+    dx = x - x0[ring_id]
+    dy = y - y0[ring_id]
+    dxn = dx[nxt]
+    dyn = dy[nxt]
+    cross = dx * dyn - dxn * dy
+    a2 = np.bincount(ring_id, weights=cross, minlength=n_rings)
+    cx = np.bincount(ring_id, weights=(dx + dxn) * cross, minlength=n_rings)
+    cy = np.bincount(ring_id, weights=(dy + dyn) * cross, minlength=n_rings)
+    roles = np.array(ring_roles, dtype=np.float64)
+    valid = (roles != 0) & (a2 != 0)
+    safe = np.where(valid, a2, 1.0)
+    w = np.where(valid, roles * np.abs(a2), 0.0)
+    owner = np.array(ring_owner, dtype=np.int64)
+    n_geoms = len(ring_lists)
+    weight = np.bincount(owner, weights=w, minlength=n_geoms)
+    wx = np.bincount(owner, weights=np.where(valid, w * (cx / (3 * safe) + x0), 0.0), minlength=n_geoms)
+    wy = np.bincount(owner, weights=np.where(valid, w * (cy / (3 * safe) + y0), 0.0), minlength=n_geoms)
+
+    counts = np.array(sizes, dtype=np.int64)
+    point_owner = np.repeat(np.arange(n_geoms), counts)
+    sx = np.bincount(point_owner, weights=x, minlength=n_geoms)
+    sy = np.bincount(point_owner, weights=y, minlength=n_geoms)
+    present = np.flatnonzero(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+    min_x = np.minimum.reduceat(x, starts)
+    min_y = np.minimum.reduceat(y, starts)
+    max_x = np.maximum.reduceat(x, starts)
+    max_y = np.maximum.reduceat(y, starts)
+    for k, i in enumerate(present.tolist()):
+        bbox = (float(min_x[k]), float(min_y[k]), float(max_x[k]), float(max_y[k]))
+        out[i] = finish_stats(
+            bbox,
+            float(sx[i]),
+            float(sy[i]),
+            int(counts[i]),
+            float(weight[i]),
+            float(wx[i]),
+            float(wy[i]),
+        )
+    return out
+
+
+def geometry_stats_many(
+    geoms: Iterable[dict], batch_size: int = BATCH_SIZE
+) -> List[Optional[GeometryStats]]:
+    ring_lists = [geometry_rings(geom) for geom in geoms]
+    if not HAS_NUMPY:
+        return [stats_python(rings) for rings in ring_lists]
+    out: List[Optional[GeometryStats]] = []
+    for start in range(0, len(ring_lists), batch_size):
+        out.extend(stats_numpy(ring_lists[start : start + batch_size]))
+    return out
+
+
+def geometry_stats(geom: dict) -> Optional[GeometryStats]:
+    return stats_python(geometry_rings(geom))
@@ -0,0 +1,252 @@
+import math
+import statistics
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from city_match import Grid, match_city
+from geometry_backends import Nearest
+from spatial_order import bbox_cells
+
+Point = Tuple[float, float]
+# covers(i, city_id): does that city cover sample point i?
+SampleTest = Callable[[int, str], bool]
+
+TUNE_SAMPLE = 2000
+# Points matched between checks of a setting's running cost.
+COST_CHECK = 100
+# Cell sizes tried, as multiples of the median city extent.
+CELL_SCALES = (0.25, 0.5, 1.0, 2.0, 4.0)
+CANDIDATE_RADII = (0, 1, 2)
+MAX_FALLBACK_RADIUS = 6
+
+
+class GridSetting:
+    def __init__(self, cell_size: float, candidate_radius: int, fallback_radius: int) -> None:
+        self.cell_size = cell_size
+        self.candidate_radius = candidate_radius
+        self.fallback_radius = fallback_radius
+
+    def key(self) -> Tuple[float, int, int]:
+        # A fallback radius at or below the candidate radius never runs.
+        fallback = max(self.fallback_radius, self.candidate_radius)
+        return (self.cell_size, self.candidate_radius, fallback)
+
+    def describe(self) -> str:
+        return (
+            f"cell size {self.cell_size:g}, candidate radius {self.candidate_radius}, "
+            f"fallback radius {self.fallback_radius}"
+        )
+
+
+class SettingRun:
+    # Counters for one setting over the sample; cost is the measured walk
+    # over the grid plus the polygon tests it asked for.
+    def __init__(self, setting: GridSetting) -> None:
+        self.setting = setting
+        self.candidates = 0
+        self.tests = 0
+        self.fallbacks = 0
+        self.points = 0
+        self.cost = 0.0
+
+    def describe(self) -> str:
+        n = max(self.points, 1)
+        return (
+            f"{self.candidates / n:.1f} candidates, {self.tests / n:.2f} polygon tests "
+            f"per point, {self.fallbacks / n:.1%} fallbacks"
+        )
+
+
+def sample_indexes(count: int, size: int = TUNE_SAMPLE) -> List[int]:
+    step = max(1, count // size)
+    return list(range(0, count, step))[:size]
+
+
+def build_grid(city_polygons: Dict[str, dict], cell_size: float) -> Grid:
+    # Same cells, in the same order, as the extractors' own grids.
+    grid: Grid = {}
+    for city_id, info in city_polygons.items():
+        for cell in bbox_cells(info["bbox"], cell_size):
+            grid.setdefault(cell, []).append(city_id)
+    return grid
+
+
+def grid_match(
+    i: int,
+    center: Point,
+    city_polygons: Dict[str, dict],
+    grid: Grid,
+    setting: GridSetting,
+    covers: SampleTest,
+    nearest: Optional[Nearest],
+    run: SettingRun,
+) -> Optional[str]:
+    # The extractors' match_city without the lookup table and last-hit
+    # cache, which never change the answer; run counts the work it does.
+    searches = 0
+    covered = False
+
+    def counted(candidates: List[str]) -> None:
+        nonlocal searches
+        searches += 1
+        run.candidates += len(candidates)
+
+    def test(city_id: str) -> bool:
+        nonlocal covered
+        run.tests += 1
+        covered = covers(i, city_id)
+        return covered
+
+    matched = match_city(
+        center,
+        city_polygons,
+        grid,
+        setting.cell_size,
+        test,
+        setting.candidate_radius,
+        setting.fallback_radius,
+        nearest,
+        on_candidates=counted,
+    )
+    # A second search, or the nearest fallback straight after the first.
+    if searches > 1 or (matched is not None and not covered):
+        run.fallbacks += 1
+    return matched
+
+
+def exhaustive_covering(
+    points: Sequence[Point],
+    city_polygons: Dict[str, dict],
+    reach: Dict[str, float],
+    covers: SampleTest,
+) -> Tuple[List[Optional[str]], float]:
+    # First city, in city order, covering each point: every city whose bbox
+    # (widened by how far its test can reach) holds the point is tested.
+    # Also returns the mean cost of one polygon test.
+    found: List[Optional[str]] = [None] * len(points)
+    tests = 0
+    start = time.perf_counter()
+    for city_id, info in city_polygons.items():
+        bbox = info["bbox"]
+        r = reach.get(city_id, 0.0)
+        for i, (x, y) in enumerate(points):
+            if found[i] is not None:
+                continue
+            if bbox[0] - r <= x <= bbox[2] + r and bbox[1] - r <= y <= bbox[3] + r:
+                tests += 1
+                if covers(i, city_id):
+                    found[i] = city_id
+    elapsed = time.perf_counter() - start
+    return found, elapsed / tests if tests else 0.0
+
+
+def cell_sizes(city_polygons: Dict[str, dict], current: float) -> List[float]:
+    extents = [
+        max(info["bbox"][2] - info["bbox"][0], info["bbox"][3] - info["bbox"][1])
+        for info in city_polygons.values()
+    ]
+    extents = [e for e in extents if e > 0]
+    sizes = {current}
+    if extents:
+        median = statistics.median(extents)
+        sizes.update(float(f"{median * scale:.2g}") for scale in CELL_SCALES)
+    return sorted(size for size in sizes if size > 0)
+
+
+def candidate_settings(sizes: Sequence[float], current: GridSetting) -> List[GridSetting]:
+    settings = [current]
+    seen = {current.key()}
+    for cell_size in sizes:
+        for candidate_radius in CANDIDATE_RADII:
+            for fallback_radius in range(candidate_radius, MAX_FALLBACK_RADIUS + 1):
+                setting = GridSetting(cell_size, candidate_radius, fallback_radius)
+                if setting.key() not in seen:
+                    seen.add(setting.key())
+                    settings.append(setting)
+    return settings
+
+
+def auto_tune(
+    points: Sequence[Point],
+    city_polygons: Dict[str, dict],
+    reach: Dict[str, float],
+    covers: SampleTest,
+    current: GridSetting,
+    nearest: Optional[Nearest],
+    fixed_cell_size: bool = False,
+) -> GridSetting:
+    # Picks the cheapest setting whose assignments on the sample match an
+    # exhaustive search: the first covering city for covered points, and
+    # the configured nearest-centroid fallback (a search bounded by the
+    # current radii by design) for the rest.
+    if not points or not city_polygons:
+        print("Auto-tune: nothing to sample, keeping the configured grid")
+        return current
+
+    cache: Dict[Tuple[int, str], bool] = {}
+
+    def cached(i: int, city_id: str) -> bool:
+        key = (i, city_id)
+        hit = cache.get(key)
+        if hit is None:
+            hit = cache[key] = covers(i, city_id)
+        return hit
+
+    covering, test_cost = exhaustive_covering(points, city_polygons, reach, cached)
+    grids: Dict[float, Grid] = {}
+
+    def evaluate(
+        setting: GridSetting,
+        expected: Optional[List[Optional[str]]],
+        budget: float = math.inf,
+    ):
+        # Gives up (None) on the first disagreement, or once the setting
+        # has cost more than `budget`.
+        grid = grids.get(setting.cell_size)
+        if grid is None:
+            grid = grids[setting.cell_size] = build_grid(city_polygons, setting.cell_size)
+        run = SettingRun(setting)
+        answers: List[Optional[str]] = []
+        start = time.perf_counter()
+        for i, center in enumerate(points):
+            answer = grid_match(
+                i, center, city_polygons, grid, setting, cached, nearest, run
+            )
+            if expected is not None and answer != expected[i]:
+                return None, answers
+            answers.append(answer)
+            run.points += 1
+            if run.points % COST_CHECK == 0:
+                if time.perf_counter() - start + run.tests * test_cost > budget:
+                    return None, answers
+        run.cost = time.perf_counter() - start + run.tests * test_cost
+        return run, answers
+
+    base, base_answers = evaluate(current, None)
+    reference = [
+        covering[i] if covering[i] is not None else base_answers[i] for i in range(len(points))
+    ]
+    differs = sum(1 for a, b in zip(base_answers, reference) if a != b)
+
+    sizes = [current.cell_size] if fixed_cell_size else cell_sizes(city_polygons, current.cell_size)
+    settings = candidate_settings(sizes, current)
+    best = None
+    for setting in settings:
+        run, _ = evaluate(setting, reference, best.cost if best is not None else math.inf)
+        if run is not None and (best is None or run.cost < best.cost):
+            best = run
+
+    print(
+        f"Auto-tune: {len(points)} sample points "
+        f"({sum(1 for c in covering if c is not None)} covered), {len(settings)} settings tried"
+    )
+    if differs:
+        print(f"Auto-tune: the configured grid differs from it on {differs} sample points")
+    if best is None:
+        print("Auto-tune: no setting matches the exhaustive search, keeping the configured grid")
+        return current
+    print(f"Auto-tune: configured {current.describe()} ({base.describe()})")
+    print(f"Auto-tune: chosen {best.setting.describe()} ({best.describe()})")
+    speedup = base.cost / best.cost if best.cost > 0 else 1.0
+    print(f"Auto-tune: expected matching speedup {speedup:.2f}x")
+    return best.setting
@@ -5,10 +5,13 @@ import json
 import os
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Set
 
 import requests
 
+from export_profile import load_export
+from output_manifest import entity_hashes, grouped_hashes, recorded_groups
+
 
 def load_json(path: Path):
     with path.open("r", encoding="utf-8") as f:
@@ -35,6 +38,42 @@ def post_batch(url: str, headers: Dict[str, str], batch: List[Dict[str, Any]]):
         raise RuntimeError(f"{resp.status_code} {resp.text} ({url})")
 
 
+def delete_rows(
+    url: str,
+    headers: Dict[str, str],
+    column: str,
+    ids: Set[str],
+    size: int,
+    filters: Dict[str, str] | None = None,
+):
+    # PostgREST in.(...) list; ids are double-quoted (backslash escapes) so
+    # commas and parentheses in them survive.
+    for batch in chunked(sorted(ids), size):
+        params = dict(filters or {})
+        values = (v.replace("\\", "\\\\").replace('"', '\\"') for v in batch)
+        params[column] = "in.(" + ",".join(f'"{v}"' for v in values) + ")"
+        resp = requests.delete(url, headers=headers, params=params)
+        if not resp.ok:
+            raise RuntimeError(f"{resp.status_code} {resp.text} ({url})")
+
+
+def grouped_ids(grouped: Dict[str, Any]) -> Dict[str, List[str]]:
+    ids: Dict[str, List[str]] = {}
+    for city_id, items in grouped.items():
+        if city_id == "_unassigned" or not isinstance(items, list):
+            continue
+        ids[city_id] = [str(item.get("id")) for item in items]
+    return ids
+
+
+def removed_ids(previous: Dict[str, List[str]], current: Dict[str, List[str]]) -> Set[str]:
+    return all_ids(previous.values()) - all_ids(current.values())
+
+
+def all_ids(groups: Iterable[List[str]]) -> Set[str]:
+    return {entity_id for ids in groups for entity_id in ids}
+
+
 def decode_role_from_jwt(token: str) -> str | None:
     parts = token.split(".")
     if len(parts) < 2:
@@ -53,6 +92,30 @@ def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--cities", default="data/exports/cities.filtered.json")
     parser.add_argument("--places", default="data/exports/places_by_city.best.json")
+    parser.add_argument(
+        "--search-index",
+        default="",
+        help="Search index JSON from build_search_index.py (empty = skip)",
+    )
+    parser.add_argument(
+        "--neighbours",
+        default="",
+        help="Neighbours JSON from build_neighbours.py (empty = skip)",
+    )
+    parser.add_argument(
+        "--gazetteer",
+        default="",
+        help="Gazetteer JSON from build_gazetteer.py (empty = skip)",
+    )
+    parser.add_argument(
+        "--state",
+        default="",
+        help=(
+            "Import state JSON; cities whose export hashes match the last "
+            "successful import are skipped, and cities, places and gazetteer "
+            "entries missing since then are deleted (empty = import everything)"
+        ),
+    )
     parser.add_argument("--batch-size", type=int, default=500)
     parser.add_argument("--dry-run", action="store_true")
     parser.add_argument("--upsert", action="store_true")
@@ -81,9 +144,11 @@ def main() -> int:
     cities_path = (repo_root / args.cities).resolve()
     places_path = (repo_root / args.places).resolve()
 
-    cities = load_json(cities_path)
-    places_by_city = load_json(places_path)
+    cities = load_export(cities_path)
+    places_by_city = load_export(places_path)
 
+    # geohash, bbox_geohash, area9_id and area10_id need the columns from
+    # supabase/migrations/20261019120000_location_spatial_keys.sql.
     city_fields = {
         "id",
         "name",
@@ -93,6 +158,8 @@ def main() -> int:
         "wikipedia",
         "centroid",
         "bbox",
+        "geohash",
+        "bbox_geohash",
     }
     place_fields = {
         "id",
@@ -109,19 +176,120 @@ def main() -> int:
         "name_eu",
         "centroid",
         "bbox",
+        "area9_id",
+        "area10_id",
+        "geohash",
+        "bbox_geohash",
+    }
+    gazetteer_fields = place_fields | {"area_id", "place_id", "sources", "match_km"}
+
+    # Per-city hashes from the exports' manifests (recomputed when a file no
+    # longer matches its manifest entry).
+    city_hashes = recorded_groups(cities_path) or entity_hashes(cities)
+    place_hashes = recorded_groups(places_path) or grouped_hashes(places_by_city)
+    state_path = (repo_root / args.state).resolve() if args.state.strip() else None
+    previous: Dict[str, Dict[str, Any]] = {
+        "cities": {},
+        "places": {},
+        "gazetteer": {},
+        "place_ids": {},
+        "gazetteer_ids": {},
     }
+    if state_path is not None and state_path.exists():
+        previous.update(load_json(state_path))
+    # Entities in the last import that the exports no longer hold.
+    place_ids = grouped_ids(places_by_city)
+    removed_cities: Set[str] = set()
+    removed_places: Set[str] = set()
+    if state_path is not None:
+        removed_cities = set(previous["cities"]) - set(city_hashes)
+        removed_places = removed_ids(previous["place_ids"], place_ids)
+    unchanged_cities = {
+        city_id
+        for city_id, digest in city_hashes.items()
+        if previous["cities"].get(city_id) == digest
+    }
+    unchanged_places = {
+        city_id
+        for city_id, digest in place_hashes.items()
+        if previous["places"].get(city_id) == digest
+    }
+    skipped_cities = sum(1 for c in cities if str(c.get("id")) in unchanged_cities)
 
-    cities = [{k: c.get(k) for k in city_fields} for c in cities]
+    cities = [
+        {k: c.get(k) for k in city_fields}
+        for c in cities
+        if str(c.get("id")) not in unchanged_cities
+    ]
 
     places: List[Dict[str, Any]] = []
     for city_id, items in places_by_city.items():
         if city_id == "_unassigned":
             continue
+        if city_id in unchanged_places:
+            continue
         if not isinstance(items, list):
             continue
         for item in items:
             places.append({k: item.get(k) for k in place_fields})
 
+    search_rows: List[Dict[str, Any]] = []
+    if args.search_index.strip():
+        search_path = (repo_root / args.search_index).resolve()
+        for entry in load_json(search_path):
+            city_id = str(entry["city_id"])
+            if city_id in unchanged_cities and city_id in unchanged_places:
+                continue
+            for key in entry["keys"]:
+                search_rows.append(
+                    {
+                        "key": key,
+                        "kind": entry["kind"],
+                        "entity_id": entry["id"],
+                        "city_id": entry["city_id"],
+                        "name_norm": entry["name_norm"],
+                    }
+                )
+
+    gazetteer_rows: List[Dict[str, Any]] = []
+    gazetteer_hashes: Dict[str, str] = {}
+    gazetteer_ids: Dict[str, List[str]] = {}
+    removed_gazetteer: Set[str] = set()
+    skipped_gazetteer = 0
+    if args.gazetteer.strip():
+        gazetteer_path = (repo_root / args.gazetteer).resolve()
+        gazetteer = load_export(gazetteer_path)
+        gazetteer_hashes = recorded_groups(gazetteer_path) or grouped_hashes(gazetteer)
+        gazetteer_ids = grouped_ids(gazetteer)
+        if state_path is not None:
+            removed_gazetteer = removed_ids(previous["gazetteer_ids"], gazetteer_ids)
+        for city_id, items in gazetteer.items():
+            if city_id == "_unassigned" or not isinstance(items, list):
+                continue
+            if previous["gazetteer"].get(city_id) == gazetteer_hashes.get(city_id):
+                skipped_gazetteer += 1
+                continue
+            for item in items:
+                gazetteer_rows.append({k: item.get(k) for k in gazetteer_fields})
+
+    place_neighbour_rows: List[Dict[str, Any]] = []
+    city_neighbour_rows: List[Dict[str, Any]] = []
+    if args.neighbours.strip():
+        neighbours = load_json((repo_root / args.neighbours).resolve())
+        for place_id, items in neighbours.get("places", {}).items():
+            for rank, item in enumerate(items, start=1):
+                place_neighbour_rows.append(
+                    {
+                        "place_id": place_id,
+                        "neighbour_id": item["id"],
+                        "distance_km": item["distance_km"],
+                        "rank": rank,
+                    }
+                )
+        for city_id, ids in neighbours.get("cities", {}).items():
+            for neighbour_id in ids:
+                city_neighbour_rows.append({"city_id": city_id, "neighbour_id": neighbour_id})
+
     prefer_header = "return=minimal"
     if args.upsert:
         prefer_header = "resolution=merge-duplicates,return=minimal"
@@ -136,22 +304,93 @@ def main() -> int:
     base_url = normalize_supabase_url(supabase_url)
     cities_url = f"{base_url}/rest/v1/cities"
     places_url = f"{base_url}/rest/v1/city_places"
+    search_url = f"{base_url}/rest/v1/location_search_keys"
+    place_neighbours_url = f"{base_url}/rest/v1/place_neighbours"
+    city_neighbours_url = f"{base_url}/rest/v1/city_neighbours"
+    gazetteer_url = f"{base_url}/rest/v1/location_gazetteer"
     if args.upsert:
         cities_url = f"{cities_url}?on_conflict=id"
         places_url = f"{places_url}?on_conflict=id"
+        search_url = f"{search_url}?on_conflict=key,kind,entity_id"
+        place_neighbours_url = f"{place_neighbours_url}?on_conflict=place_id,neighbour_id"
+        city_neighbours_url = f"{city_neighbours_url}?on_conflict=city_id,neighbour_id"
+        gazetteer_url = f"{gazetteer_url}?on_conflict=id"
 
     print(f"Cities: {len(cities)}")
     print(f"Places: {len(places)}")
+    if state_path is not None:
+        print(f"Unchanged cities skipped: {skipped_cities}")
+        print(f"Unchanged place groups skipped: {len(unchanged_places)}")
+        if args.gazetteer.strip():
+            print(f"Unchanged gazetteer groups skipped: {skipped_gazetteer}")
+        print(f"Removed cities: {len(removed_cities)}")
+        print(f"Removed places: {len(removed_places)}")
+        if args.gazetteer.strip():
+            print(f"Removed gazetteer entries: {len(removed_gazetteer)}")
+    if search_rows:
+        print(f"Search keys: {len(search_rows)}")
+    if gazetteer_rows:
+        print(f"Gazetteer entries: {len(gazetteer_rows)}")
+    if place_neighbour_rows or city_neighbour_rows:
+        print(f"Place neighbours: {len(place_neighbour_rows)}")
+        print(f"City neighbours: {len(city_neighbour_rows)}")
     if args.dry_run:
         print("Dry run enabled, exiting without uploads.")
         return 0
 
+    # Plain URLs: deletes take their own filters, not on_conflict.
+    delete_headers = dict(headers, Prefer="return=minimal")
+    table_url = f"{base_url}/rest/v1"
+    size = args.batch_size
+    delete_rows(f"{table_url}/cities", delete_headers, "id", removed_cities, size)
+    delete_rows(f"{table_url}/city_places", delete_headers, "id", removed_places, size)
+    if args.search_index.strip():
+        for kind, ids in (("city", removed_cities), ("place", removed_places)):
+            delete_rows(
+                f"{table_url}/location_search_keys",
+                delete_headers,
+                "entity_id",
+                ids,
+                size,
+                {"kind": f"eq.{kind}"},
+            )
+    if args.neighbours.strip():
+        for table, owner, ids in (
+            ("place_neighbours", "place_id", removed_places),
+            ("city_neighbours", "city_id", removed_cities),
+        ):
+            for column in (owner, "neighbour_id"):
+                delete_rows(f"{table_url}/{table}", delete_headers, column, ids, size)
+    if args.gazetteer.strip():
+        delete_rows(
+            f"{table_url}/location_gazetteer", delete_headers, "id", removed_gazetteer, size
+        )
+
     for batch in chunked(cities, args.batch_size):
         post_batch(cities_url, headers, batch)
 
     for batch in chunked(places, args.batch_size):
         post_batch(places_url, headers, batch)
 
+    for batch in chunked(search_rows, args.batch_size):
+        post_batch(search_url, headers, batch)
+
+    for batch in chunked(gazetteer_rows, args.batch_size):
+        post_batch(gazetteer_url, headers, batch)
+
+    for batch in chunked(place_neighbour_rows, args.batch_size):
+        post_batch(place_neighbours_url, headers, batch)
+
+    for batch in chunked(city_neighbour_rows, args.batch_size):
+        post_batch(city_neighbours_url, headers, batch)
+
+    if state_path is not None:
+        with state_path.open("w", encoding="utf-8") as f:
+            state = {"cities": city_hashes, "places": place_hashes, "place_ids": place_ids}
+            if args.gazetteer.strip():
+                state["gazetteer"] = gazetteer_hashes
+                state["gazetteer_ids"] = gazetteer_ids
+            json.dump(state, f, indent=2)
     print("Import complete.")
     return 0
 
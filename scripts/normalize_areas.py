@@ -6,6 +6,14 @@ import unicodedata
 from pathlib import Path
 from typing import Dict, List, Tuple
 
+from external_groups import ExternalGroups, iter_grouped
+from output_manifest import (
+    canonical_grouped,
+    grouped_hashes,
+    write_grouped_output,
+    write_json_output,
+)
+
 
 def normalize_name(value: str) -> str:
     value = value.strip().lower()
@@ -51,10 +59,41 @@ def dedupe_city_areas(areas: List[dict]) -> Tuple[List[dict], List[dict]]:
 
     # Preserve deterministic order by name
     kept = list(kept_by_key.values())
-    kept.sort(key=lambda item: (item.get("name") or "").lower())
+    kept.sort(key=area_order)
     return kept, duplicates
 
 
+def area_order(area: dict) -> str:
+    return (area.get("name") or "").lower()
+
+
+def stream_normalize(
+    input_path: Path, out_path: Path, dupes_path: Path, budget: int
+) -> Tuple[int, int, int, bool, bool]:
+    # One city decoded at a time; both outputs are regrouped through bounded
+    # (disk-spilling) buffers of `budget` entries each.
+    kept_groups = ExternalGroups(budget)
+    dupe_groups = ExternalGroups(budget)
+    total_in = 0
+    for city_id, areas in iter_grouped(input_path):
+        if not isinstance(areas, list):
+            continue
+        total_in += len(areas)
+        kept, dupes = dedupe_city_areas(areas)
+        kept_groups.touch(city_id)
+        for area in kept:
+            kept_groups.add(city_id, area_order(area), area)
+        for area in dupes:
+            # Duplicates keep the order dedupe_city_areas found them in.
+            dupe_groups.add(city_id, "", area)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_written = write_grouped_output(out_path, kept_groups.groups())
+    dupes_written = write_grouped_output(dupes_path, dupe_groups.groups(), record_groups=False)
+    print(kept_groups.summary())
+    return total_in, kept_groups.count, dupe_groups.count, out_written, dupes_written
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -72,6 +111,13 @@ def main() -> int:
         default="data/exports/areas_by_city.duplicates.json",
         help="Output duplicates report JSON",
     )
+    parser.add_argument(
+        "--group-budget",
+        type=int,
+        default=0,
+        help="Stream the input city by city, holding at most this many areas per "
+        "output in memory and spilling sorted runs to temporary files (0 = load it whole)",
+    )
     args = parser.parse_args()
 
     repo_root = Path(__file__).resolve().parent.parent
@@ -79,34 +125,42 @@ def main() -> int:
     out_path = (repo_root / args.out).resolve()
     dupes_path = (repo_root / args.dupes).resolve()
 
-    with input_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+    if args.group_budget > 0:
+        total_in, total_out, total_dupes, out_written, dupes_written = stream_normalize(
+            input_path, out_path, dupes_path, args.group_budget
+        )
+    else:
+        with input_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        normalized: Dict[str, List[dict]] = {}
+        duplicates: Dict[str, List[dict]] = {}
+
+        for city_id, areas in data.items():
+            if not isinstance(areas, list):
+                continue
+            kept, dupes = dedupe_city_areas(areas)
+            normalized[city_id] = kept
+            if dupes:
+                duplicates[city_id] = dupes
+
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        normalized = canonical_grouped(normalized)
+        duplicates = canonical_grouped(duplicates)
+        out_written = write_json_output(
+            out_path, normalized, groups=grouped_hashes(normalized)
+        )
+        dupes_written = write_json_output(dupes_path, duplicates)
+
+        total_in = sum(len(v) for v in data.values() if isinstance(v, list))
+        total_out = sum(len(v) for v in normalized.values() if isinstance(v, list))
+        total_dupes = sum(len(v) for v in duplicates.values() if isinstance(v, list))
 
-    normalized: Dict[str, List[dict]] = {}
-    duplicates: Dict[str, List[dict]] = {}
-
-    for city_id, areas in data.items():
-        if not isinstance(areas, list):
-            continue
-        kept, dupes = dedupe_city_areas(areas)
-        normalized[city_id] = kept
-        if dupes:
-            duplicates[city_id] = dupes
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(normalized, f, ensure_ascii=False, indent=2)
-    with dupes_path.open("w", encoding="utf-8") as f:
-        json.dump(duplicates, f, ensure_ascii=False, indent=2)
-
-    total_in = sum(len(v) for v in data.values() if isinstance(v, list))
-    total_out = sum(len(v) for v in normalized.values() if isinstance(v, list))
-    total_dupes = sum(len(v) for v in duplicates.values() if isinstance(v, list))
     print(f"Input areas: {total_in}")
     print(f"Normalized areas: {total_out}")
     print(f"Duplicates: {total_dupes}")
-    print(f"Wrote: {out_path}")
-    print(f"Wrote: {dupes_path}")
+    print(f"{'Wrote' if out_written else 'Unchanged'}: {out_path}")
+    print(f"{'Wrote' if dupes_written else 'Unchanged'}: {dupes_path}")
     return 0
 
 
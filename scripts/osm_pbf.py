@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import osmium
+
+    HAS_OSMIUM = True
+except Exception:
+    HAS_OSMIUM = False
+    osmium = None
+
+Keep = Optional[Callable[[dict], bool]]
+
+
+def is_pbf(path: Path) -> bool:
+    return path.name.endswith(".pbf")
+
+
+def require_osmium(path: Path) -> None:
+    if not HAS_OSMIUM:
+        raise SystemExit(f"Reading {path} needs pyosmium (pip install osmium)")
+
+
+def read_features(processor, keep: Keep) -> dict:
+    # Same shape as the GeoJSON exports: tags become properties, areas
+    # become MultiPolygons. Feature order follows the file, so ids built
+    # from feature indexes are stable for a given extract.
+    factory = osmium.geom.GeoJSONFactory()
+    features = []
+    for obj in processor:
+        props = {tag.k: tag.v for tag in obj.tags}
+        if keep is not None and not keep(props):
+            continue
+        if obj.is_node():
+            geom = {"type": "Point", "coordinates": [obj.location.lon, obj.location.lat]}
+        else:
+            try:
+                geom = json.loads(factory.create_multipolygon(obj))
+            except RuntimeError:
+                # Broken multipolygon (unclosed rings, missing members).
+                continue
+        features.append({"type": "Feature", "properties": props, "geometry": geom})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def load_pbf_boundaries(path: Path, keep: Keep = None) -> dict:
+    require_osmium(path)
+    # Only boundary=administrative relations and closed ways are assembled
+    # into areas; every other way is dropped before geometry building.
+    admin = osmium.filter.TagFilter(("boundary", "administrative"))
+    processor = (
+        osmium.FileProcessor(str(path))
+        .with_areas(admin)
+        .with_filter(osmium.filter.EntityFilter(osmium.osm.AREA))
+        .with_filter(osmium.filter.TagFilter(("boundary", "administrative")))
+    )
+    return read_features(processor, keep)
+
+
+def load_pbf_places(path: Path, keep: Keep = None) -> dict:
+    require_osmium(path)
+    processor = (
+        osmium.FileProcessor(str(path))
+        .with_areas(osmium.filter.KeyFilter("place"))
+        .with_filter(osmium.filter.EntityFilter(osmium.osm.NODE | osmium.osm.AREA))
+        .with_filter(osmium.filter.KeyFilter("place"))
+    )
+    return read_features(processor, keep)
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from records import json_default
+
+MANIFEST_NAME = "manifest.json"
+VERSION = 1
+CHUNK_BATCH = 8192
+PARALLEL_MIN_ENTRIES = 50000
+GROUP_BATCH_ENTRIES = 2000
+
+# json default= hook; export profiles swap in their own.
+Default = Callable[[Any], Any]
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def group_hash(value: Any, default: Default = json_default) -> str:
+    # Independent of the file's indent/ascii settings so the same city data
+    # hashes the same in every export that carries it.
+    data = json.dumps(
+        value,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=default,
+    )
+    return sha256_bytes(data.encode("utf-8"))
+
+
+def canonical_grouped(grouped: Dict[str, List[dict]]) -> Dict[str, List[dict]]:
+    # City keys in sorted order, _unassigned last; entries keep their order.
+    out = {key: grouped[key] for key in sorted(k for k in grouped if k != "_unassigned")}
+    if "_unassigned" in grouped:
+        out["_unassigned"] = grouped["_unassigned"]
+    return out
+
+
+def grouped_hashes(grouped: Dict[str, Any], default: Default = json_default) -> Dict[str, str]:
+    return {str(key): group_hash(items, default) for key, items in grouped.items()}
+
+
+def entity_hashes(
+    entries: Iterable[dict], key: str = "id", default: Default = json_default
+) -> Dict[str, str]:
+    groups: Dict[str, list] = {}
+    for entry in entries:
+        groups.setdefault(str(entry.get(key)), []).append(entry)
+    return grouped_hashes(groups, default)
+
+
+def manifest_path(path: Path) -> Path:
+    return path.parent / MANIFEST_NAME
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": VERSION, "files": {}}
+    if manifest.get("version") != VERSION:
+        return {"version": VERSION, "files": {}}
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def same_content(path: Path, size: int, sha: str) -> bool:
+    try:
+        if path.stat().st_size != size:
+            return False
+    except OSError:
+        return False
+    return file_sha256(path) == sha
+
+
+def start_copy(tmp_path: Path, old, size: int):
+    # The first size bytes already matched the old file; carry them over.
+    out = tmp_path.open("wb")
+    if old is not None and size:
+        old.seek(0)
+        remaining = size
+        while remaining:
+            data = old.read(min(remaining, 1 << 20))
+            out.write(data)
+            remaining -= len(data)
+    return out
+
+
+def write_chunks_if_changed(path: Path, chunks: Iterable[bytes]) -> Tuple[bool, str, int]:
+    # Compares against the current file while hashing; a temp copy is only
+    # started at the first differing chunk, so unchanged outputs are never
+    # written and the payload is never held in memory whole.
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    old = path.open("rb") if path.is_file() else None
+    out = None
+    try:
+        for chunk in chunks:
+            digest.update(chunk)
+            if out is None and old is not None and old.read(len(chunk)) == chunk:
+                size += len(chunk)
+                continue
+            if out is None:
+                out = start_copy(tmp_path, old, size)
+            out.write(chunk)
+            size += len(chunk)
+        if out is None:
+            if old is not None and not old.read(1):
+                return False, digest.hexdigest(), size
+            out = start_copy(tmp_path, old, size)
+    finally:
+        if old is not None:
+            old.close()
+        if out is not None:
+            out.close()
+    os.replace(tmp_path, path)
+    return True, digest.hexdigest(), size
+
+
+def write_bytes_if_changed(path: Path, data: bytes) -> bool:
+    return write_chunks_if_changed(path, (data,))[0]
+
+
+def record_output(
+    path: Path, sha: str, size: int, groups: Optional[Dict[str, str]] = None
+) -> None:
+    mpath = manifest_path(path)
+    manifest = load_manifest(mpath)
+    entry: Dict[str, Any] = {"sha256": sha, "bytes": size}
+    if groups is not None:
+        entry["groups"] = groups
+    if manifest["files"].get(path.name) != entry:
+        manifest["files"][path.name] = entry
+        manifest["files"] = dict(sorted(manifest["files"].items()))
+        payload = json.dumps(manifest, ensure_ascii=True, indent=2, sort_keys=True)
+        write_bytes_if_changed(mpath, payload.encode("utf-8"))
+
+
+def write_output(
+    path: Path,
+    chunks: Iterable[bytes],
+    groups: Optional[Dict[str, str]] = None,
+) -> bool:
+    # Rewrites the file only when its bytes change, and records the content
+    # hash (plus per-city hashes) in the directory's manifest.json.
+    written, sha, size = write_chunks_if_changed(path, chunks)
+    record_output(path, sha, size, groups)
+    return written
+
+
+def replace_output(path: Path, tmp_path: Path) -> bool:
+    # For files another library writes (e.g. sqlite): the finished temp file
+    # replaces path only when its bytes differ, and is recorded the same way.
+    sha = file_sha256(tmp_path)
+    size = tmp_path.stat().st_size
+    written = not same_content(path, size, sha)
+    if written:
+        os.replace(tmp_path, path)
+    else:
+        tmp_path.unlink()
+    record_output(path, sha, size)
+    return written
+
+
+def encode_chunks(
+    value: Any,
+    ensure_ascii: bool,
+    indent: Optional[int],
+    batch: int = CHUNK_BATCH,
+    default: Default = json_default,
+) -> Iterator[bytes]:
+    # Unindented output is written fully compact.
+    separators = (",", ":") if indent is None else None
+    encoder = json.JSONEncoder(
+        ensure_ascii=ensure_ascii, indent=indent, separators=separators, default=default
+    )
+    pending: List[str] = []
+    for chunk in encoder.iterencode(value):
+        pending.append(chunk)
+        if len(pending) >= batch:
+            yield "".join(pending).encode("utf-8")
+            pending.clear()
+    if pending:
+        yield "".join(pending).encode("utf-8")
+
+
+def encode_members(task: Tuple[List[Tuple[str, Any]], bool, int, Default]) -> bytes:
+    # "key": value lines exactly as the indented encoder emits them one
+    # level down: JSON strings never hold raw newlines, so re-indenting a
+    # standalone dump is a plain replace.
+    members, ensure_ascii, indent, default = task
+    pad = " " * indent
+    parts = []
+    for key, items in members:
+        body = json.dumps(items, ensure_ascii=ensure_ascii, indent=indent, default=default)
+        key_text = json.dumps(key, ensure_ascii=ensure_ascii)
+        parts.append(f"{pad}{key_text}: {body.replace(chr(10), chr(10) + pad)}")
+    return ",\n".join(parts).encode("utf-8")
+
+
+def parallel_workers(value: Any, indent: Optional[int], workers: int) -> int:
+    # workers: 1 = serial, 0 = pool sized to the CPUs once the grouped
+    # output holds PARALLEL_MIN_ENTRIES entries, N = pool of N.
+    if workers == 1 or indent is None or not isinstance(value, dict) or not value:
+        return 1
+    if not all(type(key) is str for key in value):
+        return 1
+    if workers > 1:
+        return workers
+    total = sum(len(items) for items in value.values() if isinstance(items, list))
+    if total < PARALLEL_MIN_ENTRIES:
+        return 1
+    return os.cpu_count() or 1
+
+
+def encode_grouped_parallel(
+    grouped: Dict[str, Any],
+    ensure_ascii: bool,
+    indent: int,
+    workers: int,
+    default: Default = json_default,
+) -> Iterator[bytes]:
+    # Cities are batched by entry count and encoded in a process pool;
+    # map() returns batches in key order, so output matches encode_chunks.
+    batches: List[List[Tuple[str, Any]]] = [[]]
+    size = 0
+    for key, items in grouped.items():
+        if size >= GROUP_BATCH_ENTRIES:
+            batches.append([])
+            size = 0
+        batches[-1].append((key, items))
+        size += len(items) if isinstance(items, list) else 1
+    tasks = ((members, ensure_ascii, indent, default) for members in batches)
+    yield b"{\n"
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, chunk in enumerate(executor.map(encode_members, tasks)):
+            yield chunk if i == 0 else b",\n" + chunk
+    yield b"\n}"
+
+
+def encode_grouped_stream(
+    groups: Iterable[Tuple[str, Any]],
+    ensure_ascii: bool,
+    indent: Optional[int],
+    default: Default = json_default,
+    hashes: Optional[Dict[str, str]] = None,
+) -> Iterator[bytes]:
+    # Same bytes encode_chunks gives for the equivalent dict, built one group
+    # at a time; per-group hashes are filled into `hashes` on the way.
+    first = True
+    for key, items in groups:
+        if hashes is not None:
+            hashes[str(key)] = group_hash(items, default)
+        if indent is None:
+            key_text = json.dumps(key, ensure_ascii=ensure_ascii)
+            body = json.dumps(
+                items, ensure_ascii=ensure_ascii, separators=(",", ":"), default=default
+            )
+            chunk = f"{key_text}:{body}".encode("utf-8")
+            yield (b"{" if first else b",") + chunk
+        else:
+            chunk = encode_members(([(key, items)], ensure_ascii, indent, default))
+            yield (b"{\n" if first else b",\n") + chunk
+        first = False
+    if first:
+        yield b"{}"
+    else:
+        yield b"}" if indent is None else b"\n}"
+
+
+def write_grouped_output(
+    path: Path,
+    groups: Iterable[Tuple[str, Any]],
+    ensure_ascii: bool = False,
+    indent: Optional[int] = 2,
+    default: Default = json_default,
+    record_groups: bool = True,
+) -> bool:
+    # Streaming counterpart of write_json_output for grouped exports; the
+    # hashes dict is complete by the time write_output records it.
+    hashes: Optional[Dict[str, str]] = {} if record_groups else None
+    chunks = encode_grouped_stream(groups, ensure_ascii, indent, default, hashes)
+    return write_output(path, chunks, hashes)
+
+
+def write_json_output(
+    path: Path,
+    value: Any,
+    ensure_ascii: bool = False,
+    indent: Optional[int] = 2,
+    groups: Optional[Dict[str, str]] = None,
+    workers: int = 1,
+    default: Default = json_default,
+) -> bool:
+    pool_size = parallel_workers(value, indent, workers)
+    if pool_size > 1:
+        chunks = encode_grouped_parallel(value, ensure_ascii, indent, pool_size, default)
+    else:
+        chunks = encode_chunks(value, ensure_ascii, indent, default=default)
+    return write_output(path, chunks, groups)
+
+
+def describe_write(path: Path, written: bool) -> str:
+    return f"Wrote {path}" if written else f"Unchanged {path}"
+
+
+def recorded_groups(path: Path) -> Optional[Dict[str, str]]:
+    # Per-city hashes from the manifest, trusted only while the file still
+    # matches the hash recorded next to them.
+    entry = load_manifest(manifest_path(path))["files"].get(path.name)
+    if not entry or "groups" not in entry:
+        return None
+    if not same_content(path, entry.get("bytes", -1), entry.get("sha256", "")):
+        return None
+    return entry["groups"]
@@ -0,0 +1,128 @@
+import json
+import math
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from geojson_stream import SKIPPED
+
+Point = Tuple[float, float]
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+Plan = List[Tuple[str, BBox]]
+
+
+def load_plan(spec: str, points: Sequence[Point], repo_root: Path) -> Plan:
+    # "grid:<degrees>" tiles the occupied extent with a coarse grid; anything
+    # else is a JSON file of named boxes ({"name": [bbox]} or
+    # [{"name": ..., "bbox": [...]}]), e.g. one per province.
+    if spec.startswith("grid:"):
+        return grid_plan(points, float(spec[5:]))
+    with (repo_root / spec).resolve().open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = data.items() if isinstance(data, dict) else ((d["name"], d["bbox"]) for d in data)
+    return [(str(name), tuple(float(v) for v in bbox)) for name, bbox in items]
+
+
+def grid_plan(points: Iterable[Point], size: float) -> Plan:
+    cells = sorted({(math.floor(y / size), math.floor(x / size)) for x, y in points})
+    return [
+        (f"{cy}_{cx}", (cx * size, cy * size, (cx + 1) * size, (cy + 1) * size))
+        for cy, cx in cells
+    ]
+
+
+def expand(bbox: BBox, margin: float) -> BBox:
+    return (bbox[0] - margin, bbox[1] - margin, bbox[2] + margin, bbox[3] + margin)
+
+
+def intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def contains(bbox: BBox, point: Point) -> bool:
+    return bbox[0] <= point[0] <= bbox[2] and bbox[1] <= point[1] <= bbox[3]
+
+
+def points_hull(points: Iterable[Point]) -> Optional[BBox]:
+    pts = list(points)
+    if not pts:
+        return None
+    xs = [p[0] for p in pts]
+    ys = [p[1] for p in pts]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def assign_owners(points: Sequence[Optional[Point]], plan: Plan) -> List[Optional[int]]:
+    # Each point goes to the first box whose half-open core holds it, or to
+    # the nearest box when none does, so every feature has exactly one owner.
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, (_, bbox) in enumerate(plan):
+        for cy in range(math.floor(bbox[1]), math.floor(bbox[3]) + 1):
+            for cx in range(math.floor(bbox[0]), math.floor(bbox[2]) + 1):
+                buckets.setdefault((cy, cx), []).append(i)
+    owners: List[Optional[int]] = []
+    for point in points:
+        if point is None:
+            owners.append(None)
+            continue
+        x, y = point
+        owner = None
+        for i in buckets.get((math.floor(y), math.floor(x)), ()):
+            bbox = plan[i][1]
+            if bbox[0] <= x < bbox[2] and bbox[1] <= y < bbox[3]:
+                owner = i
+                break
+        if owner is None:
+            best = None
+            for i, (_, bbox) in enumerate(plan):
+                dx = max(bbox[0] - x, 0.0, x - bbox[2])
+                dy = max(bbox[1] - y, 0.0, y - bbox[3])
+                dist = dx * dx + dy * dy
+                if best is None or dist < best:
+                    best = dist
+                    owner = i
+        owners.append(owner)
+    return owners
+
+
+def sparse_features(features: Sequence[dict], keep: Set[int]) -> List[dict]:
+    # Full-length list so feature indexes (and ids built from them) match a
+    # single-process run; unselected slots hold the shared SKIPPED placeholder.
+    out = [SKIPPED] * len(features)
+    for idx in keep:
+        out[idx] = features[idx]
+    return out
+
+
+def id_index(entity_id: str) -> int:
+    return int(entity_id.rsplit("-", 1)[1])
+
+
+def merge_grouped(
+    parts: Iterable[Dict[str, List[dict]]], sort_by_name: bool = False
+) -> Dict[str, List[dict]]:
+    # Rebuild grouped output in feature order, as the single pass appends it;
+    # ids embed the feature index, and repeats from overlapping plan boxes
+    # are dropped by id.
+    entries = []
+    for grouped in parts:
+        for key, items in grouped.items():
+            for item in items:
+                entries.append((id_index(item["id"]), key, item))
+    entries.sort(key=lambda entry: entry[0])
+    seen: Set[str] = set()
+    out: Dict[str, List[dict]] = {}
+    unassigned: List[dict] = []
+    for _, key, item in entries:
+        if item["id"] in seen:
+            continue
+        seen.add(item["id"])
+        if key == "_unassigned":
+            unassigned.append(item)
+        else:
+            out.setdefault(key, []).append(item)
+    if sort_by_name:
+        for items in out.values():
+            items.sort(key=lambda item: item["name"])
+    if unassigned:
+        out["_unassigned"] = unassigned
+    return out
@@ -0,0 +1,155 @@
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+Point = Tuple[float, float]
+
+
+def intern_value(value: Any) -> Any:
+    # place / admin_level and friends repeat across hundreds of thousands of
+    # entries; interned, they share one string object each.
+    return sys.intern(value) if type(value) is str else value
+
+
+class Record:
+    # Slotted stand-in for the JSON dicts the extractors used to build per
+    # entry. bbox and centroid stay tuples until serialization; item access
+    # keeps the old entry["key"] call sites working. geohash / bbox_geohash
+    # stay unset (and are left out of the JSON) until assign_geohashes runs.
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        setattr(self, key, value)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for key in self.FIELDS:
+            if key == "bbox":
+                bbox = self.bbox
+                out["bbox"] = {
+                    "min_lon": bbox[0],
+                    "min_lat": bbox[1],
+                    "max_lon": bbox[2],
+                    "max_lat": bbox[3],
+                }
+            elif key == "centroid":
+                out["centroid"] = {"lon": self.centroid[0], "lat": self.centroid[1]}
+            else:
+                out[key] = getattr(self, key)
+        for key in ("geohash", "bbox_geohash"):
+            value = getattr(self, key, self)
+            if value is not self:
+                out[key] = value
+        return out
+
+
+class AreaRecord(Record):
+    FIELDS = (
+        "id",
+        "name",
+        "admin_level",
+        "place",
+        "wikidata",
+        "wikipedia",
+        "bbox",
+        "centroid",
+        "city_id",
+    )
+    __slots__ = FIELDS + ("geohash", "bbox_geohash")
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        admin_level: str,
+        place: Optional[str],
+        wikidata: Optional[str],
+        wikipedia: Optional[str],
+        bbox: BBox,
+        centroid: Point,
+        city_id: Optional[str] = None,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.admin_level = intern_value(admin_level)
+        self.place = intern_value(place)
+        self.wikidata = wikidata
+        self.wikipedia = wikipedia
+        self.bbox = bbox
+        self.centroid = centroid
+        self.city_id = city_id
+
+
+class PlaceRecord(Record):
+    FIELDS = (
+        "id",
+        "name",
+        "place",
+        "admin_level",
+        "ref_ine",
+        "wikidata",
+        "wikipedia",
+        "population",
+        "population_date",
+        "name_es",
+        "name_eu",
+        "bbox",
+        "centroid",
+        "city_id",
+        "city_name",
+        "area9_id",
+        "area10_id",
+    )
+    __slots__ = FIELDS + ("geohash", "bbox_geohash")
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        place: str,
+        admin_level: Optional[str],
+        ref_ine: Optional[str],
+        wikidata: Optional[str],
+        wikipedia: Optional[str],
+        population: Optional[str],
+        population_date: Optional[str],
+        name_es: Optional[str],
+        name_eu: Optional[str],
+        bbox: BBox,
+        centroid: Point,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.place = intern_value(place)
+        self.admin_level = intern_value(admin_level)
+        self.ref_ine = ref_ine
+        self.wikidata = wikidata
+        self.wikipedia = wikipedia
+        self.population = population
+        self.population_date = intern_value(population_date)
+        self.name_es = name_es
+        self.name_eu = name_eu
+        self.bbox = bbox
+        self.centroid = centroid
+        self.city_id = None
+        self.city_name = None
+        self.area9_id = None
+        self.area10_id = None
+
+
+def json_default(value: Any) -> Any:
+    # default= hook for json.dumps: records become dicts one at a time while
+    # encoding, so the full dict tree never exists at once.
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
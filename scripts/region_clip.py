@@ -0,0 +1,192 @@
+import argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from feature_index import FeatureIndex, get_feature_index, iter_properties
+from geojson_stream import load_features
+from partitions import BBox, contains, expand, intersects, points_hull
+
+UNASSIGNED = "_unassigned"
+
+# is_city(props) reads only the indexed tags (a load_features keep);
+# city_key(props) is the id the extractor gives that city, None when it
+# builds none.
+TagFilter = Callable[[dict], bool]
+CityKey = Callable[[dict], Optional[str]]
+
+
+def add_region_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--bbox",
+        nargs=4,
+        type=float,
+        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+        help="Clip the run to the cities whose boundary intersects this box (plus "
+        "unassigned entries inside it); results for them match a full run "
+        "(default: whole input)",
+    )
+    parser.add_argument(
+        "--city-ids",
+        default="",
+        help="Clip the run to these comma-separated city ids; combined with --bbox "
+        "the region holds both (empty = whole input)",
+    )
+
+
+class Region:
+    def __init__(self, bbox: Optional[BBox] = None, city_ids: Optional[Set[str]] = None) -> None:
+        self.bbox = bbox
+        self.city_ids = city_ids or set()
+
+    def selects(self, city_id: str, boxes: Iterable[BBox]) -> bool:
+        if city_id in self.city_ids:
+            return True
+        return self.bbox is not None and any(intersects(box, self.bbox) for box in boxes)
+
+    def holds(self, point: Tuple[float, float]) -> bool:
+        return self.bbox is not None and contains(self.bbox, point)
+
+    def describe(self) -> str:
+        parts = []
+        if self.bbox is not None:
+            parts.append("bbox " + ",".join(f"{v:g}" for v in self.bbox))
+        if self.city_ids:
+            parts.append(f"{len(self.city_ids)} city ids")
+        return " + ".join(parts)
+
+
+def region_from_args(
+    args: argparse.Namespace, parser: argparse.ArgumentParser
+) -> Optional[Region]:
+    bbox = None
+    if args.bbox is not None:
+        bbox = tuple(args.bbox)
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            parser.error("--bbox expects MIN_LON MIN_LAT MAX_LON MAX_LAT")
+    city_ids = {c.strip() for c in args.city_ids.split(",") if c.strip()}
+    if bbox is None and not city_ids:
+        return None
+    return Region(bbox, city_ids)
+
+
+def window_features(index: FeatureIndex, window: BBox) -> Set[int]:
+    selected = set()
+    for i in range(index.count):
+        bbox = index.bbox(i)
+        if bbox is not None and intersects(bbox, window):
+            selected.add(i)
+    return selected
+
+
+class Clip:
+    # One region's share of a run. Entries matched to a region city have
+    # their centroid within `margin` of its bbox (the grid search never looks
+    # further), so only features inside that window are read; every city
+    # within `margin` of the window is loaded as well, which gives each of
+    # them the candidates a full run would see, and the results filtered to
+    # the region's cities equal the full run's.
+    def __init__(
+        self,
+        region: Region,
+        source: Path,
+        city_ids: Set[str],
+        window: Optional[BBox],
+        boundaries: Set[int],
+        context: int,
+    ) -> None:
+        self.region = region
+        self.source = source
+        self.city_ids = city_ids
+        self.window = window
+        self.boundaries = boundaries
+        self.context = context
+
+    def load(self, path: Path, keep: Optional[TagFilter] = None, hints=()) -> dict:
+        # The planned boundaries for the source file; features inside the
+        # window for any other file (e.g. places).
+        index = get_feature_index(path)
+        try:
+            if path == self.source:
+                only = self.boundaries
+            elif self.window is not None:
+                only = window_features(index, self.window)
+            else:
+                only = set()
+            return load_features(path, keep=keep, hints=hints, index=index, only=only)
+        finally:
+            index.close()
+
+    def keeps(self, group_id: str, item: Any) -> bool:
+        if group_id == UNASSIGNED:
+            return self.region.holds(item.centroid)
+        return group_id in self.city_ids
+
+    def cities(self, cities: List[dict]) -> List[dict]:
+        return [city for city in cities if city["id"] in self.city_ids]
+
+    def grouped(self, grouped: Dict[str, list]) -> Dict[str, list]:
+        return dict(self.groups(grouped.items()))
+
+    def groups(self, groups: Iterable[Tuple[str, list]]) -> Iterable[Tuple[str, list]]:
+        for group_id, items in groups:
+            if group_id == UNASSIGNED:
+                items = [item for item in items if self.keeps(group_id, item)]
+                if items:
+                    yield group_id, items
+            elif group_id in self.city_ids:
+                yield group_id, items
+
+    def summary(self) -> str:
+        return (
+            f"Region {self.region.describe()}: {len(self.city_ids)} cities, "
+            f"{self.context} more loaded around them"
+        )
+
+
+def plan_clip(
+    source: Path, region: Region, margin: float, is_city: TagFilter, city_key: CityKey
+) -> Clip:
+    # Only the city boundaries' properties are decoded here; bboxes come
+    # from the sidecar index. A city id's every boundary is loaded, so the
+    # extractors keep the same one of duplicates as a full run.
+    index = get_feature_index(source)
+    try:
+        variants: Dict[str, List[int]] = {}
+        for i, props in iter_properties(source, index, is_city):
+            city_id = city_key(props)
+            if city_id is not None:
+                variants.setdefault(city_id, []).append(i)
+        boxes = {
+            city_id: [box for box in (index.bbox(i) for i in idxs) if box is not None]
+            for city_id, idxs in variants.items()
+        }
+        city_ids = {city_id for city_id in variants if region.selects(city_id, boxes[city_id])}
+        missing = region.city_ids - set(variants)
+        if missing:
+            print(f"Region: city ids not in {source.name}: {', '.join(sorted(missing))}")
+
+        corners = [
+            corner
+            for city_id in city_ids
+            for box in boxes[city_id]
+            for corner in (box[:2], box[2:])
+        ]
+        if region.bbox is not None:
+            corners += [region.bbox[:2], region.bbox[2:]]
+        hull = points_hull(corners)
+        if hull is None:
+            return Clip(region, source, city_ids, None, set(), 0)
+        window = expand(hull, margin)
+        around = expand(window, margin)
+        context = {
+            city_id
+            for city_id, city_boxes in boxes.items()
+            if any(intersects(box, around) for box in city_boxes)
+        }
+        context |= city_ids
+        boundaries = {i for city_id in context for i in variants[city_id]}
+        cities = {i for idxs in variants.values() for i in idxs}
+        boundaries.update(i for i in window_features(index, window) if i not in cities)
+    finally:
+        index.close()
+    return Clip(region, source, city_ids, window, boundaries, len(context - city_ids))
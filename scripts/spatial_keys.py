@@ -0,0 +1,101 @@
+import math
+from typing import List, Sequence, Tuple
+
+try:
+    import numpy as np
+
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+    np = None
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# 12 characters = 60 bits, the most an int64 code holds.
+MAX_PRECISION = 12
+
+
+def geohash_bits(precision: int):
+    total = precision * 5
+    return total, (total + 1) // 2, total // 2
+
+
+def geohash(lon: float, lat: float, precision: int) -> str:
+    total, lon_bits, lat_bits = geohash_bits(precision)
+    x = min(int(math.floor((lon + 180.0) / 360.0 * (1 << lon_bits))), (1 << lon_bits) - 1)
+    y = min(int(math.floor((lat + 90.0) / 180.0 * (1 << lat_bits))), (1 << lat_bits) - 1)
+    code = 0
+    for i in range(total):
+        # Bits interleave longitude first, most significant first.
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+    return "".join(BASE32[(code >> (5 * (precision - 1 - k))) & 31] for k in range(precision))
+
+
+def geohash_many(lons: Sequence[float], lats: Sequence[float], precision: int) -> List[str]:
+    if not HAS_NUMPY or precision > MAX_PRECISION:
+        return [geohash(lon, lat, precision) for lon, lat in zip(lons, lats)]
+    total, lon_bits, lat_bits = geohash_bits(precision)
+    lon_arr = np.asarray(lons, dtype=np.float64)
+    lat_arr = np.asarray(lats, dtype=np.float64)
+    x = np.floor((lon_arr + 180.0) / 360.0 * float(1 << lon_bits)).astype(np.int64)
+    y = np.floor((lat_arr + 90.0) / 180.0 * float(1 << lat_bits)).astype(np.int64)
+    x = np.minimum(x, (1 << lon_bits) - 1)
+    y = np.minimum(y, (1 << lat_bits) - 1)
+    code = np.zeros(len(lon_arr), dtype=np.int64)
+    for i in range(total):
+        if i % 2 == 0:
+            bit = (x >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        code = (code << 1) | bit
+    chars = np.array(list(BASE32))
+    columns = [chars[(code >> (5 * (precision - 1 - k))) & 31] for k in range(precision)]
+    if not columns or not len(lon_arr):
+        return [""] * len(lon_arr)
+    return ["".join(row) for row in np.stack(columns, axis=1).tolist()]
+
+
+def common_prefix(a: str, b: str) -> str:
+    n = 0
+    for ca, cb in zip(a, b):
+        if ca != cb:
+            break
+        n += 1
+    return a[:n]
+
+
+def entry_coords(entry) -> Tuple[float, float, float, float, float, float]:
+    # Centroid then bbox corners, from JSON-shaped dicts or slotted records
+    # (which keep both as tuples).
+    centroid, bbox = entry["centroid"], entry["bbox"]
+    if isinstance(centroid, dict):
+        return (
+            centroid["lon"],
+            centroid["lat"],
+            bbox["min_lon"],
+            bbox["min_lat"],
+            bbox["max_lon"],
+            bbox["max_lat"],
+        )
+    return (centroid[0], centroid[1], bbox[0], bbox[1], bbox[2], bbox[3])
+
+
+def assign_geohashes(entries: List[dict], precision: int) -> None:
+    # Geohashes are hierarchical: every shorter precision is a prefix, so one
+    # column serves prefix lookups at any level. bbox_geohash is the smallest
+    # cell holding the whole bbox (common prefix of its corners).
+    if not entries or precision <= 0:
+        return
+    coords = [entry_coords(entry) for entry in entries]
+    lons, lats, min_lons, min_lats, max_lons, max_lats = (
+        [c[i] for c in coords] for i in range(6)
+    )
+    centers = geohash_many(lons, lats, precision)
+    lows = geohash_many(min_lons, min_lats, precision)
+    highs = geohash_many(max_lons, max_lats, precision)
+    for entry, center, low, high in zip(entries, centers, lows, highs):
+        entry["geohash"] = center
+        entry["bbox_geohash"] = common_prefix(low, high) or None
@@ -0,0 +1,150 @@
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+Point = Tuple[float, float]
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+
+CURVES = ("none", "hilbert", "morton")
+CURVE_BITS = 16
+
+
+def morton_index(x: int, y: int, bits: int = CURVE_BITS) -> int:
+    code = 0
+    for i in range(bits - 1, -1, -1):
+        code = (code << 2) | (((y >> i) & 1) << 1) | ((x >> i) & 1)
+    return code
+
+
+def hilbert_index(x: int, y: int, bits: int = CURVE_BITS) -> int:
+    code = 0
+    s = 1 << (bits - 1)
+    while s:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        code += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous.
+        if not ry:
+            if rx:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return code
+
+
+def curve_order(points: Sequence[Point], curve: str, bits: int = CURVE_BITS) -> List[int]:
+    # Indexes of points sorted along the curve over their own extent; ties
+    # keep input order.
+    order = list(range(len(points)))
+    if curve == "none" or not points:
+        return order
+    index = hilbert_index if curve == "hilbert" else morton_index
+    min_x = min(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    span = max(max(p[0] for p in points) - min_x, max(p[1] for p in points) - min_y)
+    top = (1 << bits) - 1
+    scale = top / span if span > 0 else 0.0
+    keys = [
+        index(
+            min(int((p[0] - min_x) * scale), top),
+            min(int((p[1] - min_y) * scale), top),
+            bits,
+        )
+        for p in points
+    ]
+    order.sort(key=keys.__getitem__)
+    return order
+
+
+def segment_reach(rings: Sequence[Sequence[Point]], eps: float) -> float:
+    # How far outside its bbox the eps tests in point_on_segment can still
+    # report a hit; the tolerance grows as segments get shorter.
+    min_len = math.inf
+    for ring in rings:
+        n = len(ring)
+        for i in range(n):
+            a, b = ring[i], ring[(i + 1) % n]
+            seg = math.hypot(b[0] - a[0], b[1] - a[1])
+            if 0 < seg < min_len:
+                min_len = seg
+    if min_len == math.inf:
+        return eps
+    return max(eps, 2 * eps / min_len)
+
+
+class LastHitCache:
+    # Points sorted along a curve tend to fall in the city matched just
+    # before. The cached city is only returned when it is provably what the
+    # full match gives: the point lies in its bbox (so it is a grid
+    # candidate), it covers the point, and no other city that could reach
+    # the point covers it too.
+    def __init__(
+        self,
+        city_polygons: Dict[str, dict],
+        covers: Callable[[str, Point], bool],
+        reach: Dict[str, float],
+        cell_size: float,
+    ) -> None:
+        self.city_polygons = city_polygons
+        self.covers = covers
+        self.city: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        expanded: Dict[str, BBox] = {}
+        cells: Dict[Tuple[int, int], List[str]] = {}
+        for city_id, info in city_polygons.items():
+            r = reach.get(city_id, 0.0)
+            bbox = info["bbox"]
+            box = (bbox[0] - r, bbox[1] - r, bbox[2] + r, bbox[3] + r)
+            expanded[city_id] = box
+            for cell in bbox_cells(box, cell_size):
+                cells.setdefault(cell, []).append(city_id)
+        self.partners: Dict[str, List[Tuple[str, BBox]]] = {}
+        for city_id, info in city_polygons.items():
+            bbox = info["bbox"]
+            found: Dict[str, BBox] = {}
+            for cell in bbox_cells(bbox, cell_size):
+                for other in cells.get(cell, ()):
+                    if other == city_id or other in found:
+                        continue
+                    box = expanded[other]
+                    if (
+                        box[0] <= bbox[2]
+                        and bbox[0] <= box[2]
+                        and box[1] <= bbox[3]
+                        and bbox[1] <= box[3]
+                    ):
+                        found[other] = box
+            self.partners[city_id] = list(found.items())
+
+    def lookup(self, point: Point) -> Optional[str]:
+        city_id = self.city
+        if city_id is None:
+            return None
+        x, y = point
+        bbox = self.city_polygons[city_id]["bbox"]
+        if not (bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]) or not self.covers(
+            city_id, point
+        ):
+            self.misses += 1
+            return None
+        for other, box in self.partners[city_id]:
+            if box[0] <= x <= box[2] and box[1] <= y <= box[3] and self.covers(other, point):
+                self.misses += 1
+                return None
+        self.hits += 1
+        return city_id
+
+    def remember(self, city_id: Optional[str]) -> None:
+        self.city = city_id
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Last-hit cache: {self.hits}/{total} hits ({rate:.0%})"
+
+
+def bbox_cells(bbox: BBox, cell_size: float):
+    for cy in range(math.floor(bbox[1] / cell_size), math.floor(bbox[3] / cell_size) + 1):
+        for cx in range(math.floor(bbox[0] / cell_size), math.floor(bbox[2] / cell_size) + 1):
+            yield (cy, cx)
@@ -0,0 +1,388 @@
+import gzip
+import json
+import math
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from boundary_topology import QUANT, RingGroups, build_topology, ring_points, simplify_arc
+from output_manifest import replace_output
+
+TilePoint = Tuple[float, float]
+
+EXTENT = 4096
+BUFFER = 64
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+POLYGON = 3
+# Column bands each zoom is split into per worker, so the tiles of the
+# deep zooms spread over every process.
+BANDS_PER_WORKER = 4
+
+# Topology, feature bounds and the last zoom's simplified arcs, set once
+# per worker process by init_render.
+_render: Dict[str, Any] = {}
+
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def field_varint(number: int, value: int) -> bytes:
+    return varint(number << 3) + varint(value)
+
+
+def field_bytes(number: int, data: bytes) -> bytes:
+    return varint((number << 3) | 2) + varint(len(data)) + data
+
+
+def field_packed(number: int, values: Sequence[int]) -> bytes:
+    return field_bytes(number, b"".join(varint(v) for v in values))
+
+
+def project(lon: float, lat: float, zoom: int) -> TilePoint:
+    # Web Mercator, in tile units at this zoom.
+    n = 2.0**zoom
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    rad = math.radians(lat)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def clip_ring(
+    ring: List[TilePoint], lo: float, hi: float, axes: Sequence[int] = (0, 1)
+) -> List[TilePoint]:
+    # Sutherland-Hodgman against the buffered tile square (or, with one
+    # axis, the strip between lo and hi).
+    out = ring
+    for axis in axes:
+        for bound, keep_above in ((lo, True), (hi, False)):
+            if not out:
+                return []
+            points, out = out, []
+            prev = points[-1]
+            prev_in = prev[axis] >= bound if keep_above else prev[axis] <= bound
+            for cur in points:
+                cur_in = cur[axis] >= bound if keep_above else cur[axis] <= bound
+                if cur_in != prev_in:
+                    t = (bound - prev[axis]) / (cur[axis] - prev[axis])
+                    cross = (
+                        prev[0] + t * (cur[0] - prev[0]),
+                        prev[1] + t * (cur[1] - prev[1]),
+                    )
+                    out.append(cross)
+                if cur_in:
+                    out.append(cur)
+                prev, prev_in = cur, cur_in
+    return out
+
+
+def signed_area(ring: Sequence[Tuple[int, int]]) -> int:
+    total = 0
+    n = len(ring)
+    for i in range(n):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % n]
+        total += x1 * y2 - x2 * y1
+    return total
+
+
+def encode_geometry(polygons: List[List[List[Tuple[int, int]]]]) -> List[int]:
+    commands: List[int] = []
+    cx = cy = 0
+    for rings in polygons:
+        for i, ring in enumerate(rings):
+            # Exterior rings must have positive area in tile coordinates,
+            # interior rings negative.
+            area = signed_area(ring)
+            if (i == 0 and area < 0) or (i > 0 and area > 0):
+                ring = ring[::-1]
+            commands.append((MOVE_TO & 0x7) | (1 << 3))
+            x, y = ring[0]
+            commands.extend((zigzag(x - cx), zigzag(y - cy)))
+            cx, cy = x, y
+            commands.append((LINE_TO & 0x7) | ((len(ring) - 1) << 3))
+            for x, y in ring[1:]:
+                commands.extend((zigzag(x - cx), zigzag(y - cy)))
+                cx, cy = x, y
+            commands.append((CLOSE_PATH & 0x7) | (1 << 3))
+    return commands
+
+
+def tile_polygons(
+    polygons: List[List[List[TilePoint]]], tx: int, ty: int
+) -> List[List[List[Tuple[int, int]]]]:
+    lo = -BUFFER
+    hi = EXTENT + BUFFER
+    out = []
+    for rings in polygons:
+        tile_rings = []
+        for ring_index, ring in enumerate(rings):
+            local = [((x - tx) * EXTENT, (y - ty) * EXTENT) for x, y in ring]
+            xs = [p[0] for p in local]
+            ys = [p[1] for p in local]
+            if min(xs) < lo or max(xs) > hi or min(ys) < lo or max(ys) > hi:
+                local = clip_ring(local, lo, hi)
+            ints: List[Tuple[int, int]] = []
+            for x, y in local:
+                pt = (round(x), round(y))
+                if not ints or ints[-1] != pt:
+                    ints.append(pt)
+            if len(ints) > 1 and ints[0] == ints[-1]:
+                ints.pop()
+            if len(ints) < 3 or signed_area(ints) == 0:
+                if ring_index == 0:
+                    break
+                continue
+            tile_rings.append(ints)
+        if tile_rings:
+            out.append(tile_rings)
+    return out
+
+
+def encode_layer(name: str, features: List[Tuple[dict, List[int]]]) -> bytes:
+    keys: Dict[str, int] = {}
+    values: Dict[str, int] = {}
+    encoded_features = []
+    for props, geometry in features:
+        tags = []
+        for key, value in props.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(str(value), len(values)))
+        encoded_features.append(
+            field_packed(2, tags) + field_varint(3, POLYGON) + field_packed(4, geometry)
+        )
+    data = field_varint(15, 2) + field_bytes(1, name.encode("utf-8"))
+    for feature in encoded_features:
+        data += field_bytes(2, feature)
+    for key in keys:
+        data += field_bytes(3, key.encode("utf-8"))
+    for value in values:
+        data += field_bytes(4, field_bytes(1, value.encode("utf-8")))
+    data += field_varint(5, EXTENT)
+    return data
+
+
+def clip_columns(
+    polygons: List[List[List[TilePoint]]], lo: float, hi: float
+) -> List[List[List[TilePoint]]]:
+    # A feature clipped once to a buffered column of tiles; tile_polygons
+    # then only cuts the rows. Same x-then-y order as clipping each tile
+    # whole.
+    out = []
+    for rings in polygons:
+        strip_rings = []
+        for ring_index, ring in enumerate(rings):
+            xs = [p[0] for p in ring]
+            if min(xs) < lo or max(xs) > hi:
+                ring = clip_ring(ring, lo, hi, axes=(0,))
+            if len(ring) < 3:
+                if ring_index == 0:
+                    break
+                continue
+            strip_rings.append(ring)
+        if strip_rings:
+            out.append(strip_rings)
+    return out
+
+
+def feature_bounds(feature: dict, arcs: List[List[Tuple[int, int]]]) -> Optional[Tuple]:
+    points = [pt for rings in feature["arcs"] for pt in ring_points(rings[0], arcs)]
+    if not points:
+        return None
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def init_render(arcs: List[List[Tuple[int, int]]], objects: Dict[str, List[dict]]) -> None:
+    _render.clear()
+    _render["arcs"] = arcs
+    _render["objects"] = objects
+    # Simplified rings keep a subset of the arc points, so these bounds
+    # hold them at every zoom.
+    _render["bounds"] = {
+        layer: [feature_bounds(feature, arcs) for feature in features]
+        for layer, features in objects.items()
+    }
+
+
+def simplified_arcs(zoom: int) -> List[List[Tuple[int, int]]]:
+    if _render.get("zoom") != zoom:
+        # Simplify to about half a 256px screen pixel at this zoom.
+        tolerance = 360.0 / (2**zoom) / 512.0 * QUANT
+        _render["simplified"] = [simplify_arc(arc, tolerance) for arc in _render["arcs"]]
+        _render["zoom"] = zoom
+    return _render["simplified"]
+
+
+def tile_columns(min_lon: float, max_lon: float, zoom: int) -> Tuple[int, int]:
+    # Buffered tile columns a longitude range touches.
+    margin = BUFFER / EXTENT
+    left, _ = project(min_lon, 0.0, zoom)
+    right, _ = project(max_lon, 0.0, zoom)
+    return int(math.floor(left - margin)), int(math.floor(right + margin))
+
+
+def render_band(task: Tuple[int, int, int]) -> List[Tuple[int, int, int, bytes]]:
+    # One column band of one zoom.
+    zoom, col_lo, col_hi = task
+    simplified = simplified_arcs(zoom)
+    limit = 2**zoom
+    tiles: Dict[Tuple[int, int], Dict[str, List[Tuple[dict, List[int]]]]] = {}
+    # Ids already in each (tile, layer): a feature is encoded once per tile
+    # even if the layer input repeats it.
+    seen: Dict[Tuple[int, int, str], Set[str]] = {}
+    margin = BUFFER / EXTENT
+    for layer, features in _render["objects"].items():
+        for feature, box in zip(features, _render["bounds"][layer]):
+            if box is None:
+                continue
+            first_col, last_col = tile_columns(box[0] / QUANT, box[2] / QUANT, zoom)
+            if last_col < col_lo or first_col >= col_hi:
+                continue
+            polygons = []
+            for rings in feature["arcs"]:
+                projected = [
+                    [project(x / QUANT, y / QUANT, zoom) for x, y in ring_points(refs, simplified)]
+                    for refs in rings
+                ]
+                polygons.append(projected)
+            points = [pt for rings in polygons for pt in rings[0]]
+            if not points:
+                continue
+            min_tx = max(int(math.floor(min(p[0] for p in points) - margin)), col_lo)
+            max_tx = min(int(math.floor(max(p[0] for p in points) + margin)), col_hi - 1)
+            min_ty = max(int(math.floor(min(p[1] for p in points) - margin)), 0)
+            max_ty = min(int(math.floor(max(p[1] for p in points) + margin)), limit - 1)
+            for tx in range(min_tx, max_tx + 1):
+                strip = clip_columns(polygons, tx - margin, tx + 1 + margin)
+                if not strip:
+                    continue
+                for ty in range(min_ty, max_ty + 1):
+                    ids = seen.setdefault((tx, ty, layer), set())
+                    if feature["id"] in ids:
+                        continue
+                    clipped = tile_polygons(strip, tx, ty)
+                    if not clipped:
+                        continue
+                    ids.add(feature["id"])
+                    props = {"id": feature["id"], **feature["properties"]}
+                    layers = tiles.setdefault((tx, ty), {})
+                    layers.setdefault(layer, []).append((props, encode_geometry(clipped)))
+
+    out = []
+    for (tx, ty), layers in tiles.items():
+        data = b"".join(
+            field_bytes(3, encode_layer(name, features)) for name, features in sorted(layers.items())
+        )
+        # MBTiles rows are TMS (y flipped); pbf tiles are stored gzipped.
+        out.append((zoom, tx, limit - 1 - ty, gzip.compress(data, mtime=0)))
+    return out
+
+
+def band_tasks(
+    bounds: List[float], min_zoom: int, max_zoom: int, workers: int
+) -> List[Tuple[int, int, int]]:
+    # (zoom, first column, end column) over the columns the data touches.
+    tasks = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        first, last = tile_columns(bounds[0], bounds[2], zoom)
+        first, last = max(first, 0), min(last, 2**zoom - 1)
+        rows = last - first + 1
+        if rows <= 0:
+            continue
+        step = -(-rows // min(rows, BANDS_PER_WORKER * workers))
+        tasks.extend((zoom, lo, min(lo + step, last + 1)) for lo in range(first, last + 1, step))
+    return tasks
+
+
+def write_mbtiles(
+    path: Path,
+    layers: Dict[str, List[Tuple[str, dict, RingGroups]]],
+    min_zoom: int,
+    max_zoom: int,
+    workers: Optional[int] = None,
+) -> Tuple[int, bool]:
+    arcs, objects = build_topology(layers)
+
+    xs = [x / QUANT for arc in arcs for x, _ in arc]
+    ys = [y / QUANT for arc in arcs for _, y in arc]
+    bounds = [min(xs), min(ys), max(xs), max(ys)] if xs else [-180, -85, 180, 85]
+    tasks = band_tasks(bounds, min_zoom, max_zoom, workers or os.cpu_count() or 1)
+    fields: Dict[str, Dict[str, str]] = {}
+    for name, features in layers.items():
+        layer_fields = fields.setdefault(name, {"id": "String"})
+        for _, props, _ in features:
+            layer_fields.update({key: "String" for key in props})
+    metadata = {
+        "name": path.stem,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": ",".join(f"{v:.6f}" for v in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom}",
+        "json": json.dumps(
+            {
+                "vector_layers": [
+                    {"id": name, "fields": fields[name], "minzoom": min_zoom, "maxzoom": max_zoom}
+                    for name in sorted(layers)
+                ]
+            }
+        ),
+    }
+
+    # Built in a temp file that only replaces the old tiles when its bytes
+    # differ, like the JSON outputs.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    conn = sqlite3.connect(str(tmp_path))
+    total = 0
+    try:
+        conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        conn.execute(
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB)"
+        )
+        conn.execute(
+            "CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)"
+        )
+        conn.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_render, initargs=(arcs, objects)
+        ) as pool:
+            results = zip(tasks, pool.map(render_band, tasks))
+            # Bands come back in task order; each zoom is inserted in tile
+            # (column, then row) order.
+            for _, bands in groupby(results, key=lambda item: item[0][0]):
+                rows = sorted(
+                    (row for _, band in bands for row in band), key=lambda r: (r[1], -r[2])
+                )
+                conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+                total += len(rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return total, replace_output(path, tmp_path)
@@ -0,0 +1,89 @@
+// supabase/functions/_tests/locations.test.ts
+
+/**
+ * Tests para la búsqueda de la edge function locations
+ * Valida las claves de búsqueda frente a las que genera scripts/build_search_index.py
+ */
+
+import { TestRunner, TestAssertions } from './test-utils.ts';
+import {
+  MAX_PREFIX,
+  normalizeName,
+  prefixKey,
+  searchKeys,
+} from '../locations/search.ts';
+
+const runner = new TestRunner();
+
+// Claves de search_entry("city", ..., "Villanueva de la Cañada", 2, 12)
+const INDEX_KEYS = new Set([
+  'p:vi', 'p:vil', 'p:vill', 'p:villa', 'p:villan', 'p:villanu', 'p:villanue',
+  'p:villanuev', 'p:villanueva', 'p:villanueva d', 'p:de', 'p:de l', 'p:de la',
+  'p:de la c', 'p:de la ca', 'p:de la can', 'p:de la cana', 'p:de la canad',
+  'p:de la canada', 'p:la', 'p:la c', 'p:la ca', 'p:la can', 'p:la cana',
+  'p:la canad', 'p:la canada', 'p:ca', 'p:can', 'p:cana', 'p:canad', 'p:canada',
+  't: vi', 't:vil', 't:ill', 't:lla', 't:lan', 't:anu', 't:nue', 't:uev', 't:eva',
+  't:va ', 't: de', 't:de ', 't: la', 't:la ', 't: ca', 't:can', 't:ana', 't:nad',
+  't:ada', 't:da ',
+]);
+const INDEX_NAME_NORM = 'villanueva de la canada';
+
+// Lo que hacen search_location_ids (todas las claves) y el filtro strpos
+const matches = (query: string) => {
+  const norm = normalizeName(query);
+  return searchKeys(norm).every((key) => INDEX_KEYS.has(key)) &&
+    INDEX_NAME_NORM.includes(norm);
+};
+
+// ====================
+// TESTS DE NORMALIZACIÓN
+// ====================
+
+runner.test('locations: normalizeName coincide con normalize_name', () => {
+  TestAssertions.assertEquals(normalizeName('  Vitoria-Gasteiz '), 'vitoria gasteiz');
+  TestAssertions.assertEquals(normalizeName('Donostia / San Sebastián'), 'donostia san sebastian');
+  TestAssertions.assertEquals(normalizeName('Villanueva de la Cañada'), INDEX_NAME_NORM);
+});
+
+// ====================
+// TESTS DE CLAVES
+// ====================
+
+runner.test('locations: consulta más larga que MAX_PREFIX usa trigramas', () => {
+  const norm = normalizeName('Villanueva de la Cañada');
+  TestAssertions.assertTrue(norm.length > MAX_PREFIX, 'La consulta debe superar MAX_PREFIX');
+
+  const keys = searchKeys(norm);
+  TestAssertions.assertFalse(keys.includes(prefixKey(norm)), 'No debe usar la clave de prefijo');
+  TestAssertions.assertTrue(keys.every((key) => key.startsWith('t:')), 'Solo claves t:');
+  TestAssertions.assertTrue(matches('Villanueva de la Cañada'), 'Debe encontrar el nombre completo');
+  TestAssertions.assertTrue(matches('villanueva de la canada'), 'Sin acentos también');
+});
+
+runner.test('locations: consulta larga que no está en el nombre no coincide', () => {
+  TestAssertions.assertFalse(matches('Villanueva de la Cañadilla'), 'No debe coincidir');
+  TestAssertions.assertFalse(matches('Villanueva del Pardillo'), 'No debe coincidir');
+});
+
+runner.test('locations: consulta a mitad de palabra coincide', () => {
+  TestAssertions.assertTrue(matches('nueva'), 'nueva está dentro de villanueva');
+  TestAssertions.assertTrue(matches('anueva de la ca'), 'Cruza palabras a mitad');
+});
+
+runner.test('locations: consulta sin palabras de 3 letras usa la clave de prefijo', () => {
+  TestAssertions.assertEquals(searchKeys('de').join(','), 'p:de');
+  TestAssertions.assertEquals(searchKeys('la c').join(','), 'p:la c');
+  TestAssertions.assertTrue(matches('de la c'), 'Prefijo de palabra');
+});
+
+// ====================
+// EJECUTAR TESTS
+// ====================
+
+if (import.meta.main) {
+  console.log('🧪 Running locations tests...\n');
+  const results = await runner.run();
+  const summary = runner.printResults(results);
+
+  Deno.exit(summary.failed > 0 ? 1 : 0);
+}
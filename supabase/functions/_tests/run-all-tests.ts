@@ -83,6 +83,7 @@ async function main() {
     './supabase/functions/_tests/auth-register-phase3.test.ts',
     './supabase/functions/_tests/rooms.test.ts',
     './supabase/functions/_tests/chats.test.ts',
+    './supabase/functions/_tests/locations.test.ts',
   ];
 
   const results: TestFileSummary[] = [];
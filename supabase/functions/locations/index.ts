@@ -2,6 +2,7 @@
 import { serve } from 'https://deno.land/std@0.224.0/http/server.ts';
 import { corsHeaders, handleCORS } from '../_shared/cors.ts';
 import { supabaseAdmin } from '../_shared/supabaseAdmin.ts';
+import { MIN_PREFIX, normalizeName, searchKeys } from './search.ts';
 
 const jsonResponse = (body: unknown, status = 200) =>
   new Response(JSON.stringify(body), {
@@ -9,6 +10,8 @@ const jsonResponse = (body: unknown, status = 200) =>
     headers: { ...corsHeaders, 'Content-Type': 'application/json' },
   });
 
+const shortQueryHint = { hint: `Query must be at least ${MIN_PREFIX} chars.` };
+
 serve(async (req) => {
   const cors = handleCORS(req);
   if (cors) return cors;
@@ -116,17 +119,22 @@ serve(async (req) => {
         return jsonResponse({ data, meta: { limit, offset } });
       }
 
-      let dbQuery = supabaseAdmin
-        .from('cities')
+      const norm = query ? normalizeName(query) : '';
+      if (query && norm.length < MIN_PREFIX) {
+        return jsonResponse({ data: [], meta: shortQueryHint });
+      }
+
+      let dbQuery = (
+        norm
+          ? supabaseAdmin.rpc('search_cities', { p_keys: searchKeys(norm), p_norm: norm })
+          : supabaseAdmin.from('cities')
+      )
         .select('id,name,ref_ine,ine_municipio,wikidata,wikipedia,centroid,bbox')
         .order('name', { ascending: true });
 
       if (id) {
         dbQuery = dbQuery.eq('id', id);
       }
-      if (query) {
-        dbQuery = dbQuery.ilike('name', `%${query}%`);
-      }
       dbQuery = dbQuery.range(offset, offset + limit - 1);
 
       const { data, error } = await dbQuery;
@@ -145,12 +153,9 @@ serve(async (req) => {
       const limitParam = url.searchParams.get('limit');
       const offsetParam = url.searchParams.get('offset');
 
-      const minQueryLen = 2;
-      if (query && query.length < minQueryLen) {
-        return jsonResponse({
-          data: [],
-          meta: { hint: `Query must be at least ${minQueryLen} chars.` },
-        });
+      const norm = query ? normalizeName(query) : '';
+      if (query && norm.length < MIN_PREFIX) {
+        return jsonResponse({ data: [], meta: shortQueryHint });
       }
 
       let limit = parseIntParam(limitParam, top ? 20 : 50);
@@ -158,8 +163,15 @@ serve(async (req) => {
       limit = Math.max(1, Math.min(limit, 200));
       offset = Math.max(0, offset);
 
-      let dbQuery = supabaseAdmin
-        .from('city_places_with_counts')
+      let dbQuery = (
+        norm
+          ? supabaseAdmin.rpc('search_city_places', {
+              p_city_id: cityId,
+              p_keys: searchKeys(norm),
+              p_norm: norm,
+            })
+          : supabaseAdmin.from('city_places_with_counts')
+      )
         .select(
           'id,city_id,name,place,admin_level,ref_ine,wikidata,wikipedia,centroid,bbox,search_count'
         )
@@ -168,9 +180,6 @@ serve(async (req) => {
       if (place) {
         dbQuery = dbQuery.eq('place', place);
       }
-      if (query) {
-        dbQuery = dbQuery.ilike('name', `%${query}%`);
-      }
       if (top) {
         dbQuery = dbQuery.order('search_count', { ascending: false });
       } else {
@@ -0,0 +1,47 @@
+// supabase/functions/locations/search.ts
+
+/**
+ * Query side of the location search keys built by
+ * scripts/build_search_index.py and stored in location_search_keys.
+ * normalizeName mirrors normalize_name in scripts/normalize_areas.py.
+ */
+
+// --min-prefix and --max-prefix defaults of build_search_index.py
+export const MIN_PREFIX = 2;
+export const MAX_PREFIX = 12;
+
+export const normalizeName = (value: string) =>
+  value
+    .trim()
+    .toLowerCase()
+    .normalize('NFKD')
+    .replace(/\p{M}/gu, '')
+    .replace(/[^\p{L}\p{N}_\s-]/gu, ' ')
+    .replace(/-/g, ' ')
+    .replace(/\s+/g, ' ')
+    .trim();
+
+// "p:" key of the query: a name has it when one of its words starts with
+// the first MAX_PREFIX characters of the query.
+export const prefixKey = (norm: string) => `p:${norm.slice(0, MAX_PREFIX).trimEnd()}`;
+
+// Unpadded trigrams of every query word of 3+ characters. The build emits
+// the trigrams of each name word padded with spaces, which include these
+// whenever the query occurs in the name, mid-word or not.
+export const trigramKeys = (norm: string) => {
+  const keys = new Set<string>();
+  for (const word of norm.split(' ')) {
+    for (let i = 0; i + 3 <= word.length; i++) {
+      keys.add(`t:${word.slice(i, i + 3)}`);
+    }
+  }
+  return [...keys];
+};
+
+// Keys every match must hold; the SQL search functions then keep the
+// names that contain the whole normalized query. Queries without a word
+// of 3+ characters fall back to their prefix key.
+export const searchKeys = (norm: string) => {
+  const trigrams = trigramKeys(norm);
+  return trigrams.length > 0 ? trigrams : [prefixKey(norm)];
+};
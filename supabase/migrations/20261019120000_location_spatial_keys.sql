@@ -0,0 +1,23 @@
+-- Columns sent by scripts/import_locations.py since the exports gained
+-- geohash spatial keys (extract_geojson / extract_places --geohash-precision)
+-- and the level 9/10 area chain of each place (extract_places).
+
+alter table public.cities
+  add column if not exists geohash text,
+  add column if not exists bbox_geohash text;
+
+alter table public.city_places
+  add column if not exists geohash text,
+  add column if not exists bbox_geohash text,
+  add column if not exists area9_id text,
+  add column if not exists area10_id text;
+
+-- Proximity queries are geohash prefix matches (geohash like 'ezjmg%').
+create index if not exists cities_geohash_idx
+  on public.cities (geohash text_pattern_ops);
+create index if not exists city_places_geohash_idx
+  on public.city_places (geohash text_pattern_ops);
+create index if not exists city_places_area9_id_idx
+  on public.city_places (area9_id);
+create index if not exists city_places_area10_id_idx
+  on public.city_places (area10_id);
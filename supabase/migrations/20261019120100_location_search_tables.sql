@@ -0,0 +1,113 @@
+-- Tables filled by scripts/import_locations.py (--search-index, --neighbours,
+-- --gazetteer). Primary keys match the importer's on_conflict targets.
+
+-- One row per search key of a city or place (build_search_index.py):
+-- "p:<prefix>" for prefixes of the normalized name and of each word tail,
+-- "t:<trigram>" for the trigrams of each word padded with spaces.
+-- name_norm is lower-cased, accent-free.
+create table if not exists public.location_search_keys (
+  key text not null,
+  kind text not null check (kind in ('city', 'place')),
+  entity_id text not null,
+  city_id text,
+  name_norm text not null,
+  primary key (key, kind, entity_id)
+);
+
+-- Place search is always scoped to one city.
+create index if not exists location_search_keys_city_key_idx
+  on public.location_search_keys (kind, city_id, key);
+
+create table if not exists public.place_neighbours (
+  place_id text not null,
+  neighbour_id text not null,
+  distance_km double precision not null,
+  rank integer not null,
+  primary key (place_id, neighbour_id)
+);
+
+create table if not exists public.city_neighbours (
+  city_id text not null,
+  neighbour_id text not null,
+  primary key (city_id, neighbour_id)
+);
+
+create table if not exists public.location_gazetteer (
+  id text primary key,
+  city_id text,
+  name text,
+  place text,
+  admin_level text,
+  ref_ine text,
+  wikidata text,
+  wikipedia text,
+  population text,
+  population_date text,
+  name_es text,
+  name_eu text,
+  centroid jsonb,
+  bbox jsonb,
+  area9_id text,
+  area10_id text,
+  geohash text,
+  bbox_geohash text,
+  area_id text,
+  place_id text,
+  sources text[],
+  match_km double precision
+);
+
+create index if not exists location_gazetteer_city_id_idx
+  on public.location_gazetteer (city_id);
+create index if not exists location_gazetteer_geohash_idx
+  on public.location_gazetteer (geohash text_pattern_ops);
+
+-- Name search through the key table. p_keys come from
+-- supabase/functions/locations/search.ts: the unpadded trigrams of the
+-- query's words of 3+ characters (any query length, mid-word included),
+-- else its "p:" prefix key. Entities holding every key are candidates, and
+-- p_norm, the whole normalized query, must occur in their name_norm, as
+-- the ilike '%q%' search it replaces did.
+drop function if exists public.search_cities(text, text);
+drop function if exists public.search_city_places(text, text, text);
+
+create or replace function public.search_location_ids(
+  p_kind text,
+  p_keys text[],
+  p_norm text,
+  p_city_id text default null
+)
+returns setof text
+language sql
+stable
+as $$
+  select k.entity_id
+  from public.location_search_keys k
+  where k.kind = p_kind
+    and k.key = any (p_keys)
+    and (p_city_id is null or k.city_id = p_city_id)
+  group by k.entity_id
+  having count(distinct k.key) = (select count(distinct key) from unnest(p_keys) key)
+    and strpos(min(k.name_norm), p_norm) > 0
+$$;
+
+create or replace function public.search_cities(p_keys text[], p_norm text)
+returns setof public.cities
+language sql
+stable
+as $$
+  select c.*
+  from public.cities c
+  where c.id in (select public.search_location_ids('city', p_keys, p_norm))
+$$;
+
+create or replace function public.search_city_places(p_city_id text, p_keys text[], p_norm text)
+returns setof public.city_places_with_counts
+language sql
+stable
+as $$
+  select p.*
+  from public.city_places_with_counts p
+  where p.city_id = p_city_id
+    and p.id in (select public.search_location_ids('place', p_keys, p_norm, p_city_id))
+$$;